@@ -0,0 +1,257 @@
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+from time import perf_counter, time
+from typing import Callable, Dict
+
+from bs4 import BeautifulSoup
+
+from lib import Client, get_args
+from lib.emulator import EmulatedSwitch, EmulatorServer, _vlan_page, start_emulator
+from lib.exporter import MetricsCollector
+from lib.snapshot import take_snapshot
+from lib.vlan import ModeVLAN
+from lib.vlan.set_vlans import set_vlans
+from lib.vlan.get_vlans import get_vlan_info
+from lib.vlan.helper_functions import _get_port_2_vlan_mapping_from_html_code, _get_vlans_from_html_code
+from lib.vlan.page_parser import parse_vlan_page
+
+ZONED_VLANS = {
+    1000: {"name": "Zone00", "ports_access": {1: "untagged", 2: "untagged", 3: "untagged", 4: "untagged", 15: "tagged"}},
+    1001: {"name": "Zone01", "ports_access": {5: "untagged", 6: "untagged", 7: "untagged", 8: "untagged", 15: "tagged"}},
+    1002: {"name": "Zone02", "ports_access": {9: "untagged", 10: "untagged", 11: "untagged", 12: "untagged", 15: "tagged"}},
+}
+
+RE_ZONED_VLANS = {
+    1000: {"name": "Zone00", "ports_access": {1: "untagged", 2: "untagged", 15: "tagged"}},
+    1001: {"name": "Zone01", "ports_access": {3: "untagged", 4: "untagged", 5: "untagged", 15: "tagged"}},
+    1003: {"name": "Zone03", "ports_access": {6: "untagged", 7: "untagged", 8: "untagged", 15: "tagged"}},
+}
+
+# The modules the short commands must not import, the budget check fails if they do
+SLOW_IMPORTS = ["asyncio", "bs4", "lib.firmware", "lib.vlan.cmds", "lib.daemon"]
+IMPORT_COMMANDS = {
+    "poe": (["poe", "--reset", "1"], "lib.poe"),
+    "mirror-port": (["mirror-port", "--disable"], "lib.mirror_port"),
+}
+_IMPORT_SCRIPT = """
+import json, sys
+from importlib import import_module
+from time import perf_counter
+before = set(sys.modules)
+time_start = perf_counter()
+from lib import get_args
+get_args(["--host", "127.0.0.1", "--password", "password"] + json.loads(sys.argv[1]))
+import_module("lib.client")
+import_module(sys.argv[2])
+print(json.dumps({"import_time_sec": perf_counter() - time_start,
+                  "modules": sorted(set(sys.modules) - before)}))
+"""
+
+
+def _new_client(server: EmulatorServer, password: str) -> Client:
+    client = Client(host=server.host, port=server.port)
+    client._token_store.clear()
+    client.login(password=password)
+    return client
+
+
+def _measure(server: EmulatorServer, func: Callable[[], object], rounds: int) -> Dict[str, float]:
+    wall_times = []
+    requests_count = bytes_count = 0
+    for _ in range(rounds):
+        server.switch.reset_stats()
+        time_start = time()
+        func()
+        wall_times.append(time() - time_start)
+        requests_count = sum(server.switch.stats_requests.values())
+        bytes_count = sum(server.switch.stats_bytes.values())
+
+    return {
+        "requests": requests_count,
+        "bytes": bytes_count,
+        "wall_time_sec": min(wall_times),
+    }
+
+
+def run_benchmarks(latency: float, rounds: int) -> Dict[str, Dict[str, float]]:
+    password = "password"
+    server = start_emulator(password=password, latency=latency)
+    try:
+        client = _new_client(server, password)
+
+        def reset_switch():
+            with server.switch.lock:
+                server.switch.reset_vlans()
+            client.invalidate_pages()
+
+        def get_vlan_info_cold():
+            client.invalidate_pages()
+            get_vlan_info(client)
+
+        def set_vlans_unchanged():
+            client.invalidate_pages()
+            set_vlans(client=client, vlans=ZONED_VLANS)
+
+        def set_vlans_from_default():
+            reset_switch()
+            set_vlans(client=client, vlans=ZONED_VLANS)
+
+        def set_vlans_re_zone():
+            reset_switch()
+            set_vlans(client=client, vlans=ZONED_VLANS)
+            server.switch.reset_stats()
+            client.invalidate_pages()
+            set_vlans(client=client, vlans=RE_ZONED_VLANS)
+
+        results = {
+            "get_vlan_info": _measure(server, get_vlan_info_cold, rounds),
+            "set_vlans_from_default": _measure(server, set_vlans_from_default, rounds),
+            "set_vlans_unchanged": _measure(server, set_vlans_unchanged, rounds),
+        }
+
+        # Only the second set_vlans call is counted, the wall time includes both
+        results["set_vlans_re_zone"] = _measure(server, set_vlans_re_zone, 1)
+
+        def snapshot_cold():
+            client.invalidate_pages()
+            take_snapshot(client)
+
+        # The four pages are fetched at the same time, so the wall time is about one round trip
+        results["snapshot"] = _measure(server, snapshot_cold, rounds)
+
+        # A new login replaces the session of the client above, so it is measured last
+        results["login"] = _measure(server, lambda: _new_client(server, password), rounds)
+
+        # Ten scrapes within the cache TTL, only the first one may reach the switch
+        args = get_args(["--host", f"{server.host}:{server.port}", "--password", password, "exporter"])
+        collector = MetricsCollector(args, hosts=args.hosts, cache_ttl_sec=60)
+        results["exporter_scrapes"] = _measure(server, lambda: [collector.collect() for _ in range(10)], 1)
+        return results
+    finally:
+        server.shutdown()
+
+
+def _parse_with_bs4(html: str):
+    # The way vlan.html was parsed before: one BeautifulSoup tree for each of the mode, VLANs and PVIDs
+    bs = BeautifulSoup(html, 'html.parser')
+    mode = ModeVLAN(bs.find("span", attrs={"class": "status-text"}).parent.get("vlanmode"))
+    return mode, _get_vlans_from_html_code(html), _get_port_2_vlan_mapping_from_html_code(html)
+
+
+def run_parse_benchmarks(vlan_count: int, iterations: int) -> Dict[str, float]:
+    switch = EmulatedSwitch()
+    for index in range(vlan_count - 1):
+        members = "".join("2" if port_no % vlan_count == index else "1" if index % 2 else "3" for port_no in range(16))
+        switch.vlans[100 + index] = [f"vlan{100 + index}", members]
+    html = _vlan_page(switch)
+
+    page = parse_vlan_page(html)
+    if (page.mode, page.vlans, page.port2vlan) != _parse_with_bs4(html):
+        raise Exception("The single pass parser and the BeautifulSoup functions do not agree")
+
+    results = {}
+    for name, func in [("bs4_functions", _parse_with_bs4), ("single_pass", parse_vlan_page)]:
+        time_start = perf_counter()
+        for _ in range(iterations):
+            func(html)
+        results[name] = (perf_counter() - time_start) / iterations
+    return results
+
+
+def run_import_benchmarks(rounds: int) -> Dict[str, Dict[str, object]]:
+    # Every round is a new interpreter, otherwise the modules would be imported already
+    results = {}
+    for name, (argv, module) in IMPORT_COMMANDS.items():
+        import_times = []
+        modules = []
+        for _ in range(rounds):
+            output = subprocess.run([sys.executable, "-c", _IMPORT_SCRIPT, json.dumps(argv), module],
+                                    cwd=Path(__file__).parent, check=True, capture_output=True, text=True).stdout
+            result = json.loads(output)
+            import_times.append(result["import_time_sec"])
+            modules = result["modules"]
+        results[name] = {
+            "import_time_sec": min(import_times),
+            "slow_imports": [module for module in SLOW_IMPORTS if module in modules],
+        }
+    return results
+
+
+def _check_import_budget(results: Dict[str, Dict[str, object]], budget_sec: float) -> int:
+    print(f"\n{'Command':<24} | {'Imports':>10} | Slow imports")
+    exit_code = 0
+    for name, result in results.items():
+        print(f"{name:<24} | {result['import_time_sec'] * 1000:>7.1f} ms | {', '.join(result['slow_imports']) or '-'}")
+        if result["import_time_sec"] > budget_sec or result["slow_imports"]:
+            print(f"OVER BUDGET: `{name}` takes {result['import_time_sec'] * 1000:.1f} ms to import, "
+                  f"the budget is {budget_sec * 1000:.0f} ms")
+            exit_code = 1
+    return exit_code
+
+
+def _print_parse_results(results: Dict[str, float], vlan_count: int):
+    print(f"\nParsing vlan.html with {vlan_count} VLANs")
+    for name, sec_per_call in results.items():
+        print(f"{name:<24} | {sec_per_call * 1000:>8.2f} ms | "
+              f"{results['bs4_functions'] / sec_per_call:>5.1f}x")
+
+
+def _print_results(results: Dict[str, Dict[str, float]]):
+    print(f"{'Benchmark':<24} | {'Requests':>8} | {'Bytes':>10} | {'Wall time':>10}")
+    print(f"{'-' * 24}-|-{'-' * 8}-|-{'-' * 10}-|-{'-' * 10}")
+    for name, result in results.items():
+        print(f"{name:<24} | {result['requests']:>8} | {result['bytes']:>10} | {result['wall_time_sec']:>9.3f}s")
+
+
+def _compare(results: Dict[str, Dict[str, float]], baseline_path: str) -> int:
+    baseline = json.loads(Path(baseline_path).read_text())
+    exit_code = 0
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        if result["requests"] > baseline[name]["requests"]:
+            print(f"REGRESSION: `{name}` uses {result['requests']} requests, "
+                  f"the baseline is {baseline[name]['requests']}")
+            exit_code = 1
+    return exit_code
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="Netgear Switch (GS316EP) Manager - Benchmark")
+    parser.add_argument("--latency", dest="latency", type=float, default=0.02,
+                        help="Seconds the emulated switch waits before answering each request")
+    parser.add_argument("--rounds", dest="rounds", type=int, default=3,
+                        help="The number of times each benchmark is run, the fastest run is reported")
+    parser.add_argument("--parse-vlans", dest="parse_vlans", type=int, default=64,
+                        help="The number of VLANs on the page used for the parse benchmark")
+    parser.add_argument("--parse-iterations", dest="parse_iterations", type=int, default=50,
+                        help="The number of times the page is parsed in the parse benchmark")
+    parser.add_argument("--import-budget", dest="import_budget", type=float, default=0.25,
+                        help="Fail if the imports of the poe or mirror-port command take longer (seconds) "
+                             "or pull in the modules of other commands")
+    parser.add_argument("--save", dest="save", type=str, default=None,
+                        help="Save the results as JSON, which can be used as a baseline")
+    parser.add_argument("--compare", dest="compare", type=str, default=None,
+                        help="Fail if a benchmark uses more requests than in the given baseline")
+    args = parser.parse_args()
+
+    results = run_benchmarks(latency=args.latency, rounds=args.rounds)
+    _print_results(results)
+    _print_parse_results(run_parse_benchmarks(vlan_count=args.parse_vlans, iterations=args.parse_iterations),
+                         vlan_count=args.parse_vlans)
+
+    import_exit_code = _check_import_budget(run_import_benchmarks(rounds=args.rounds), budget_sec=args.import_budget)
+
+    if args.save:
+        Path(args.save).write_text(json.dumps(results, indent=4))
+
+    if args.compare:
+        exit(_compare(results, args.compare) or import_exit_code)
+    exit(import_exit_code)
+
+
+if __name__ == '__main__':
+    main()
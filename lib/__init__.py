@@ -1,2 +1,17 @@
 from .arguments import get_args
-from .client import Client
+
+_LAZY_ATTRIBUTES = {
+    "AsyncClient": ".async_client",
+    "Client": ".client",
+    "run_fleet": ".fleet",
+    "run_fleet_async": ".fleet",
+}
+
+
+def __getattr__(name: str):
+    # Importing requests takes longer than parsing the arguments, so it waits until a client is needed
+    if name in _LAZY_ATTRIBUTES:
+        from importlib import import_module
+        value = globals()[name] = getattr(import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,32 +1,116 @@
 import argparse
+from copy import copy
+from importlib import import_module
+from typing import Callable, List, Type
 
-from .firmware import sub_cmd_update
-from .misc import switch_port_iter
-from .vlan import ModeVLAN, sub_cmd_vlan
-from .poe import sub_cmd_poe
-from .mirror_port import sub_cmd_mirror_port
+from .inventory import load_inventory, parse_host
+from .misc import Once, switch_port_iter
+from .output import OUTPUT_FORMATS
+from .vlan.structs import ModeVLAN
 from os import environ
 
-def get_args() -> argparse.Namespace:
-    parser = argparse.ArgumentParser(prog="Netgear Switch (GS316EP) Manager")
 
-    parser.add_argument("--host", dest="host", type=str, required=True,
-                        default=environ.get("SWITCH_HOST"),
-                        help="The IP or DNS address of the Switch")
+def _lazy_command(module: str, name: str) -> Callable:
+    # The sub-command modules (and requests, bs4, zipfile...) are only imported when the selected
+    # sub-command runs, so a short command does not pay for importing all the others
+    def command(*args, **kwargs):
+        return getattr(import_module(module, __package__), name)(*args, **kwargs)
+    return command
+
+
+def _add_firmware_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--firmware-cache-dir",
+                        dest="firmware_cache_dir", type=str, required=False,
+                        default=environ.get("SWITCH_FIRMWARE_CACHE_DIR"),
+                        help="The directory where downloaded firmware is cached "
+                             "(default: ~/.cache/netgear-gs316ep/firmware)")
+    parser.add_argument("--firmware-dir",
+                        dest="firmware_dir", type=str, required=False,
+                        default=environ.get("SWITCH_FIRMWARE_DIR"),
+                        help="Use the newest firmware (.image or .zip) in this directory "
+                             "instead of looking it up on netgear.com")
+    parser.add_argument("--firmware-metadata-ttl",
+                        dest="firmware_metadata_ttl", type=int, required=False,
+                        default=int(environ.get("SWITCH_FIRMWARE_METADATA_TTL", "3600")),
+                        help="Seconds the latest firmware version from netgear.com is cached")
+
+
+class _RaisingArgumentParser(argparse.ArgumentParser):
+    # A wrong line in a batch script is reported for that line, instead of exiting the process
+    def error(self, message: str):
+        raise Exception(message)
+
+
+def _build_parser(parser_class: Type[argparse.ArgumentParser] = argparse.ArgumentParser) -> argparse.ArgumentParser:
+    parser = parser_class(prog="Netgear Switch (GS316EP) Manager")
+
+    parser.add_argument("--host", dest="hosts", type=str, required=False,
+                        default=None, action="append",
+                        help="The IP or DNS address of the Switch (<HOST>[:<PORT>], an IPv6 address with "
+                             "a port as [<ADDR>]:<PORT>). Can be repeated to run the command against multiple switches")
+    parser.add_argument("--connect-timeout", dest="connect_timeout", type=float, required=False,
+                        default=float(environ.get("SWITCH_CONNECT_TIMEOUT", "5")),
+                        help="Seconds to wait for a connection to the switch")
+    parser.add_argument("--read-timeout", dest="read_timeout", type=float, required=False,
+                        default=float(environ.get("SWITCH_READ_TIMEOUT", "30")),
+                        help="Seconds to wait for the switch to answer a request")
+    parser.add_argument("--retries", dest="retries", type=int, required=False,
+                        default=int(environ.get("SWITCH_RETRIES", "2")),
+                        help="The number of times a failed connection or GET request is retried with backoff")
+    parser.add_argument("--pool-size", dest="pool_size", type=int, required=False,
+                        default=int(environ.get("SWITCH_POOL_SIZE", "4")),
+                        help="The max number of requests in flight to each switch, it is lowered while "
+                             "the switch answers slowly or fails and raised again when it keeps up")
+    parser.add_argument("--inventory", dest="inventory", type=str, required=False,
+                        default=environ.get("SWITCH_INVENTORY"),
+                        help="File with one switch per line (<HOST>[:<PORT>]) to run the command against")
+    parser.add_argument("--workers", dest="workers", type=int, required=False,
+                        default=int(environ.get("SWITCH_WORKERS", "8")),
+                        help="The max number of switches to configure at the same time")
     parser.add_argument("--port", dest="port", type=int, required=False,
                         default=int(environ.get("SWITCH_PORT", "80")),
                         help="The port for the Website on the Switch")
-    parser.add_argument("--password", dest="password", type=str, required=True,
+    parser.add_argument("--password", dest="password", type=str, required=False,
                         default=environ.get("SWITCH_PASSWORD"),
                         help="The password for the Switch")
     parser.add_argument("--proxy-url", dest="proxy_url", type=str, required=False,
                         default=environ.get("SWITCH_PROXY_URL"),
                         help="Enter proxy url if needed. Support for Socks5 and HTTP proxy")
+    parser.add_argument("--daemon-url", dest="daemon_url", type=str, required=False,
+                        default=environ.get("SWITCH_DAEMON_URL"),
+                        help="Run the command in the daemon listening on this URL, "
+                             "which keeps the sessions to the switches warm")
+    parser.add_argument("--daemon-secret-file", dest="daemon_secret_file", type=str, required=False,
+                        default=environ.get("SWITCH_DAEMON_SECRET_FILE"),
+                        help="The file with the secret the daemon requires from the commands it runs "
+                             "(default: ~/.config/netgear-gs316ep/daemon-<PORT>.secret)")
+    parser.add_argument("--trace", dest="trace", type=str, required=False,
+                        default=environ.get("SWITCH_TRACE"),
+                        help="Write a JSON line for every request and parsed page to this file (`-` for stderr) "
+                             "and print the time spent per endpoint when the command is done")
+    parser.add_argument("--output", dest="output", type=str, required=False,
+                        default=environ.get("SWITCH_OUTPUT", "text"), choices=OUTPUT_FORMATS,
+                        help="`json` or `ndjson` write typed records (one per host or step, as it finishes) "
+                             "to stdout and the text for people to stderr")
 
-    sub_command = parser.add_subparsers(title="commands", help="Select Sub-command", required=True)
+    sub_command = parser.add_subparsers(title="commands", dest="command", help="Select Sub-command", required=True)
 
     parser_update = sub_command.add_parser('update', help="Update to the latest firmware")
-    parser_update.set_defaults(func=sub_cmd_update)
+    _add_firmware_arguments(parser_update)
+    parser_update.set_defaults(func=_lazy_command(".firmware", "sub_cmd_update"))
+
+
+    parser_rollout = sub_command.add_parser('rollout', help="Update the firmware of many switches in waves, "
+                                                             "which only start when the previous wave is healthy")
+    _add_firmware_arguments(parser_rollout)
+    parser_rollout.add_argument("--wave-size",
+                                dest="rollout_wave_size", type=int, required=False, default=1,
+                                help="The max number of switches updated at the same time")
+    parser_rollout.add_argument("--reboot-wait",
+                                dest="rollout_reboot_wait", type=int, required=False, default=600,
+                                help="Seconds to wait for a switch to come back after the update, "
+                                     "before the rollout is stopped")
+    parser_rollout.set_defaults(run=_lazy_command(".rollout", "sub_cmd_rollout"))
 
 
     parser_vlan = sub_command.add_parser('vlan', help="Config VLANs")
@@ -43,9 +127,25 @@ def get_args() -> argparse.Namespace:
              "[<VLAN_ID>:<VLAN_NAME>@<PORT_NO>:<tagged|untagged|excluded>[,<PORT_NO>:<tagged|untagged|excluded>]]")
     parser_vlan_group.add_argument("--get",
         dest="vlan_get", type=str, required=False,
-        default="info", choices=["info", "command"],
+        default=None, const="info", nargs="?", choices=["info", "command"],
         help="Get VLAN config from the switch as info or a command line argument")
-    parser_vlan.set_defaults(func=sub_cmd_vlan)
+    parser_vlan.add_argument("--plan",
+        dest="vlan_plan", action="store_true", required=False, default=False,
+        help="Only print the operations --set would send to the switch, without changing anything")
+    parser_vlan.add_argument("--watch",
+        dest="vlan_watch", type=float, required=False, default=None, metavar="SECONDS",
+        help="With --get, poll the VLANs of the switches every SECONDS over one session per switch "
+             "and print only the VLANs and PVIDs which changed")
+    parser_vlan.add_argument("--check",
+        dest="vlan_check", type=str, required=False, default=None, metavar="SNAPSHOT_DIR",
+        help="With --set, validate the config and print the operations and requests it would take for each "
+             "switch, planned from its snapshot in SNAPSHOT_DIR (see `snapshot --output-dir`) without connecting "
+             "to it. Without --host or --inventory every snapshot in the directory is checked")
+    parser_vlan.add_argument("--record",
+        dest="vlan_record", type=str, required=False, default=None, metavar="SNAPSHOT_DIR",
+        help="With --set or --mode, replace the VLAN part of the snapshot of the switch in SNAPSHOT_DIR with the "
+             "new config once it is applied, so `drift` only reports the changes made in another way")
+    parser_vlan.set_defaults(func=_lazy_command(".vlan.cmds", "sub_cmd_vlan"))
 
 
     parser_poe = sub_command.add_parser('poe', help="Configure PoE")
@@ -53,7 +153,7 @@ def get_args() -> argparse.Namespace:
                             dest="power_cycle_ports", type=int, required=False, default=[],
                             nargs="+", choices=list(switch_port_iter(include_port_16=False)),
                             help="List the port(s) to power cycle")
-    parser_poe.set_defaults(func=sub_cmd_poe)
+    parser_poe.set_defaults(func=_lazy_command(".poe", "sub_cmd_poe"))
 
 
     parser_poe = sub_command.add_parser('mirror-port', help="Configure PoE")
@@ -68,9 +168,129 @@ def get_args() -> argparse.Namespace:
                             dest="mirror_port_dest_port", type=int, required=False, default=None,
                             choices=list(switch_port_iter()),
                             help="The port to mirror to")
-    parser_poe.set_defaults(func=sub_cmd_mirror_port)
+    parser_poe.set_defaults(func=_lazy_command(".mirror_port", "sub_cmd_mirror_port"))
+
+
+    parser_snapshot = sub_command.add_parser('snapshot', help="Save the VLAN, mirror, PoE and firmware config of "
+                                                               "the switch as one JSON document")
+    parser_snapshot.add_argument("--output-dir",
+                                 dest="snapshot_output_dir", type=str, required=False, default=None,
+                                 help="Write the snapshot of each switch to <DIR>/<HOST>.json "
+                                      "instead of printing it")
+    parser_snapshot.set_defaults(func=_lazy_command(".snapshot", "sub_cmd_snapshot"))
+
+
+    parser_diff = sub_command.add_parser('diff', help="Show the differences between two snapshots, "
+                                                      "without connecting to a switch")
+    parser_diff.add_argument("diff_old", type=str, metavar="OLD", help="The snapshot to compare against")
+    parser_diff.add_argument("diff_new", type=str, metavar="NEW", help="The snapshot to compare")
+    parser_diff.set_defaults(run=_lazy_command(".snapshot", "sub_cmd_diff"))
+
+
+    parser_drift = sub_command.add_parser('drift', help="Compare the VLAN config of the switches with their "
+                                                        "snapshots by fingerprint, and show what changed on "
+                                                        "the switches which drifted")
+    parser_drift.add_argument("drift_baseline_dir", type=str, metavar="SNAPSHOT_DIR",
+                              help="The snapshots of the last applied config (see `snapshot --output-dir`). "
+                                   "Without --host or --inventory every switch with a snapshot is checked")
+    parser_drift.add_argument("--accept",
+                              dest="drift_accept", action="store_true", required=False, default=False,
+                              help="Replace the snapshot of each switch which drifted with its current config")
+    parser_drift.set_defaults(run=_lazy_command(".drift", "sub_cmd_drift"))
+
+
+    parser_batch = sub_command.add_parser('batch', help="Run the commands of a script (one per line, e.g. "
+                                                        "`poe --reset 1 2`) in one session with the switch")
+    parser_batch.add_argument("batch_file", type=str, metavar="FILE", nargs="?", default="-",
+                              help="The script to run, `-` (default) reads it from stdin")
+    parser_batch.add_argument("--keep-going",
+                              dest="batch_keep_going", action="store_true", required=False, default=False,
+                              help="Run the remaining lines after a line failed, instead of stopping")
+    parser_batch.set_defaults(func=_lazy_command(".batch", "sub_cmd_batch"))
+
+
+    parser_daemon = sub_command.add_parser('daemon', help="Run a daemon which keeps the sessions to the switches "
+                                                          "open and runs the commands forwarded with --daemon-url")
+    parser_daemon.add_argument("--listen",
+                               dest="daemon_listen", type=str, required=False,
+                               default=environ.get("SWITCH_DAEMON_LISTEN", "127.0.0.1:8316"),
+                               help="The loopback address and port the daemon listens on (<HOST>:<PORT>)")
+    parser_daemon.add_argument("--cache-ttl",
+                               dest="daemon_cache_ttl", type=float, required=False, default=10.0,
+                               help="Seconds the parsed pages of a switch are reused between two commands")
+    parser_daemon.set_defaults(run=_lazy_command(".daemon", "sub_cmd_daemon"))
+
+
+    parser_exporter = sub_command.add_parser('exporter', help="Serve the PoE, port and uptime metrics of the "
+                                                               "switches on /metrics for Prometheus")
+    parser_exporter.add_argument("--listen",
+                                 dest="exporter_listen", type=str, required=False,
+                                 default=environ.get("SWITCH_EXPORTER_LISTEN", "127.0.0.1:9316"),
+                                 help="The address and port the exporter listens on (<HOST>:<PORT>), "
+                                      "e.g. 0.0.0.0:9316 for a Prometheus on another machine")
+    parser_exporter.add_argument("--cache-ttl",
+                                 dest="exporter_cache_ttl", type=float, required=False,
+                                 default=float(environ.get("SWITCH_EXPORTER_CACHE_TTL", "30")),
+                                 help="Seconds the metrics of a switch are reused, however many scrapers ask")
+    parser_exporter.set_defaults(run=_lazy_command(".exporter", "sub_cmd_exporter"))
+
+
+    return parser
+
+
+def _select_run(parser: argparse.ArgumentParser, args: argparse.Namespace) -> argparse.Namespace:
+    # Commands with `run` are not run against each switch with a logged in client, they handle it themselves
+    args.run = getattr(args, "run", None)
+    if getattr(args, "vlan_watch", None) is not None:
+        if args.vlan_set or args.vlan_mode:
+            parser.error("--watch can only be used with --get")
+        # Watching polls all the switches itself, for as long as it runs
+        args.run = _lazy_command(".vlan.watch", "sub_cmd_vlan_watch")
+    if getattr(args, "vlan_record", None) is not None:
+        if not (args.vlan_set or args.vlan_mode) or args.vlan_plan or args.vlan_check is not None:
+            parser.error("--record can only be used with --set or --mode, when they change the switch")
+    if getattr(args, "vlan_check", None) is not None:
+        if not args.vlan_set:
+            parser.error("--check can only be used with --set")
+        # The check only reads the snapshots, it never connects to a switch
+        args.run = _lazy_command(".vlan.check", "sub_cmd_vlan_check")
+    if args.command == "batch":
+        args.batch_script = Once()
+    return args
+
+
+def get_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = _build_parser()
+    args = _select_run(parser, parser.parse_args(argv))
+
+    hosts = [parse_host(host, default_port=args.port) for host in args.hosts or []]
+    if args.inventory:
+        hosts += load_inventory(args.inventory, default_port=args.port)
+    if not hosts and environ.get("SWITCH_HOST"):
+        hosts.append(parse_host(environ["SWITCH_HOST"], default_port=args.port))
+
+    args.hosts = hosts
+    if args.run is not None:
+        args.host = hosts[0].host if hosts else None
+        return args
+
+    if not hosts:
+        parser.error("At least one switch have to be provided with --host or --inventory")
+    if args.password is None and args.daemon_url is None:
+        parser.error("The password for the switch have to be provided with --password")
 
+    args.host, args.port = hosts[0]
+    return args
 
-    return parser.parse_args()
 
+def parse_command(args: argparse.Namespace, argv: List[str]) -> argparse.Namespace:
+    # Parses one sub-command (e.g. a line of a batch script) on top of the global arguments, which
+    # were parsed when the process started and are kept as they are
+    if not argv or argv[0].startswith("-"):
+        raise Exception("The line has to start with a command, the global arguments cannot be changed")
 
+    namespace = copy(args)
+    for name in ("func", "run"):
+        namespace.__dict__.pop(name, None)
+    parser = _build_parser(_RaisingArgumentParser)
+    return _select_run(parser, parser.parse_args(argv, namespace=namespace))
@@ -0,0 +1,444 @@
+import argparse
+import asyncio
+import socket
+from hashlib import md5
+from ipaddress import ip_address
+from time import perf_counter
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple, TypeVar, Union
+from urllib.parse import SplitResult, unquote, urlencode, urljoin, urlsplit
+
+from .governor import AsyncGovernor, async_governor_for
+from .login_page import _is_login_page, _merge, _parse_login_page
+from .misc import bad_request
+from .token_store import TokenStore
+from .trace import operation, trace_request
+
+T = TypeVar("T")
+
+_IDEMPOTENT_METHODS = frozenset({"GET", "HEAD"})
+# The proxies `Client` supports as well: an HTTP forward proxy, and SOCKS5 resolving the name of the
+# switch here (socks5) or on the proxy (socks5h)
+_PROXY_SCHEMES = frozenset({"http", "socks5", "socks5h"})
+_RETRY_STATUS_CODES = frozenset({502, 503, 504})
+
+
+class AsyncResponse(NamedTuple):
+    status_code: int
+    headers: Dict[str, str]
+    content: bytes
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(errors="replace")
+
+
+class _Connection(NamedTuple):
+    reader: asyncio.StreamReader
+    writer: asyncio.StreamWriter
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncClient:
+    # The same session handling as `Client` (login, Gambit token, shared token store, page cache), on
+    # asyncio streams instead of requests, so one event loop can drive hundreds of switches. The
+    # switch only speaks plain HTTP/1.1 with small bodies, so redirects are not followed and
+    # `max_connections` bounds the number of requests in flight to this switch, which the governor
+    # lowers while the switch answers slowly or fails
+    def __init__(self, host: str, port: int = 80, proxy_url: str = None,
+                 timeout: Tuple[float, float] = (5.0, 30.0), max_retries: int = 2, backoff_factor: float = 0.5,
+                 max_connections: int = 4):
+        self.host = host
+        self.port = port
+        self.proxy_url = proxy_url
+        self._proxy = urlsplit(proxy_url) if proxy_url is not None else None
+        if self._proxy is not None and self._proxy.scheme not in _PROXY_SCHEMES:
+            raise Exception(f"The proxy `{proxy_url}` is not supported, "
+                            f"only {', '.join(sorted(_PROXY_SCHEMES))} proxies are")
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.prefix_url = f"http://[{host}]:{port}" if ":" in host else f"http://{host}:{port}"
+        self._token = None
+        self._password = None
+        self._token_store = TokenStore(host=host, port=port)
+        self._page_cache: Dict[str, Any] = {}
+
+        self.max_connections = max_connections
+        self._governor: Optional[AsyncGovernor] = None
+        self._login_lock = asyncio.Lock()
+        self._idle_connections: List[_Connection] = []
+
+    @classmethod
+    def from_args(cls, args: argparse.Namespace, host: str = None, port: int = None) -> "AsyncClient":
+        return cls(
+            host=args.host if host is None else host,
+            port=args.port if port is None else port,
+            proxy_url=args.proxy_url,
+            timeout=(args.connect_timeout, args.read_timeout),
+            max_retries=args.retries,
+            max_connections=args.pool_size,
+        )
+
+    async def __aenter__(self) -> "AsyncClient":
+        return self
+
+    async def __aexit__(self, *_exc_info):
+        await self.close()
+
+    async def close(self):
+        while self._idle_connections:
+            connection = self._idle_connections.pop()
+            connection.close()
+            try:
+                await connection.writer.wait_closed()
+            except OSError:
+                pass
+
+    async def get(self, url: str, **kwargs) -> AsyncResponse:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> AsyncResponse:
+        return await self.request("POST", url, **kwargs)
+
+    async def request(self, method: str, url: str, params: Dict[str, Any] = None,
+                      data: Union[Dict[str, Any], bytes] = None, timeout: Union[float, Tuple[float, float]] = None,
+                      retry_login: bool = True) -> AsyncResponse:
+        url = urljoin(self.prefix_url, url)
+
+        # A write can change what a page shows, so the cached page is dropped unless the caller
+        # puts the page from the response back into the cache
+        if method != "GET":
+            self.invalidate_pages(urlsplit(url).path)
+
+        token = self._token
+        resp = await self._request_with_token(method, url, params=params, data=data, timeout=timeout)
+
+        # The switch answers with the login page when the session has expired, so login again and
+        # retry the request once. The token the request was sent with is the expired one, another
+        # coroutine may have already replaced it
+        if retry_login and token and self._password is not None and _is_login_page(resp):
+            await self.login(force=True, expired_token=token)
+            resp = await self._request_with_token(method, url, params=params, data=data, timeout=timeout)
+
+        return resp
+
+    async def _request_with_token(self, method: str, url: str, params: Optional[Dict[str, Any]],
+                                  data: Union[Dict[str, Any], bytes, None],
+                                  timeout: Union[float, Tuple[float, float], None]) -> AsyncResponse:
+        params = dict(params or {})
+        if isinstance(data, dict):
+            data = dict(data)
+
+        if self._token:
+            if method == "POST" and isinstance(data, dict):
+                data['Gambit'] = self._token
+            params['Gambit'] = self._token
+
+        split_url = urlsplit(url)
+        query = "&".join(part for part in [split_url.query, urlencode(params)] if part)
+        target = f"{split_url.path or '/'}{'?' if query else ''}{query}"
+        # A forward proxy gets the absolute URL, through a SOCKS tunnel the request goes to the switch as it is
+        if self._proxy is not None and self._proxy.scheme == "http":
+            target = f"{split_url.scheme}://{split_url.netloc}{target}"
+
+        headers = {"Host": split_url.netloc, "Connection": "keep-alive", "Accept-Encoding": "identity"}
+        body = b""
+        if isinstance(data, dict):
+            body = urlencode(data).encode()
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        elif data is not None:
+            body = data
+        if body or method == "POST":
+            headers["Content-Length"] = f"{body.__len__()}"
+
+        request = f"{method} {target} HTTP/1.1\r\n".encode("latin-1")
+        request += "".join(f"{name}: {value}\r\n" for name, value in headers.items()).encode("latin-1")
+        request += b"\r\n" + body
+
+        if timeout is None:
+            timeout = self.timeout
+        if not isinstance(timeout, tuple):
+            timeout = (timeout, timeout)
+
+        if self._governor is None:
+            self._governor = async_governor_for(self.host, self.port, max_limit=self.max_connections)
+        async with self._governor.slot(split_url.path) as slot:
+            time_start = perf_counter()
+            try:
+                resp = await self._send_with_retries(method, request, timeout)
+            except Exception:
+                trace_request(method, split_url.path, host=self.host, status=None, size=None,
+                              latency_sec=perf_counter() - time_start)
+                raise
+            slot.failed = resp.status_code >= 500
+            trace_request(method, split_url.path, host=self.host, status=resp.status_code, size=resp.content.__len__(),
+                          latency_sec=perf_counter() - time_start)
+            return resp
+
+    async def _send_with_retries(self, method: str, request: bytes, timeout: Tuple[float, float]) -> AsyncResponse:
+        # Like the retries of `Client`: connection errors are retried for every request, because
+        # nothing has been sent yet, while read errors and bad gateway answers only for GET and HEAD
+        attempt = 0
+        while True:
+            try:
+                resp = await self._send(request, timeout)
+                # After the last retry the bad gateway answer is returned, like `raise_on_status=False`
+                if (resp.status_code not in _RETRY_STATUS_CODES or method not in _IDEMPOTENT_METHODS or
+                        attempt >= self.max_retries):
+                    return resp
+            except (ConnectionError, asyncio.TimeoutError) as err:
+                if (isinstance(err, _ReadError) and method not in _IDEMPOTENT_METHODS) or attempt >= self.max_retries:
+                    raise
+
+            await asyncio.sleep(self.backoff_factor * (2 ** attempt))
+            attempt += 1
+
+    async def _send(self, request: bytes, timeout: Tuple[float, float]) -> AsyncResponse:
+        while self._idle_connections:
+            # The switch closes idle keep-alive connections, so a reused connection which fails
+            # before the answer starts is replaced by a new one instead of counting as a retry
+            connection = self._idle_connections.pop()
+            try:
+                return await self._exchange(connection, request, timeout)
+            except _StaleConnection:
+                continue
+
+        connection = await self._connect(timeout[0])
+        try:
+            return await self._exchange(connection, request, timeout)
+        except _StaleConnection as err:
+            raise _ReadError(f"The switch `{self.host}:{self.port}` closed the connection") from err
+
+    async def _connect(self, connect_timeout: float) -> _Connection:
+        if self._proxy is not None:
+            host, port = self._proxy.hostname, self._proxy.port or (80 if self._proxy.scheme == "http" else 1080)
+        else:
+            host, port = self.host, self.port
+
+        async def connect() -> _Connection:
+            reader, writer = await asyncio.open_connection(host, port)
+            if self._proxy is not None and self._proxy.scheme != "http":
+                try:
+                    await _socks5_connect(reader, writer, self._proxy, host=self.host, port=self.port)
+                except BaseException:
+                    writer.close()
+                    raise
+            return _Connection(reader=reader, writer=writer)
+
+        try:
+            return await asyncio.wait_for(connect(), timeout=connect_timeout)
+        except asyncio.TimeoutError:
+            raise ConnectionError(f"Timed out connecting to `{host}:{port}` after {connect_timeout}s")
+
+    async def _exchange(self, connection: _Connection, request: bytes, timeout: Tuple[float, float]) -> AsyncResponse:
+        try:
+            connection.writer.write(request)
+            await connection.writer.drain()
+            status_line = await asyncio.wait_for(connection.reader.readline(), timeout=timeout[1])
+        except (ConnectionError, asyncio.IncompleteReadError) as err:
+            connection.close()
+            raise _StaleConnection() from err
+        except asyncio.TimeoutError as err:
+            connection.close()
+            raise _ReadError(f"Timed out waiting for `{self.host}:{self.port}` after {timeout[1]}s") from err
+        if not status_line:
+            connection.close()
+            raise _StaleConnection()
+
+        try:
+            resp, keep_alive = await asyncio.wait_for(_read_response(status_line, connection.reader),
+                                                      timeout=timeout[1])
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError) as err:
+            connection.close()
+            raise _ReadError(f"Failed to read the answer from `{self.host}:{self.port}` - err: {err!r}") from err
+
+        if keep_alive:
+            self._idle_connections.append(connection)
+        else:
+            connection.close()
+        return resp
+
+    async def get_page(self, path: str, parser: Callable[[str], T]) -> T:
+        if path not in self._page_cache:
+            resp = await self.get(path)
+            try:
+                self._page_cache[path] = parser(resp.text)
+            except Exception as err:
+                bad_request(resp, err=err)
+        return self._page_cache[path]
+
+    def cache_page(self, path: str, page: Any):
+        self._page_cache[path] = page
+
+    def invalidate_pages(self, *paths: str):
+        if not paths:
+            self._page_cache.clear()
+        for path in paths:
+            self._page_cache.pop(path, None)
+
+    async def login(self, password: str = None, force: bool = False, expired_token: str = None, fresh: bool = False):
+        if password is None:
+            if self._password is None:
+                raise Exception("The client have not been provided with a password, "
+                                "it have to be provided one at least ones")
+            password = self._password
+        self._password = password
+
+        # `force` means the current token (or `expired_token`) is known to be expired. `fresh` logs in with
+        # the password even when a valid token exists, like `Client.login`
+        if force and expired_token is None:
+            expired_token = self._token
+        with operation("login"):
+            async with self._login_lock, self._token_store.lock_async():
+                if fresh:
+                    self._token = None
+                    await self._login(password=password)
+                    return
+
+                # Another coroutine of this client logged in while this one waited for the lock
+                if force and self._token is not None and self._token != expired_token:
+                    return
+
+                # The token of another process (or of an earlier run) is checked before it is used,
+                # like `Client.login` does
+                token = self._token_store.load()
+                if token is not None and token != expired_token:
+                    self._token = token
+                    if await self.valid_token():
+                        self.invalidate_pages()
+                        return
+
+                self._token = None
+                await self._login(password=password)
+
+    async def _login(self, password: str):
+        resp_login_page = await self.get("/", timeout=10, retry_login=False)
+
+        if resp_login_page.status_code != 200:
+            bad_request(resp_login_page)
+
+        login_page = _parse_login_page(resp_login_page.text)
+        if login_page.rand is None:
+            bad_request(resp_login_page, msg="The login page does not contain the random number")
+        salted_password = _merge(password, login_page.rand)
+        hashed_password = md5(salted_password.encode()).hexdigest()
+
+        resp_login = await self.post("/redirect.html", data={"LoginPassword": hashed_password},
+                                     timeout=10, retry_login=False)
+
+        if resp_login.status_code != 200:
+            bad_request(resp_login)
+
+        redirect_page = _parse_login_page(resp_login.text)
+        if redirect_page.body_onload != 'loadHomePage()':
+            self._token_store.clear()
+            if redirect_page.error_msg:
+                raise Exception(f"Login Failed - {redirect_page.error_msg}")
+            else:
+                raise Exception("Wrong Password")
+
+        if redirect_page.gambit is None:
+            bad_request(resp_login, msg="The login answer does not contain the session token")
+        self.set_token(token=redirect_page.gambit)
+
+    def set_token(self, token: str):
+        self._token = token
+        self.invalidate_pages()
+        self._token_store.save(token)
+
+    def get_token(self) -> str:
+        if self._token is None:
+            raise Exception("The client does not have a token,"
+                            "the client needs to login successfully at least ones to obtain a token")
+        return self._token
+
+    async def valid_token(self) -> bool:
+        resp = await self.get('/homepage.html', timeout=10, retry_login=False)
+        if resp.status_code != 200 or resp.text.__len__() < 250 or _is_login_page(resp):
+            return False
+
+        return True
+
+
+class _StaleConnection(ConnectionError):
+    pass
+
+
+class _ReadError(ConnectionError):
+    pass
+
+
+async def _socks5_connect(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, proxy: SplitResult,
+                          host: str, port: int):
+    # RFC 1928, with the username and password authentication of RFC 1929 when the proxy URL has them
+    methods = b"\x00\x02" if proxy.username else b"\x00"
+    writer.write(b"\x05" + bytes([methods.__len__()]) + methods)
+    version, method = await reader.readexactly(2)
+    if version != 5 or method not in methods:
+        raise ConnectionError(f"The SOCKS proxy `{proxy.hostname}` does not accept any of the offered methods")
+    if method == 2:
+        username, password = unquote(proxy.username).encode(), unquote(proxy.password or "").encode()
+        writer.write(b"\x01" + bytes([username.__len__()]) + username + bytes([password.__len__()]) + password)
+        _version, status = await reader.readexactly(2)
+        if status != 0:
+            raise ConnectionError(f"The SOCKS proxy `{proxy.hostname}` rejected the username and password")
+
+    try:
+        address = ip_address(host)
+    except ValueError:
+        address = None
+    if address is None and proxy.scheme == "socks5":
+        # `socks5` resolves the name of the switch here, like requests does, `socks5h` leaves it to the proxy
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        address = ip_address(infos[0][4][0])
+    if address is None:
+        name = host.encode("idna")
+        destination = b"\x03" + bytes([name.__len__()]) + name
+    else:
+        destination = (b"\x01" if address.version == 4 else b"\x04") + address.packed
+    writer.write(b"\x05\x01\x00" + destination + port.to_bytes(2, "big"))
+    await writer.drain()
+
+    _version, reply, _reserved, address_type = await reader.readexactly(4)
+    if reply != 0:
+        raise ConnectionError(f"The SOCKS proxy `{proxy.hostname}` could not connect to `{host}:{port}` "
+                              f"- reply: {reply}")
+    # The address the proxy connected from is not needed
+    if address_type == 3:
+        await reader.readexactly((await reader.readexactly(1))[0] + 2)
+    else:
+        await reader.readexactly((4 if address_type == 1 else 16) + 2)
+
+
+async def _read_response(status_line: bytes, reader: asyncio.StreamReader) -> Tuple[AsyncResponse, bool]:
+    version, status_code, *_reason = status_line.decode("latin-1").split(" ", 2)
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in {b"\r\n", b"\n", b""}:
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        content = b""
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                await reader.readline()
+                break
+            content += await reader.readexactly(size)
+            await reader.readline()
+    elif "content-length" in headers:
+        content = await reader.readexactly(int(headers["content-length"]))
+    else:
+        # Without a length the answer ends when the switch closes the connection
+        content = await reader.read()
+        keep_alive = False
+
+    return AsyncResponse(status_code=int(status_code), headers=headers, content=content), keep_alive
+
@@ -0,0 +1,129 @@
+import argparse
+import shlex
+import sys
+import threading
+from copy import copy
+from pathlib import Path
+from time import time
+from typing import List, NamedTuple, Optional
+
+from .arguments import parse_command
+from .client import Client
+from .fleet import _PrefixedWriter, _exit_code
+from .misc import thread_local_stdout
+from .output import emit
+from .trace import operation
+
+
+class BatchLine(NamedTuple):
+    line_no: int
+    text: str
+    args: Optional[argparse.Namespace]
+    error: Optional[str]
+
+
+class LineResult(NamedTuple):
+    line: BatchLine
+    exit_code: int
+    duration_sec: float
+    error: Optional[str]
+
+
+def parse_script(args: argparse.Namespace, text: str) -> List[BatchLine]:
+    lines = []
+    for line_no, line in enumerate(text.splitlines(), start=1):
+        try:
+            argv = shlex.split(line, comments=True)
+            if not argv:
+                continue
+            line_args = parse_command(args, argv)
+            if line_args.run is not None or line_args.command == "batch":
+                raise Exception(f"The command `{line_args.command}` cannot be run in a batch")
+        except Exception as err:
+            lines.append(BatchLine(line_no=line_no, text=line.strip(), args=None, error=f"{err}"))
+        else:
+            lines.append(BatchLine(line_no=line_no, text=line.strip(), args=line_args, error=None))
+    return lines
+
+
+def load_script(args: argparse.Namespace, path: str) -> List[BatchLine]:
+    # The script is read and parsed once per command (`args.batch_script` is shared by the copies of the
+    # arguments for each switch), so stdin is only read by the first switch and every switch runs the same
+    # lines. The next command reads the file again, also in the daemon
+    def read() -> List[BatchLine]:
+        return parse_script(args, sys.stdin.read() if path == "-" else Path(path).read_text())
+
+    return args.batch_script.get(read)
+
+
+def run_line(client: Client, args: argparse.Namespace, line: BatchLine) -> LineResult:
+    time_start = time()
+
+    # The lines were parsed once for all switches, the switch they run against is the current one
+    line_args = copy(line.args)
+    line_args.host = args.host
+    line_args.port = args.port
+
+    error = None
+    try:
+        with operation(line_args.command):
+            line_args.func(client, line_args)
+        exit_code = 0
+    except SystemExit as err:
+        exit_code = _exit_code(err)
+    except Exception as err:
+        exit_code = 1
+        error = f"{err}"
+
+    return LineResult(line=line, exit_code=exit_code, duration_sec=time() - time_start, error=error)
+
+
+def run_script(client: Client, args: argparse.Namespace, lines: List[BatchLine], keep_going: bool = False) -> int:
+    invalid = [line for line in lines if line.error is not None]
+    if invalid:
+        for line in invalid:
+            emit("batch_line", line_no=line.line_no, line=line.text, exit_code=None, duration_sec=None,
+                 error=f"INVALID - {line.error}")
+            print(f"[{line.line_no}] INVALID - {line.error}: {line.text}")
+        print("Nothing was run, because the script contains invalid lines")
+        return 1
+
+    stdout = thread_local_stdout()
+    target = stdout.current() or stdout.stream
+    lock = threading.Lock()
+
+    # Every line runs with the same client, so the switch sees one login and the pages read by
+    # one line are reused by the next lines until a line changes them
+    results: List[LineResult] = []
+    for line in lines:
+        writer = _PrefixedWriter(target, lock, prefix=f"[{line.line_no}] ")
+        with stdout.redirect(writer):
+            try:
+                result = run_line(client, args, line)
+            finally:
+                writer.finish()
+        results.append(result)
+        emit("batch_line", line_no=line.line_no, line=line.text, exit_code=result.exit_code,
+             duration_sec=round(result.duration_sec, 3), error=result.error)
+
+        if result.exit_code == 0:
+            print(f"[{line.line_no}] OK ({result.duration_sec:.2f}s) {line.text}")
+        elif result.error:
+            print(f"[{line.line_no}] FAILED ({result.duration_sec:.2f}s) {line.text} - {result.error}")
+        else:
+            print(f"[{line.line_no}] FAILED ({result.duration_sec:.2f}s) {line.text} - exit code: {result.exit_code}")
+
+        if result.exit_code != 0 and not keep_going:
+            break
+
+    failed = sum(1 for result in results if result.exit_code != 0)
+    not_run = lines.__len__() - results.__len__()
+    print(f"{results.__len__() - failed}/{lines.__len__()} lines succeeded"
+          + (f", {not_run} were not run after the failure" if not_run else ""))
+    emit("batch_result", succeeded=results.__len__() - failed, failed=failed, not_run=not_run)
+    return 1 if failed else 0
+
+
+def sub_cmd_batch(client: Client, args: argparse.Namespace):
+    lines = load_script(args, args.batch_file)
+    exit(run_script(client, args, lines, keep_going=args.batch_keep_going))
@@ -1,23 +1,51 @@
 from hashlib import md5
-from pathlib import Path
-from time import time
-from urllib.parse import urljoin
+import argparse
+from time import perf_counter
+from typing import Any, Callable, Dict, Tuple, TypeVar
+from urllib.parse import urljoin, urlsplit
 
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from .governor import governor_for
+from .login_page import _is_login_page, _merge, _parse_login_page
 from .misc import bad_request
+from .token_store import TokenStore
+from .trace import operation, trace_request
+
+T = TypeVar("T")
 
 
 class Client(requests.Session):
-    def __init__(self, host: str, port: int = 80, proxy_url: str = None, *args, **kwargs):
+    def __init__(self, host: str, port: int = 80, proxy_url: str = None,
+                 timeout: Tuple[float, float] = (5.0, 30.0), max_retries: int = 2, backoff_factor: float = 0.5,
+                 pool_maxsize: int = 4, *args, **kwargs):
         # noinspection PyArgumentList
         super(Client, self).__init__(*args, **kwargs)
 
-        self.prefix_url = f"http://{host}:{port}"
+        self.host = host
+        self.port = port
+        self.proxy_url = proxy_url
+        self.timeout = timeout
+        self.prefix_url = f"http://[{host}]:{port}" if ":" in host else f"http://{host}:{port}"
         self._token = None
         self._password = None
-        self._token_file_path = Path(f"/tmp/.netgear-gs316ep_token/{host}/token")
+        self._token_store = TokenStore(host=host, port=port)
+        self._page_cache: Dict[str, Any] = {}
+        self._governor = governor_for(host, port, max_limit=pool_maxsize)
+
+        # Only idempotent requests are retried after a read error or a bad gateway answer,
+        # connection errors are retried for every request, because nothing has been sent yet
+        retry = Retry(
+            total=max_retries, connect=max_retries, read=max_retries, status=max_retries,
+            backoff_factor=backoff_factor, allowed_methods=frozenset({"GET", "HEAD"}),
+            status_forcelist=frozenset({502, 503, 504}), raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_maxsize, max_retries=retry, pool_block=True)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+        self.headers["Connection"] = "keep-alive"
 
         if proxy_url is not None:
             proxies = {
@@ -26,75 +54,163 @@ class Client(requests.Session):
             }
             self.proxies.update(proxies)
 
+    @classmethod
+    def from_args(cls, args: argparse.Namespace, host: str = None, port: int = None) -> "Client":
+        return cls(
+            host=args.host if host is None else host,
+            port=args.port if port is None else port,
+            proxy_url=args.proxy_url,
+            timeout=(args.connect_timeout, args.read_timeout),
+            max_retries=args.retries,
+            pool_maxsize=args.pool_size,
+        )
+
     def request(self, method, url, *args, **kwargs):
         url = urljoin(self.prefix_url, url)
-
+        retry_login = kwargs.pop("retry_login", True)
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+
+        # A write can change what a page shows, so the cached page is dropped unless the caller
+        # puts the page from the response back into the cache
+        if method != "GET":
+            self.invalidate_pages(urlsplit(url).path)
+
+        token = self._token
+        resp = self._request_with_token(method, url, *args, **kwargs)
+
+        # The switch answers with the login page when the session has expired, so login again and
+        # retry the request once. Streamed bodies cannot be sent twice, so they are not retried, and a
+        # streamed answer is not read here to look for the login page, that would load all of it in memory.
+        # The token the request was sent with is the expired one, another thread may have already
+        # replaced it, and logging in again would expire the new token of that thread
+        if (retry_login and token and self._password is not None and
+                not hasattr(kwargs.get('data'), 'read') and not kwargs.get("stream") and _is_login_page(resp)):
+            self.login(force=True, expired_token=token)
+            resp = self._request_with_token(method, url, *args, **kwargs)
+
+        return resp
+
+    def _request_with_token(self, method, url, *args, **kwargs):
         if self._token:
-            if method == "POST" and kwargs.get('data'):
+            # The token goes into copies, the dicts of the caller may be shared between threads and switches
+            if method == "POST" and isinstance(kwargs.get('data'), dict):
+                kwargs['data'] = dict(kwargs['data'])
                 kwargs['data']['Gambit'] = self._token
 
-            if kwargs.get('params') is None:
-                kwargs['params'] = {}
+            kwargs['params'] = dict(kwargs.get('params') or {})
             kwargs['params']['Gambit'] = self._token
 
-        # if method == "GET":
-        # else:
-        #     if self._token:
-        #         if kwargs.get('data') is None:
-        #             kwargs['data'] = {}
-        #         kwargs['data']['Gambit'] = self._token
-
-        return super(Client, self).request(
-            method, url, *args, **kwargs
-        )
-
-    def login(self, password: str = None):
+        path = urlsplit(url).path
+        # The duration of an upload or a streamed download says nothing about the load of the switch
+        measured = not hasattr(kwargs.get('data'), 'read') and not kwargs.get("stream")
+        with self._governor.slot(path, measured=measured) as slot:
+            time_start = perf_counter()
+            try:
+                resp = super(Client, self).request(
+                    method, url, *args, **kwargs
+                )
+            except Exception:
+                trace_request(method, path, host=self.host, status=None, size=None,
+                              latency_sec=perf_counter() - time_start)
+                raise
+            slot.failed = resp.status_code >= 500
+        trace_request(method, path, host=self.host, status=resp.status_code,
+                      size=None if kwargs.get("stream") else resp.content.__len__(),
+                      latency_sec=perf_counter() - time_start)
+        return resp
+
+    def get_page(self, path: str, parser: Callable[[str], T]) -> T:
+        if path not in self._page_cache:
+            resp = self.get(path)
+            try:
+                self._page_cache[path] = parser(resp.text)
+            except Exception as err:
+                bad_request(resp, err=err)
+        return self._page_cache[path]
+
+    def cache_page(self, path: str, page: Any):
+        self._page_cache[path] = page
+
+    def invalidate_pages(self, *paths: str):
+        if not paths:
+            self._page_cache.clear()
+        for path in paths:
+            self._page_cache.pop(path, None)
+
+    def login(self, password: str = None, force: bool = False, expired_token: str = None, fresh: bool = False):
         if password is None:
             if self._password is None:
                 raise Exception("The client have not been provided with a password, "
                                 "it have to be provided one at least ones")
             password = self._password
+        self._password = password
 
-        if self._token_file_path.is_file() and int(self._token_file_path.stat().st_mtime) > time() - (15 * 60):
-            self._token = self._token_file_path.read_text()
-            return
-
-        resp_login_page = self.get("/", allow_redirects=False, timeout=10)
+        # `force` means the current token (or `expired_token`) is known to be expired. `fresh` logs in with
+        # the password even when a valid token exists, a token proves nothing about the password
+        if force and expired_token is None:
+            expired_token = self._token
+        with operation("login"), self._token_store.lock():
+            if fresh:
+                self._token = None
+                self._login(password=password)
+                return
+
+            # Another thread of this client logged in while this one waited for the lock
+            if force and self._token is not None and self._token != expired_token:
+                return
+
+            # The token of another process (or of an earlier run) is checked with one small GET before
+            # it is used, an expired token would cost the first request a failed round trip and a login,
+            # and a streamed upload is not retried at all
+            token = self._token_store.load()
+            if token is not None and token != expired_token:
+                self._token = token
+                if self.valid_token():
+                    self.invalidate_pages()
+                    return
+
+            self._token = None
+            self._login(password=password)
+
+    def _login(self, password: str):
+        resp_login_page = self.get("/", allow_redirects=False, timeout=10, retry_login=False)
 
         if resp_login_page.status_code != 200:
             bad_request(resp_login_page)
 
-        bs = BeautifulSoup(resp_login_page.text, 'html.parser')
-        random_number = bs.find(name="input", id="rand").get("value")
+        login_page = _parse_login_page(resp_login_page.text)
+        if login_page.rand is None:
+            bad_request(resp_login_page, msg="The login page does not contain the random number")
+        random_number = login_page.rand
         salted_password = _merge(password, random_number)
         hashed_password = md5(salted_password.encode()).hexdigest()
 
         resp_login = self.post(
             "/redirect.html", allow_redirects=False,
             data={"LoginPassword": hashed_password},
-            timeout=10,
+            timeout=10, retry_login=False,
         )
 
         if resp_login.status_code != 200:
             bad_request(resp_login)
 
-        bs2 = BeautifulSoup(resp_login.text, 'html.parser')
-        body_onload = bs2.find("body").get("onload")
-        if body_onload != 'loadHomePage()':
-            login_page_error_msg = bs2.find('span', id="loginPageErrorMsg")
-            if login_page_error_msg.contents:
-                raise Exception(f"Login Failed - {login_page_error_msg.contents[0]}")
+        redirect_page = _parse_login_page(resp_login.text)
+        if redirect_page.body_onload != 'loadHomePage()':
+            self._token_store.clear()
+            if redirect_page.error_msg:
+                raise Exception(f"Login Failed - {redirect_page.error_msg}")
             else:
                 raise Exception("Wrong Password")
 
-        token = bs2.find('input', attrs={'name': "Gambit"})['value']
-        self.set_token(token=token)
-        self._password = password
+        if redirect_page.gambit is None:
+            bad_request(resp_login, msg="The login answer does not contain the session token")
+        self.set_token(token=redirect_page.gambit)
 
     def set_token(self, token: str):
         self._token = token
-        self._token_file_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
-        self._token_file_path.write_text(token)
+        self.invalidate_pages()
+        self._token_store.save(token)
 
     def get_token(self) -> str:
         if self._token is None:
@@ -103,26 +219,8 @@ class Client(requests.Session):
         return self._token
 
     def valid_token(self) -> bool:
-        resp = self.get('/homepage.html')
-        if resp.status_code != 200 or resp.text.__len__() < 250:
+        resp = self.get('/homepage.html', timeout=10, retry_login=False)
+        if resp.status_code != 200 or resp.text.__len__() < 250 or _is_login_page(resp):
             return False
 
         return True
-
-
-def _merge(password: str, random_number: str):
-    arr1 = list(password)
-    arr2 = list(random_number)
-    result = ""
-    index1 = 0
-    index2 = 0
-    while index1 < arr1.__len__() or index2 < arr2.__len__():
-        if index1 < arr1.__len__():
-            result += arr1[index1]
-            index1 += 1
-
-        if index2 < arr2.__len__():
-            result += arr2[index2]
-            index2 += 1
-
-    return result
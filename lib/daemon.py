@@ -0,0 +1,232 @@
+import argparse
+import hmac
+import io
+import json
+import os
+import secrets
+import signal
+import sys
+import threading
+from contextlib import ExitStack, contextmanager
+from copy import copy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from time import time
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from .arguments import get_args
+from .client import Client
+from .daemon_client import daemon_secret_path
+from .fleet import run_fleet, run_on_host
+from .inventory import Host, parse_host
+from .misc import thread_local_stdout
+from .output import RecordWriter, record_writer
+from .mirror_port import mirror_port, mirror_port_disable
+from .poe import power_cycle_ports
+from .vlan.set_vlans import set_vlans
+from .vlan.get_vlans import get_vlan_info
+
+
+class _Session:
+    def __init__(self, client: Client):
+        self.client = client
+        self.lock = threading.Lock()
+        # The password the switch accepted last, a command with another one logs in again with it
+        self.password: Optional[str] = None
+        self.cached_at = 0.0
+
+
+class SessionPool:
+    # One logged in client per switch. The commands for a switch run one at a time, while
+    # different switches are handled in parallel
+    def __init__(self, cache_ttl_sec: float = 10.0):
+        self.cache_ttl_sec = cache_ttl_sec
+        self._sessions: Dict[Host, _Session] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def session(self, args: argparse.Namespace, host: Host) -> Iterator[Client]:
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = self._sessions[host] = _Session(Client.from_args(args, host=host.host, port=host.port))
+
+        with session.lock:
+            # Every command brings its own password, the daemon never runs one with the password of another
+            if args.password is None:
+                raise Exception("The password for the switch have to be provided with --password")
+            if session.password != args.password:
+                session.password = None
+                session.client.login(password=args.password, fresh=True)
+                session.password = args.password
+                session.cached_at = time()
+
+            # The switch can be changed by others (e.g. on its web interface), so the parsed pages are
+            # dropped once they are older than the TTL, however busy the daemon keeps the session
+            if time() - session.cached_at > self.cache_ttl_sec:
+                session.client.invalidate_pages()
+                session.cached_at = time()
+
+            yield session.client
+
+    def hosts(self):
+        with self._lock:
+            return sorted(f"{host}" for host in self._sessions.keys())
+
+
+def _op_set_vlans(client: Client, params: Dict[str, Any]):
+    # The keys of JSON objects are always strings, but the VLAN IDs and port numbers are integers
+    vlans = {
+        int(vlan_id): {
+            "name": vlan["name"],
+            "ports_access": {int(port_no): access for port_no, access in vlan["ports_access"].items()},
+        }
+        for vlan_id, vlan in params["vlans"].items()
+    }
+    return set_vlans(client=client, vlans=vlans).to_record()
+
+
+def _op_mirror_port(client: Client, params: Dict[str, Any]):
+    if params.get("disable"):
+        mirror_port_disable(client=client)
+    else:
+        mirror_port(client=client, src_ports=params["src_ports"], dest_port=params["dest_port"])
+
+
+OPERATIONS: Dict[str, Callable[[Client, Dict[str, Any]], Any]] = {
+    "get_vlan_info": lambda client, _params: get_vlan_info(client),
+    "set_vlans": _op_set_vlans,
+    "power_cycle_ports": lambda client, params: power_cycle_ports(client=client, ports=params["ports"]),
+    "mirror_port": _op_mirror_port,
+}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "DaemonServer"
+
+    def log_message(self, *_args):
+        pass
+
+    def _send_json(self, result: Dict[str, Any], status: int = 200):
+        body = json.dumps(result, default=str).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", f"{body.__len__()}")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self) -> bool:
+        scheme, _, secret = self.headers.get("Authorization", "").partition(" ")
+        if scheme == "Bearer" and hmac.compare_digest(secret.encode(), self.server.secret.encode()):
+            return True
+        self._send_json({"error": "The request does not carry the secret of the daemon"}, status=401)
+        return False
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        if self.path == "/sessions":
+            self._send_json({"sessions": self.server.pool.hosts()})
+        else:
+            self._send_json({"error": f"Unknown path `{self.path}`"}, status=404)
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", "0"))))
+        except ValueError as err:
+            self._send_json({"error": f"The body is not valid JSON - err: {err}"}, status=400)
+            return
+
+        if self.path == "/run":
+            self._send_json(self.server.run_command(request.get("argv", []), password=request.get("password")))
+        elif self.path.startswith("/op/") and self.path[4:] in OPERATIONS:
+            try:
+                self._send_json({"result": self.server.run_operation(self.path[4:], request)})
+            except Exception as err:
+                self._send_json({"error": f"{err}"}, status=500)
+        else:
+            self._send_json({"error": f"Unknown path `{self.path}`"}, status=404)
+
+
+class DaemonServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, args: argparse.Namespace, host: str = "127.0.0.1", port: int = 8316, secret: str = None):
+        super(DaemonServer, self).__init__((host, port), _Handler)
+        self.args = args
+        self.secret = secret or secrets.token_urlsafe(32)
+        self.pool = SessionPool(cache_ttl_sec=args.daemon_cache_ttl)
+        self.stdout = thread_local_stdout()
+
+    def run_command(self, argv, password: Optional[str]) -> Dict[str, Any]:
+        output, log = io.StringIO(), io.StringIO()
+        with ExitStack() as stack:
+            stack.enter_context(self.stdout.redirect(output))
+            try:
+                # The password of the command, never the SWITCH_PASSWORD of the daemon
+                if password is None:
+                    raise Exception("The password for the switch have to be provided with --password")
+                args = get_args(["--password", password, *argv])
+                if args.command == "batch" and args.batch_file == "-":
+                    raise Exception("`batch -` cannot be run by the daemon, it would read the stdin of the daemon")
+                if args.run is not None:
+                    raise Exception("The command cannot be run by the daemon")
+
+                # With --output json|ndjson the records are the output and what is printed goes to the log
+                if args.output != "text":
+                    writer = RecordWriter(output, args.output)
+                    stack.callback(writer.close)
+                    stack.enter_context(record_writer(writer))
+                    stack.enter_context(self.stdout.redirect(log))
+
+                if args.hosts.__len__() > 1:
+                    exit_code = run_fleet(args, hosts=args.hosts, max_workers=args.workers,
+                                          session=self.pool.session)
+                else:
+                    result = run_on_host(args, args.hosts[0], session=self.pool.session)
+                    if result.error:
+                        print(f"Error: {result.error}")
+                    exit_code = result.exit_code
+            except SystemExit as err:
+                exit_code = err.code if isinstance(err.code, int) else 1
+            except Exception as err:
+                print(f"Error: {err}")
+                exit_code = 1
+
+        return {"exit_code": exit_code, "output": output.getvalue(), "log": log.getvalue()}
+
+    def run_operation(self, name: str, request: Dict[str, Any]) -> Any:
+        args = copy(self.args)
+        args.password = request.get("password")
+        host = parse_host(f"{request['host']}", default_port=int(request.get("port", 80)))
+        with self.pool.session(args, host) as client:
+            return OPERATIONS[name](client, request.get("params", {}))
+
+
+def _write_secret(path: Path, secret: str):
+    path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    # Created readable for the user only, the secret is never in a file others can read for a moment
+    path.unlink(missing_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w") as file:
+        file.write(secret + "\n")
+
+
+def sub_cmd_daemon(args: argparse.Namespace) -> int:
+    listen_host, _, listen_port = args.daemon_listen.rpartition(":")
+    server = DaemonServer(args, host=listen_host or "127.0.0.1", port=int(listen_port))
+    secret_path = daemon_secret_path(server.server_address[1], args.daemon_secret_file)
+    _write_secret(secret_path, server.secret)
+    print(f"The daemon is listening on http://{server.server_address[0]}:{server.server_address[1]}, "
+          f"the commands have to send the secret in `{secret_path}`")
+    sys.stdout.flush()
+    # Stopped by SIGTERM as well, so the secret is removed in both cases
+    signal.signal(signal.SIGTERM, lambda *_args: sys.exit(0))
+    try:
+        server.serve_forever()
+    finally:
+        secret_path.unlink(missing_ok=True)
+    return 0
+
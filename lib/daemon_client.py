@@ -0,0 +1,47 @@
+import json
+import sys
+from http.client import HTTPConnection
+from pathlib import Path
+from typing import List, Optional
+from urllib.parse import urlsplit
+
+DAEMON_SECRET_DIR = Path.home() / ".config" / "netgear-gs316ep"
+
+
+def daemon_secret_path(port: int, secret_file: Optional[str] = None) -> Path:
+    # The secret is only readable by the user who started the daemon, so only that user's commands
+    # (and not every local user who can reach the loopback port) are run by it
+    return Path(secret_file) if secret_file else DAEMON_SECRET_DIR / f"daemon-{port}.secret"
+
+
+def forward_to_daemon(daemon_url: str, argv: List[str], password: Optional[str],
+                      secret_file: Optional[str] = None) -> int:
+    # Only the standard library is used here, so forwarding a command does not pay for importing
+    # requests and the sub-command modules, the daemon has them loaded already
+    url = urlsplit(daemon_url)
+    secret_path = daemon_secret_path(url.port or 80, secret_file)
+    try:
+        secret = secret_path.read_text().strip()
+    except FileNotFoundError:
+        print(f"Error: There is no secret of the daemon at `{secret_path}`, "
+              f"is the daemon of this user running on {daemon_url}?", file=sys.stderr)
+        return 1
+
+    # The password is sent with the command, e.g. when it comes from SWITCH_PASSWORD of this process
+    connection = HTTPConnection(url.hostname, url.port or 80)
+    try:
+        connection.request("POST", "/run", body=json.dumps({"argv": argv, "password": password}).encode(),
+                           headers={"Content-Type": "application/json", "Authorization": f"Bearer {secret}"})
+        resp = connection.getresponse()
+        result = json.loads(resp.read())
+    finally:
+        connection.close()
+
+    if "error" in result:
+        print(f"Error: {result['error']}", file=sys.stderr)
+        return 1
+
+    # With --output json|ndjson the output is the records, and what was printed for people is the log
+    sys.stdout.write(result["output"])
+    sys.stderr.write(result.get("log", ""))
+    return result["exit_code"]
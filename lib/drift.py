@@ -0,0 +1,135 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextvars import copy_context
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from .client import Client
+from .inventory import Host, parse_host
+from .misc import bad_request
+from .output import emit, record_host
+from .snapshot import load_snapshot, snapshot_path, snapshot_vlan_page, take_snapshot, write_snapshot
+from .vlan.diff import diff_pvids, diff_vlans
+from .vlan.fingerprint import html_fingerprint, page_fingerprint, page_pvids
+from .vlan.helper_functions import VLAN_PAGE_PATH
+from .vlan.page_parser import parse_vlan_page
+
+
+class DriftResult(NamedTuple):
+    host: str
+    fingerprint: Optional[str]
+    expected_fingerprint: Optional[str]
+    changes: List[str]
+    accepted: bool
+    error: Optional[str]
+
+    @property
+    def drifted(self) -> bool:
+        return self.error is None and self.fingerprint != self.expected_fingerprint
+
+    def to_record(self) -> Dict[str, Any]:
+        return {"drifted": self.drifted, "fingerprint": self.fingerprint,
+                "expected_fingerprint": self.expected_fingerprint, "changes": self.changes,
+                "accepted": self.accepted, "error": self.error}
+
+
+def expected_fingerprint(baseline: Dict[str, Any]) -> str:
+    # The snapshots taken before the fingerprint was added to them get theirs from the VLAN section
+    fingerprint = baseline["vlan"].get("fingerprint")
+    return fingerprint if fingerprint is not None else page_fingerprint(snapshot_vlan_page(baseline))
+
+
+def check_drift(client: Client, baseline: Dict[str, Any]) -> DriftResult:
+    # One GET of vlan.html per switch. A switch whose page has the fingerprint of the baseline (read from a
+    # few fields, see `html_fingerprint`) is done without parsing the page. Only the other switches,
+    # which are rare for a sweep over the whole fleet, have the page parsed and compared with the baseline
+    expected = expected_fingerprint(baseline)
+    resp = client.get(VLAN_PAGE_PATH)
+    if resp.status_code == 200 and html_fingerprint(resp.text) == expected:
+        return DriftResult(host=baseline["host"], fingerprint=expected, expected_fingerprint=expected,
+                           changes=[], accepted=False, error=None)
+
+    try:
+        page = parse_vlan_page(resp.text)
+    except Exception as err:
+        bad_request(resp, err=err)
+    client.cache_page(VLAN_PAGE_PATH, page)
+    fingerprint = page_fingerprint(page)
+    changes = []
+    if fingerprint != expected:
+        expected_page = snapshot_vlan_page(baseline)
+        if expected_page.mode != page.mode:
+            changes.append(f"~ VLAN mode: {expected_page.mode.name} -> {page.mode.name}")
+        changes += diff_vlans(expected_page.vlans, page.vlans)
+        changes += diff_pvids(page_pvids(expected_page), page_pvids(page))
+    return DriftResult(host=baseline["host"], fingerprint=fingerprint, expected_fingerprint=expected,
+                       changes=changes, accepted=False, error=None)
+
+
+def _drift_host(args: argparse.Namespace, host: Host, path: Path) -> DriftResult:
+    try:
+        baseline = load_snapshot(f"{path}")
+        client = Client.from_args(args, host=host.host, port=host.port)
+        client.login(password=args.password)
+        result = check_drift(client, baseline)
+        if result.drifted and args.drift_accept:
+            # The switch is right and the baseline is stale, e.g. after a change made on the web interface
+            write_snapshot(path, take_snapshot(client))
+            result = result._replace(accepted=True)
+        return result
+    except Exception as err:
+        return DriftResult(host=f"{host}", fingerprint=None, expected_fingerprint=None, changes=[],
+                           accepted=False, error=f"{err}")
+
+
+def _baseline_hosts(args: argparse.Namespace) -> Dict[Host, Path]:
+    if args.hosts:
+        return {host: snapshot_path(args.drift_baseline_dir, host=host.host, port=host.port) for host in args.hosts}
+
+    hosts = {}
+    for path in sorted(Path(args.drift_baseline_dir).glob("*.json")):
+        hosts[parse_host(load_snapshot(f"{path}")["host"], default_port=args.port)] = path
+    return hosts
+
+
+def sub_cmd_drift(args: argparse.Namespace) -> int:
+    if args.password is None:
+        print("Error: The password for the switches have to be provided with --password")
+        return 1
+    try:
+        hosts = _baseline_hosts(args)
+    except Exception as err:
+        print(f"Error: {err}")
+        return 1
+    if not hosts:
+        print(f"Error: There are no snapshots in `{args.drift_baseline_dir}`")
+        return 1
+
+    def run(host: Host, path: Path) -> DriftResult:
+        with record_host(f"{host}"):
+            result = _drift_host(args, host, path)
+            emit("drift", path=f"{path}", **result.to_record())
+        return result
+
+    drifted = failed = 0
+    # The switches are reported as they finish, a sweep over the whole fleet takes as long as the slowest one
+    with ThreadPoolExecutor(max_workers=max(1, min(args.workers, hosts.__len__()))) as executor:
+        futures = {executor.submit(copy_context().run, run, host, path): host for host, path in hosts.items()}
+        for future in as_completed(futures):
+            host, result = futures[future], future.result()
+            if result.error is not None:
+                failed += 1
+                print(f"[{host}] FAILED - {result.error}")
+            elif not result.drifted:
+                print(f"[{host}] OK - fingerprint {result.fingerprint[:12]}")
+            else:
+                drifted += 1
+                accepted = ", accepted as the new baseline" if result.accepted else ""
+                print(f"[{host}] DRIFTED - fingerprint {result.fingerprint[:12]}, "
+                      f"expected {result.expected_fingerprint[:12]}{accepted}")
+                for change in result.changes:
+                    print(f"[{host}] {change}")
+
+    print(f"Checked {hosts.__len__()} switches: {drifted} drifted, "
+          f"{hosts.__len__() - drifted - failed} match their snapshot, {failed} failed")
+    return 1 if failed or (drifted and not args.drift_accept) else 0
@@ -0,0 +1,431 @@
+import argparse
+import re
+import secrets
+import threading
+from collections import Counter
+from hashlib import md5
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep, time
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from .login_page import _merge
+from .misc import switch_port_iter
+
+# The real web pages ship a lot of inline JavaScript and translations, so pad the
+# pages to a comparable size to keep transfer and parse costs realistic
+_PAGE_FILLER = "<script type=\"text/javascript\">\n" + "".join(
+    f"var lang_str_{index} = \"Translated text for the element number {index}\";\n" for index in range(400)
+) + "</script>\n"
+
+
+class EmulatedSwitch:
+    def __init__(self, password: str = "password", firmware_version: str = "1.0.4.4",
+                 latency: float = 0.0, reboot_sec: float = 5.0, max_concurrent: int = 0):
+        self.lock = threading.RLock()
+        self.password = password
+        self.firmware_version = firmware_version
+        self.latency = latency
+        self.reboot_sec = reboot_sec
+
+        # Like the web server of the switch, only `max_concurrent` requests are worked on at the same time
+        # and as many wait for their turn, the connections of the requests after them are dropped
+        self.max_concurrent = max_concurrent
+        self._slots = threading.Semaphore(max(1, max_concurrent))
+        self._waiting = 0
+
+        self.rand = f"{secrets.randbelow(10 ** 9):09d}"
+        self.token: Optional[str] = None
+        self.boot_time = time()
+        self.rebooting_until = 0.0
+
+        self.vlan_mode = "adv8021Q"
+        self.vlans: Dict[int, list] = {}
+        self.pvids: Dict[int, int] = {}
+        self.reset_vlans()
+
+        self.mirror_src_ports = "0" * 16
+        self.mirror_dest_port = -1
+
+        # A few powered devices and links, so the status pages have something to show
+        self.poe_power_w = {port_no: 4.5 if port_no <= 4 else 0.0 for port_no in switch_port_iter(include_port_16=False)}
+        self.link_speeds = {port_no: 1000 if port_no <= 8 or port_no == 16 else 0 for port_no in switch_port_iter()}
+        # [admin mode, priority, power limit in watts]
+        self.poe_settings = {port_no: ["Enable", "Low", 30.0] for port_no in switch_port_iter(include_port_16=False)}
+
+        self.stats_requests = Counter()
+        self.stats_bytes = Counter()
+        self.stats_dropped = 0
+
+    def reset_vlans(self):
+        self.vlans = {1: ["Default", "2" * 16]}
+        self.pvids = {port_no: 1 for port_no in switch_port_iter()}
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats_requests.clear()
+            self.stats_bytes.clear()
+            self.stats_dropped = 0
+
+    def admit(self) -> bool:
+        if not self.max_concurrent:
+            return True
+        with self.lock:
+            if self._waiting >= self.max_concurrent:
+                self.stats_dropped += 1
+                return False
+            self._waiting += 1
+        self._slots.acquire()
+        with self.lock:
+            self._waiting -= 1
+        return True
+
+    def release(self):
+        if self.max_concurrent:
+            self._slots.release()
+
+    def is_rebooting(self) -> bool:
+        return self.rebooting_until > time()
+
+    def reboot(self):
+        self.token = None
+        self.rebooting_until = time() + self.reboot_sec
+        self.boot_time = self.rebooting_until
+
+    def uptime_str(self) -> str:
+        uptime = int(max(0.0, time() - self.boot_time))
+        return f"{uptime // 3600} hrs, {uptime // 60 % 60} mins, {uptime % 60} secs"
+
+
+def _page(title: str, body: str, token: str = None, onload: str = "") -> str:
+    gambit = "" if token is None else f"<input type=\"hidden\" name=\"Gambit\" value=\"{token}\">\n"
+    return (
+        f"<!DOCTYPE html>\n<html>\n<head>\n<title>{title}</title>\n{_PAGE_FILLER}</head>\n"
+        f"<body onload=\"{onload}\">\n{gambit}{body}</body>\n</html>\n"
+    )
+
+
+def _login_page(switch: EmulatedSwitch, error: str = "") -> str:
+    return _page("Login", (
+        "<form id=\"loginForm\" action=\"/redirect.html\" method=\"post\">\n"
+        "<input type=\"password\" name=\"LoginPassword\" id=\"password\">\n"
+        f"<input type=\"hidden\" id=\"rand\" value=\"{switch.rand}\">\n"
+        f"<span id=\"loginPageErrorMsg\">{escape(error)}</span>\n"
+        "</form>\n"
+    ), onload="document.getElementById('password').focus()")
+
+
+def _vlan_page(switch: EmulatedSwitch, error: str = "") -> str:
+    vlan_items = "".join(
+        "<li class=\"list-item\">\n"
+        f"<span class=\"vlan-id\" list-vid=\"4\">{vlan_id}</span>\n"
+        f"<span class=\"vlan-name\" list-vnm=\"4\">{escape(name)}</span>\n"
+        f"<input type=\"hidden\" list-vhidmem=\"4\" value=\"{members}\">\n"
+        "</li>\n"
+        for vlan_id, (name, members) in sorted(switch.vlans.items())
+    )
+
+    pvid_items = ""
+    for port_no in switch_port_iter():
+        vlan_ids = [
+            f"{vlan_id}*" if vlan_id == switch.pvids[port_no] else f"{vlan_id}"
+            for vlan_id, (_, members) in sorted(switch.vlans.items())
+            if members[port_no - 1] != "3"
+        ]
+        pvid_items += (
+            "<li class=\"list-item\">\n"
+            f"<span class=\"port-count\">{port_no}</span>\n"
+            f"<span class=\"hid-txt pvid-table-vlan-list\">{','.join(vlan_ids)}</span>\n"
+            "</li>\n"
+        )
+
+    return _page("VLAN", (
+        f"<div class=\"error-msg\">{escape(error)}</div>\n"
+        f"<div class=\"vlan-mode\" vlanmode=\"{switch.vlan_mode}\">"
+        f"<span class=\"status-text\">{switch.vlan_mode}</span></div>\n"
+        f"<ul id=\"AQVTbl\" class=\"list-table\">\n{vlan_items}</ul>\n"
+        f"<ul id=\"pvidList\" class=\"list-table\">\n{pvid_items}</ul>\n"
+    ), token=switch.token)
+
+
+def _mirror_page(switch: EmulatedSwitch) -> str:
+    return _page("Port Mirroring", (
+        "<div id=\"mirrorConfig\">\n"
+        f"<input type=\"hidden\" id=\"sessionMode\" value=\"{0 if switch.mirror_dest_port != -1 else 1}\">\n"
+        f"<input type=\"hidden\" id=\"sourcePort\" value=\"{switch.mirror_src_ports}\">\n"
+        f"<input type=\"hidden\" id=\"destPort\" value=\"{switch.mirror_dest_port}\">\n"
+        "</div>\n"
+    ), token=switch.token)
+
+
+def _dashboard_page(switch: EmulatedSwitch) -> str:
+    return _page("Dashboard", (
+        "<div id=\"timezone-area\"><span>UTC</span></div>\n"
+        f"<div class=\"uptime-area\"><span> {switch.uptime_str()} </span></div>\n"
+    ), token=switch.token)
+
+
+def _poe_status_page(switch: EmulatedSwitch) -> str:
+    items = "".join(
+        "<li class=\"list-item\">\n"
+        f"<span class=\"port-count\">{port_no}</span>\n"
+        f"<span class=\"poe-status\">{'Delivering Power' if power_w else 'Searching'}</span>\n"
+        f"<span class=\"poe-power\">{power_w:.1f}</span>\n"
+        f"<span class=\"poe-class\">{'Class2' if power_w else 'Unknown'}</span>\n"
+        "</li>\n"
+        for port_no, power_w in sorted(switch.poe_power_w.items())
+    )
+    return _page("PoE Port Status", f"<ul id=\"poePortStatusTbl\" class=\"list-table\">\n{items}</ul>\n",
+                 token=switch.token)
+
+
+def _poe_config_page(switch: EmulatedSwitch) -> str:
+    items = "".join(
+        "<li class=\"list-item\">\n"
+        f"<span class=\"port-count\">{port_no}</span>\n"
+        f"<span class=\"poe-admin\">{admin}</span>\n"
+        f"<span class=\"poe-priority\">{priority}</span>\n"
+        f"<span class=\"poe-power-limit\">{power_limit_w:.1f}</span>\n"
+        "</li>\n"
+        for port_no, (admin, priority, power_limit_w) in sorted(switch.poe_settings.items())
+    )
+    return _page("PoE Port Configuration", f"<ul id=\"poePortConfTbl\" class=\"list-table\">\n{items}</ul>\n",
+                 token=switch.token)
+
+
+def _port_status_page(switch: EmulatedSwitch) -> str:
+    items = "".join(
+        "<li class=\"list-item\">\n"
+        f"<span class=\"port-count\">{port_no}</span>\n"
+        f"<span class=\"port-link\">{'Up' if speed else 'Down'}</span>\n"
+        f"<span class=\"port-speed\">{f'{speed}M' if speed else '-'}</span>\n"
+        "</li>\n"
+        for port_no, speed in sorted(switch.link_speeds.items())
+    )
+    return _page("Port Status", f"<ul id=\"portStatusTbl\" class=\"list-table\">\n{items}</ul>\n",
+                 token=switch.token)
+
+
+def _firmware_page(switch: EmulatedSwitch) -> str:
+    return _page("Firmware", (
+        "<span class=\"heading-1\">FIRMWARE</span>\n"
+        f"<span class=\"firm-data\">{switch.firmware_version}</span>\n"
+    ), token=switch.token)
+
+
+def _homepage(switch: EmulatedSwitch) -> str:
+    return _page("Home", "<div id=\"homepage\">GS316EP</div>\n", token=switch.token, onload="loadHomePage()")
+
+
+def _handle_vlan_post(switch: EmulatedSwitch, form: Dict[str, str]) -> str:
+    if "VLAN_MOD_SET" in form:
+        if form["VLAN_MOD_SET"] != switch.vlan_mode:
+            switch.vlan_mode = form["VLAN_MOD_SET"]
+            switch.reset_vlans()
+        return _vlan_page(switch)
+
+    action = form.get("ACTION")
+    if action == "add":
+        vlan_id = int(form["VLAN_ID"])
+        members = form["hiddenMem"]
+        for port_no in switch_port_iter():
+            if members[port_no - 1] == "3" and switch.pvids[port_no] == vlan_id:
+                return _vlan_page(switch, error=f"Cannot remove port {port_no} from this VLAN. Change its PVID first")
+        switch.vlans[vlan_id] = [form["VLAN_NAME"], members]
+
+    elif action == "setPvid":
+        port_no = int(form["PORT"])
+        vlan_id = int(form["PVID"])
+        if vlan_id not in switch.vlans or switch.vlans[vlan_id][1][port_no - 1] == "3":
+            return _vlan_page(switch, error=f"Port {port_no} is not a member of the VLAN {vlan_id}")
+        switch.pvids[port_no] = vlan_id
+
+    elif action == "delete":
+        vlan_id = int(form["VLAN_ID"])
+        if vlan_id == 1 or vlan_id in switch.pvids.values():
+            return _vlan_page(switch, error="You can not remove this VLAN")
+        switch.vlans.pop(vlan_id, None)
+
+    return _vlan_page(switch)
+
+
+def _handle_mirror_post(switch: EmulatedSwitch, form: Dict[str, str]) -> str:
+    if form.get("SessionMode") == "1":
+        switch.mirror_src_ports = "0" * 16
+        switch.mirror_dest_port = -1
+        return "SUCCESS"
+
+    src_ports = form.get("SourcePort", "")
+    if not re.fullmatch(r"[01]{16}", src_ports):
+        return "ERROR"
+    switch.mirror_src_ports = src_ports
+    switch.mirror_dest_port = int(form.get("DestPort", "-1"))
+    return "SUCCESS"
+
+
+def _handle_poe_post(_switch: EmulatedSwitch, form: Dict[str, str]) -> str:
+    if form.get("TYPE") == "resetPoe" and re.fullmatch(r"[01]{15}", form.get("PoePort", "")):
+        return "SUCCESS"
+    return "ERROR"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # The headers and the body are written separately, without TCP_NODELAY the body of an answer on a
+    # kept alive connection waits for the delayed ACK of the client (~40ms)
+    disable_nagle_algorithm = True
+    server: "EmulatorServer"
+
+    def log_message(self, *_args):
+        pass
+
+    def _read_body(self) -> bytes:
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            body = b""
+            while True:
+                size = int(self.rfile.readline().split(b";")[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return body
+                body += self.rfile.read(size)
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get("Content-Length", "0")))
+
+    def _send(self, text: str, status: int = 200):
+        body = text.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", f"{body.__len__()}")
+        self.end_headers()
+        self.wfile.write(body)
+
+        switch = self.server.switch
+        with switch.lock:
+            switch.stats_requests[f"{self.command} {urlsplit(self.path).path}"] += 1
+            switch.stats_bytes[f"{self.command} {urlsplit(self.path).path}"] += body.__len__()
+
+    def _handle(self, body: bytes):
+        switch = self.server.switch
+        if not switch.admit():
+            self.close_connection = True
+            return
+        try:
+            self._handle_admitted(switch, body)
+        finally:
+            switch.release()
+
+    def _handle_admitted(self, switch: EmulatedSwitch, body: bytes):
+        if switch.latency:
+            sleep(switch.latency)
+
+        if switch.is_rebooting():
+            self.close_connection = True
+            return
+
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        form = {}
+        if self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+            form = {key: values[-1] for key, values in parse_qs(body.decode()).items()}
+
+        with switch.lock:
+            self._send(self._route(switch, url.path, params, form, body))
+
+    def _route(self, switch: EmulatedSwitch, path: str, params: Dict[str, str], form: Dict[str, str],
+               body: bytes) -> str:
+        if path == "/" and self.command == "GET":
+            switch.rand = f"{secrets.randbelow(10 ** 9):09d}"
+            return _login_page(switch)
+
+        if path == "/redirect.html" and self.command == "POST":
+            expected = md5(_merge(switch.password, switch.rand).encode()).hexdigest()
+            if form.get("LoginPassword") != expected:
+                return _login_page(switch, error="The password is invalid")
+            switch.token = secrets.token_hex(16)
+            return _homepage(switch)
+
+        # Like the switch, answer requests without a valid session with a short redirect to the login page
+        gambit = form.get("Gambit", params.get("Gambit"))
+        if switch.token is None or gambit != switch.token:
+            return "<html><head><script>window.top.location.href = \"/\";</script></head><body></body></html>"
+
+        if path == "/homepage.html":
+            return _homepage(switch)
+        if path == "/iss/specific/vlan.html":
+            return _handle_vlan_post(switch, form) if self.command == "POST" else _vlan_page(switch)
+        if path == "/iss/specific/port_monitorconfig.html":
+            return _handle_mirror_post(switch, form) if self.command == "POST" else _mirror_page(switch)
+        if path == "/iss/specific/poePortConf.html":
+            return _handle_poe_post(switch, form) if self.command == "POST" else _poe_config_page(switch)
+        if path == "/iss/specific/dashboard.html":
+            return _dashboard_page(switch)
+        if path == "/iss/specific/poePortStatus.html":
+            return _poe_status_page(switch)
+        if path == "/iss/specific/portStatus.html":
+            return _port_status_page(switch)
+        if path == "/iss/specific/firmware.html":
+            return _firmware_page(switch)
+        if path == "/iss/file/post/image1" and self.command == "POST":
+            version = re.search(rb"filename=\"[^\"]*?(?P<version>[0-9]+\.[0-9]+\.[0-9]+\.[0-9]+)", body)
+            if version:
+                switch.firmware_version = version.group("version").decode()
+            page = _firmware_page(switch)
+            switch.reboot()
+            return page
+
+        return "<html><body>Not Found</body></html>"
+
+    def do_GET(self):
+        self._handle(b"")
+
+    def do_POST(self):
+        self._handle(self._read_body())
+
+
+class EmulatorServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, switch: EmulatedSwitch, host: str = "127.0.0.1", port: int = 0):
+        super(EmulatorServer, self).__init__((host, port), _Handler)
+        self.switch = switch
+
+    @property
+    def host(self) -> str:
+        return self.server_address[0]
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+
+def start_emulator(host: str = "127.0.0.1", port: int = 0, **kwargs) -> EmulatorServer:
+    server = EmulatorServer(EmulatedSwitch(**kwargs), host=host, port=port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="Netgear Switch (GS316EP) Emulator")
+    parser.add_argument("--listen", dest="listen", type=str, default="127.0.0.1",
+                        help="The address the emulator listens on")
+    parser.add_argument("--port", dest="port", type=int, default=8080,
+                        help="The port the emulator listens on")
+    parser.add_argument("--password", dest="password", type=str, default="password",
+                        help="The password of the emulated switch")
+    parser.add_argument("--latency", dest="latency", type=float, default=0.0,
+                        help="Seconds the emulated switch waits before answering each request")
+    parser.add_argument("--max-concurrent", dest="max_concurrent", type=int, default=0,
+                        help="The number of requests answered at the same time, as many more wait and the "
+                             "connections after them are dropped (default: no limit)")
+    args = parser.parse_args()
+
+    server = EmulatorServer(EmulatedSwitch(password=args.password, latency=args.latency,
+                                           max_concurrent=args.max_concurrent),
+                            host=args.listen, port=args.port)
+    print(f"Emulating a GS316EP on http://{server.host}:{server.port}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+import argparse
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import time
+from typing import Callable, Dict, List, NamedTuple, Optional, TypeVar
+
+from .client import Client
+from .daemon import SessionPool
+from .firmware import update_time
+from .inventory import Host
+from .telemetry import PoEPortStatus, PortStatus, get_poe_status, get_port_status
+from .trace import operation
+
+T = TypeVar("T")
+
+
+class SwitchMetrics(NamedTuple):
+    host: Host
+    up: bool
+    scrape_time: float
+    duration_sec: float
+    uptime: Optional[timedelta] = None
+    # None when the page could not be read, its metric family is left out for the switch and
+    # `gs316ep_page_error` says so
+    poe: Optional[Dict[int, PoEPortStatus]] = None
+    ports: Optional[Dict[int, PortStatus]] = None
+    error: Optional[str] = None
+
+
+class _CacheEntry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics: Optional[SwitchMetrics] = None
+
+
+class MetricsCollector:
+    # The switches are scraped in parallel, and the result of each switch is reused for `cache_ttl_sec`.
+    # The lock of a switch is held while it is scraped, so scrapes arriving at the same time wait for
+    # the one in flight and get its result, instead of sending the same requests to the switch again
+    def __init__(self, args: argparse.Namespace, hosts: List[Host], cache_ttl_sec: float = 30.0,
+                 max_workers: int = 8, pool: SessionPool = None):
+        self.args = args
+        self.hosts = hosts
+        self.cache_ttl_sec = cache_ttl_sec
+        self.pool = pool or SessionPool()
+        self._entries = {host: _CacheEntry() for host in hosts}
+        self._warned = set()
+        self._warned_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, hosts.__len__())))
+
+    def collect(self) -> List[SwitchMetrics]:
+        # Called from the threads of the HTTP server, which start with an empty context
+        with operation("scrape"):
+            futures = [self._executor.submit(copy_context().run, self._cached_scrape, host) for host in self.hosts]
+        return [future.result() for future in futures]
+
+    def _cached_scrape(self, host: Host) -> SwitchMetrics:
+        entry = self._entries[host]
+        with entry.lock:
+            if entry.metrics is None or time() - entry.metrics.scrape_time >= self.cache_ttl_sec:
+                entry.metrics = self._scrape(host)
+            return entry.metrics
+
+    def _scrape(self, host: Host) -> SwitchMetrics:
+        time_start = time()
+        try:
+            with self.pool.session(self.args, host) as client:
+                uptime = update_time(client)
+                poe = self._optional(host, "PoE", get_poe_status, client)
+                ports = self._optional(host, "port", get_port_status, client)
+        except Exception as err:
+            # A failed scrape is cached as well, so a switch which is down is not asked by every scrape
+            return SwitchMetrics(host=host, up=False, scrape_time=time(), duration_sec=time() - time_start,
+                                 error=f"{err}")
+
+        return SwitchMetrics(host=host, up=True, scrape_time=time(), duration_sec=time() - time_start,
+                             uptime=uptime, poe=poe, ports=ports)
+
+    def _optional(self, host: Host, family: str, getter: Callable[[Client], T], client: Client) -> Optional[T]:
+        # The layouts of the status pages are not verified against the pages of a real firmware yet, so a
+        # page which cannot be read only leaves out its metrics, and sets `gs316ep_page_error` for them.
+        # The error is printed once per switch, not per scrape
+        try:
+            return getter(client)
+        except Exception as err:
+            with self._warned_lock:
+                if (host, family) not in self._warned:
+                    self._warned.add((host, family))
+                    print(f"Warning: [{host}] The {family} status is left out of the metrics - "
+                          f"{f'{err}'.splitlines()[0]}", file=sys.stderr, flush=True)
+            return None
+
+
+_METRICS = [
+    ("gs316ep_up", "Whether the last scrape of the switch succeeded"),
+    ("gs316ep_scrape_duration_seconds", "Seconds the last scrape of the switch took"),
+    ("gs316ep_scrape_age_seconds", "Seconds since the switch was scraped, the results are cached"),
+    ("gs316ep_uptime_seconds", "Seconds since the switch booted"),
+    ("gs316ep_page_error", "Whether the status page of the metric family could not be read, "
+                           "its metrics are left out for the switch"),
+    ("gs316ep_poe_delivering", "Whether the port delivers PoE power"),
+    ("gs316ep_poe_power_watts", "The PoE power the port delivers"),
+    ("gs316ep_port_up", "Whether the link of the port is up"),
+    ("gs316ep_port_speed_mbps", "The link speed of the port, 0 when the link is down"),
+]
+
+
+def render_metrics(results: List[SwitchMetrics]) -> str:
+    samples: Dict[str, List[str]] = {name: [] for name, _help in _METRICS}
+    now = time()
+    for result in results:
+        switch = f"switch=\"{result.host}\""
+        samples["gs316ep_up"].append(f"{{{switch}}} {1 if result.up else 0}")
+        samples["gs316ep_scrape_duration_seconds"].append(f"{{{switch}}} {result.duration_sec:.3f}")
+        samples["gs316ep_scrape_age_seconds"].append(f"{{{switch}}} {now - result.scrape_time:.3f}")
+        if not result.up:
+            continue
+
+        samples["gs316ep_uptime_seconds"].append(f"{{{switch}}} {result.uptime.total_seconds():.0f}")
+        for family, page in (("poe", result.poe), ("port", result.ports)):
+            samples["gs316ep_page_error"].append(f"{{{switch},family=\"{family}\"}} {1 if page is None else 0}")
+        for port_no, poe in sorted((result.poe or {}).items()):
+            samples["gs316ep_poe_delivering"].append(f"{{{switch},port=\"{port_no}\"}} {1 if poe.delivering else 0}")
+            samples["gs316ep_poe_power_watts"].append(f"{{{switch},port=\"{port_no}\"}} {poe.power_w}")
+        for port_no, port in sorted((result.ports or {}).items()):
+            samples["gs316ep_port_up"].append(f"{{{switch},port=\"{port_no}\"}} {1 if port.link_up else 0}")
+            samples["gs316ep_port_speed_mbps"].append(f"{{{switch},port=\"{port_no}\"}} {port.speed_mbps}")
+
+    lines = []
+    for name, help_text in _METRICS:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.extend(f"{name}{sample}" for sample in samples[name])
+    return "\n".join(lines) + "\n"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "ExporterServer"
+
+    def log_message(self, *_args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+
+        body = render_metrics(self.server.collector.collect()).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", f"{body.__len__()}")
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class ExporterServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, collector: MetricsCollector, host: str = "127.0.0.1", port: int = 9316):
+        super(ExporterServer, self).__init__((host, port), _Handler)
+        self.collector = collector
+
+
+def sub_cmd_exporter(args: argparse.Namespace) -> int:
+    if not args.hosts:
+        print("Error: At least one switch have to be provided with --host or --inventory")
+        return 1
+    if args.password is None:
+        print("Error: The password for the switches have to be provided with --password")
+        return 1
+
+    collector = MetricsCollector(args, hosts=args.hosts, cache_ttl_sec=args.exporter_cache_ttl,
+                                 max_workers=args.workers)
+    listen_host, _, listen_port = args.exporter_listen.rpartition(":")
+    server = ExporterServer(collector, host=listen_host or "127.0.0.1", port=int(listen_port))
+    print(f"The exporter is serving the metrics of {args.hosts.__len__()} switches on "
+          f"http://{server.server_address[0]}:{server.server_address[1]}/metrics")
+    sys.stdout.flush()
+    server.serve_forever()
+    return 0
@@ -1,20 +1,76 @@
 import argparse
 import io
+import json
 import re
+import socket
 from datetime import timedelta
+from hashlib import sha256
+from pathlib import Path
 from time import sleep, time
-from typing import List
-from zipfile import ZipFile
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, BinaryIO, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+from uuid import uuid4
+from zipfile import ZipFile, ZipInfo
 
 import requests
 from bs4 import BeautifulSoup
 
 from .client import Client
-from .misc import bad_request
+from .misc import bad_request, file_lock
+from .output import emit
+from .steps import Request, Steps, drive, drive_async
+from .trace import operation, traced_parser
+
+if TYPE_CHECKING:
+    from .async_client import AsyncClient
+
+FIRMWARE_CACHE_DIR = Path.home() / ".cache" / "netgear-gs316ep" / "firmware"
+# https://www.netgear.com/support/product/gs316ep/#download
+FIRMWARE_METADATA_URL = "https://www.netgear.com/api/v2/product/getproductdetails?componentId=117073&publicationId=11"
+_CHUNK_SIZE = 64 * 1024
+DASHBOARD_PATH = "/iss/specific/dashboard.html"
+
+
+class FirmwareRelease(NamedTuple):
+    version: str
+    url: Optional[str] = None
+    path: Optional[Path] = None
+
+
+class FirmwareUpdateResult(NamedTuple):
+    updated: bool
+    old_version: str
+    new_version: str
+    duration_sec: float
+
+    def to_record(self) -> Dict[str, Any]:
+        return {"updated": self.updated, "old_version": self.old_version, "new_version": self.new_version,
+                "duration_sec": round(self.duration_sec, 3)}
+
+    def __str__(self):
+        return "{}".format({
+            "status_code": 1 if self.updated else 0,
+            "status": "Updated firmware" if self.updated else "No new updates",
+            "update_time_sec": self.duration_sec,
+            "old_version_str": self.old_version, "old_version_int": _version2int(self.old_version),
+            "new_version_str": self.new_version, "new_version_int": _version2int(self.new_version),
+        })
+
+
+def _print_reboot_progress(state: str, elapsed_sec: float):
+    print(f"Waiting for the switch to reboot ({elapsed_sec:.0f}s) - {state}")
+    emit("reboot_progress", state=state, elapsed_sec=round(elapsed_sec, 3))
 
 
 def sub_cmd_update(client: Client, _args: argparse.Namespace):
-    result = update(client)
+    result = update(
+        client,
+        firmware_cache_dir=Path(_args.firmware_cache_dir) if _args.firmware_cache_dir else FIRMWARE_CACHE_DIR,
+        firmware_dir=Path(_args.firmware_dir) if _args.firmware_dir else None,
+        metadata_ttl_sec=_args.firmware_metadata_ttl,
+        progress=_print_reboot_progress,
+    )
+    emit("firmware_update", **result.to_record())
     print(result)
 
 
@@ -25,9 +81,9 @@ def _version2int(version: str) -> List[int]:
     return version_int
 
 
-def update_time(client: Client) -> timedelta:
-    resp = client.get("/iss/specific/dashboard.html", timeout=10)
-    bs = BeautifulSoup(resp.text, 'html.parser')
+@traced_parser
+def _parse_update_time(html: str) -> timedelta:
+    bs = BeautifulSoup(html, 'html.parser')
     uptime_element = bs.find('div', id="timezone-area").find_next_sibling()
     uptime_string = uptime_element.find('span').decode_contents().strip()
     result = re.search(
@@ -41,18 +97,23 @@ def update_time(client: Client) -> timedelta:
     return timedelta(hours=int(result_g['hours']), minutes=int(result_g['minutes']), seconds=int(result_g['seconds']))
 
 
-def update(client: Client, reboot_wait_sec: int = 600):
-    update_time_start = time()
-    resp = client.get("/iss/specific/firmware.html")
+def _update_time_steps() -> Steps[timedelta]:
+    resp = yield Request("GET", DASHBOARD_PATH, {"timeout": 10})
+    return _parse_update_time(resp.text)
 
-    bs = BeautifulSoup(resp.text, 'html.parser')
-    version_str = bs.find('span', attrs={"class": "firm-data"}).next_element
-    if version_str.split(".").__len__() != 4:
-        raise Exception("Version format is unknown")
 
-    # https://www.netgear.com/support/product/gs316ep/#download
-    official_resp = requests.get(
-        "https://www.netgear.com/api/v2/product/getproductdetails?componentId=117073&publicationId=11")
+def update_time(client: Client) -> timedelta:
+    return drive(client, _update_time_steps())
+
+
+async def update_time_async(client: "AsyncClient") -> timedelta:
+    return await drive_async(client, _update_time_steps())
+
+
+def _fetch_latest_firmware() -> FirmwareRelease:
+    official_resp = requests.get(FIRMWARE_METADATA_URL, timeout=30)
+    if official_resp.status_code != 200:
+        bad_request(official_resp, msg="Bad Request - Failed to look up the latest firmware")
     available_versions_json = official_resp.json()
 
     latest_versions_obj_raw = available_versions_json.get(
@@ -76,61 +137,270 @@ def update(client: Client, reboot_wait_sec: int = 600):
     if latest_version_url is None:
         raise Exception("The URL to the latest version from the official website (netgear.com) is unknown")
 
-    version_int = _version2int(version_str)
-    latest_version_int = _version2int(latest_version_str)
-    if not _version2int(version_str) < _version2int(latest_version_str):
-        return {"status_code": 0, "status_code": "No new updates", "update_time_sec": time() - update_time_start,
-                "old_version_str": version_str, "old_version_int": version_int,
-                "new_version_str": latest_version_str, "new_version_int": latest_version_int}
+    return FirmwareRelease(version=latest_version_str, url=latest_version_url)
+
+
+def get_latest_firmware(cache_dir: Path = FIRMWARE_CACHE_DIR, ttl_sec: int = 3600) -> FirmwareRelease:
+    # The lookup is shared by all the switches and runs on this host until it is older than the TTL,
+    # the lock makes sure only one of them asks netgear.com when it has expired
+    cache_path = cache_dir / "latest.json"
+    with file_lock(cache_dir / ".latest.lock"):
+        if cache_path.is_file() and cache_path.stat().st_mtime > time() - ttl_sec:
+            cached = json.loads(cache_path.read_text())
+            return FirmwareRelease(version=cached["version"], url=cached["url"])
+
+        release = _fetch_latest_firmware()
+        cache_path.write_text(json.dumps({"version": release.version, "url": release.url}, indent=4))
+        return release
+
+
+def get_local_firmware(firmware_dir: Path) -> FirmwareRelease:
+    releases = []
+    for path in firmware_dir.iterdir():
+        if path.suffix.lower() not in {".image", ".zip"}:
+            continue
+
+        version = re.search(r"(?P<version>[0-9]+\.[0-9]+\.[0-9]+\.[0-9]+)", path.name)
+        if version:
+            releases.append(FirmwareRelease(version=version.group("version"), path=path))
+
+    if not releases:
+        raise Exception(f"No firmware (.image or .zip file with the version in the name) found in `{firmware_dir}`")
+
+    return max(releases, key=lambda release: _version2int(release.version))
 
-    latest_version_firmware_data = requests.get(latest_version_url)
 
-    zip_file_content = io.BytesIO(latest_version_firmware_data.content)
+def fetch_firmware(release: FirmwareRelease, cache_dir: Path = FIRMWARE_CACHE_DIR) -> Path:
+    if release.path is not None:
+        return release.path
+    return download_firmware(release.url, cache_dir=cache_dir)
 
-    zip_file = ZipFile(zip_file_content)
+
+def _sha256_file(path: Path) -> str:
+    hash_obj = sha256()
+    with path.open("rb") as file:
+        for chunk in iter(lambda: file.read(_CHUNK_SIZE), b""):
+            hash_obj.update(chunk)
+    return hash_obj.hexdigest()
+
+
+def _firmware_image_info(zip_file: ZipFile) -> ZipInfo:
     zip_file_content_objs_firmware = [x for x in zip_file.filelist if x.filename.lower().endswith(".image")]
     if zip_file_content_objs_firmware.__len__() != 1:
         raise Exception("Was unable to located the firmware file in the zip file "
                         "download from the official website (netgear.com)")
+    return zip_file_content_objs_firmware[0]
+
+
+def download_firmware(url: str, cache_dir: Path = FIRMWARE_CACHE_DIR) -> Path:
+    # The zip files are stored by their SHA256, and the index maps the download URL to the SHA256,
+    # so every version is only downloaded once, also when many switches are updated at the same time
+    index_path = cache_dir / "index.json"
+    with file_lock(cache_dir / ".lock"):
+        index: Dict[str, str] = json.loads(index_path.read_text()) if index_path.is_file() else {}
+
+        checksum = index.get(url)
+        if checksum is not None:
+            firmware_path = cache_dir / f"{checksum}.zip"
+            if firmware_path.is_file() and _sha256_file(firmware_path) == checksum:
+                return firmware_path
+
+        download_path = cache_dir / f".download-{uuid4().hex}"
+        hash_obj = sha256()
+        try:
+            with requests.get(url, stream=True, timeout=30) as resp:
+                if resp.status_code != 200:
+                    bad_request(resp, msg="Bad Request - Failed to download the firmware")
+
+                with download_path.open("wb") as file:
+                    for chunk in resp.iter_content(chunk_size=_CHUNK_SIZE):
+                        hash_obj.update(chunk)
+                        file.write(chunk)
+
+            with ZipFile(download_path) as zip_file:
+                _firmware_image_info(zip_file)
+                if zip_file.testzip() is not None:
+                    raise Exception(f"The firmware zip file downloaded from `{url}` is corrupt")
 
-    zip_file_content_obj_firmware = zip_file_content_objs_firmware[0]
-    latest_firmware_raw_data = zip_file.read(zip_file_content_obj_firmware.filename)
+            checksum = hash_obj.hexdigest()
+            firmware_path = cache_dir / f"{checksum}.zip"
+            download_path.replace(firmware_path)
+        finally:
+            download_path.unlink(missing_ok=True)
+
+        index[url] = checksum
+        index_path.write_text(json.dumps(index, indent=4))
+        return firmware_path
+
+
+class _MultipartFileStream:
+    # A multipart/form-data body which reads the file while it is sent, instead of building the
+    # whole body in memory like `files=` does. The length is known up front, so it is sent with
+    # a Content-Length header
+    def __init__(self, fields: Dict[str, str], file_field: str, filename: str, file_obj: BinaryIO, file_size: int):
+        self.boundary = uuid4().hex
+        preamble = b"".join(
+            f"--{self.boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n{value}\r\n".encode()
+            for name, value in fields.items()
+        )
+        preamble += (
+            f"--{self.boundary}\r\nContent-Disposition: form-data; name=\"{file_field}\"; filename=\"{filename}\"\r\n"
+            f"Content-Type: application/octet-stream\r\n\r\n"
+        ).encode()
+        epilogue = f"\r\n--{self.boundary}--\r\n".encode()
+
+        self._length = preamble.__len__() + file_size + epilogue.__len__()
+        self._parts = [io.BytesIO(preamble), file_obj, io.BytesIO(epilogue)]
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self) -> int:
+        return self._length
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self._length
+        result = b""
+        while self._parts and result.__len__() < size:
+            chunk = self._parts[0].read(size - result.__len__())
+            if not chunk:
+                self._parts.pop(0)
+            result += chunk
+        return result
+
+    def __iter__(self):
+        return iter(lambda: self.read(_CHUNK_SIZE), b"")
+
+
+@contextmanager
+def _open_firmware_image(firmware_path: Path) -> Iterator[Tuple[str, BinaryIO, int]]:
+    if firmware_path.suffix.lower() == ".image":
+        with firmware_path.open("rb") as firmware_file:
+            yield firmware_path.name, firmware_file, firmware_path.stat().st_size
+        return
+
+    with ZipFile(firmware_path) as zip_file:
+        firmware_info = _firmware_image_info(zip_file)
+        with zip_file.open(firmware_info) as firmware_file:
+            yield firmware_info.filename, firmware_file, firmware_info.file_size
+
+
+def upload_firmware(client: Client, firmware_path: Path) -> requests.Response:
+    with _open_firmware_image(firmware_path) as (filename, firmware_file, file_size):
+        body = _MultipartFileStream(
+            fields={"Gambit": client.get_token()},
+            file_field="fileField", filename=filename,
+            file_obj=firmware_file, file_size=file_size,
+        )
+        # The switch first answers when the whole image has been written, which takes around 3 mins
+        return client.post("/iss/file/post/image1", data=body, headers={"Content-Type": body.content_type},
+                           timeout=(client.timeout[0], 600))
+
+
+def _tcp_probe(host: str, port: int, timeout: float = 2.0) -> bool:
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def wait_for_reboot(client: Client, uptime_before: timedelta, timeout_sec: float = 600,
+                    progress: Callable[[str, float], None] = None,
+                    initial_delay_sec: float = 1.0, max_delay_sec: float = 15.0) -> timedelta:
+    # While the switch is down it is only probed with a TCP connect, the (slow) login and uptime
+    # check is first done when the web server accepts connections again. The delay between the
+    # probes grows exponentially, so waiting for many switches at the same time costs next to nothing
+    time_start = time()
+    deadline = time_start + timeout_sec
+    delay_sec = initial_delay_sec
+
+    while True:
+        # The switch cannot be probed directly when a proxy is used, so only the HTTP check is done
+        if client.proxy_url is None and not _tcp_probe(client.host, client.port):
+            state = "The switch is offline"
+        else:
+            try:
+                if client.valid_token() is False:
+                    client.login(force=True)
+                uptime_after = update_time(client)
+                if uptime_after < uptime_before:
+                    if progress:
+                        progress("The switch has rebooted", time() - time_start)
+                    return uptime_after
+                state = "The switch has not rebooted yet"
+            except Exception as err:
+                state = f"The web server is not ready - err: {err}"
+
+        if progress:
+            progress(state, time() - time_start)
+
+        remaining_sec = deadline - time()
+        if remaining_sec <= 0:
+            raise TimeoutError(f"The switch did not come back online within {timeout_sec} seconds after the update")
+
+        sleep(min(delay_sec, remaining_sec))
+        delay_sec = min(delay_sec * 2, max_delay_sec)
+
+
+@traced_parser
+def _parse_firmware_version(html: str) -> str:
+    bs = BeautifulSoup(html, 'html.parser')
+    version_str = bs.find('span', attrs={"class": "firm-data"}).next_element
+    if version_str.split(".").__len__() != 4:
+        raise Exception("Version format is unknown")
+    return version_str
+
+
+def get_firmware_version(client: Client) -> str:
+    resp = client.get("/iss/specific/firmware.html")
+    return _parse_firmware_version(resp.text)
+
+
+def get_release(firmware_cache_dir: Path = FIRMWARE_CACHE_DIR, firmware_dir: Path = None,
+                metadata_ttl_sec: int = 3600) -> FirmwareRelease:
+    if firmware_dir is not None:
+        return get_local_firmware(firmware_dir)
+    return get_latest_firmware(cache_dir=firmware_cache_dir, ttl_sec=metadata_ttl_sec)
+
+
+def update(client: Client, reboot_wait_sec: int = 600, firmware_cache_dir: Path = FIRMWARE_CACHE_DIR,
+           firmware_dir: Path = None, metadata_ttl_sec: int = 3600,
+           progress: Callable[[str, float], None] = None, release: FirmwareRelease = None) -> FirmwareUpdateResult:
+    # `release` skips the lookup of the latest firmware, e.g. when many switches get the same image
+    update_time_start = time()
+    version_str = get_firmware_version(client)
+
+    if release is not None:
+        latest_release = release
+    else:
+        latest_release = get_release(firmware_cache_dir=firmware_cache_dir, firmware_dir=firmware_dir,
+                                     metadata_ttl_sec=metadata_ttl_sec)
+    latest_version_str = latest_release.version
+
+    if not _version2int(version_str) < _version2int(latest_version_str):
+        return FirmwareUpdateResult(updated=False, old_version=version_str, new_version=latest_version_str,
+                                    duration_sec=time() - update_time_start)
+
+    firmware_path = fetch_firmware(latest_release, cache_dir=firmware_cache_dir)
 
     uptime_before_update = update_time(client)
 
     # The upload takes around 3 mins
-    resp_upload_firmware = client.post("/iss/file/post/image1", files={
-        "Gambit": (None, client.get_token()),
-        "fileField": (zip_file_content_obj_firmware.filename, latest_firmware_raw_data, 'application/octet-stream'),
-    })
+    with operation("upload"):
+        resp_upload_firmware = upload_firmware(client, firmware_path)
     bs_upload_firmware = BeautifulSoup(resp_upload_firmware.text, 'html.parser')
     if (resp_upload_firmware.status_code != 200 or
         bs_upload_firmware.find("span", attrs={"class": "heading-1"}).next_element != "FIRMWARE"):
         bad_request(resp_upload_firmware, msg="Bad Request - Firmware update failed")
 
     # The switch reboot after firmware update, so wait for it to come online again
-    sleep(5)
-    reboot_wait_time_start = time()
-    while True:
-        if reboot_wait_time_start + reboot_wait_sec > time():
-            TimeoutError(f"It is more when {reboot_wait_sec} seconds since the switch was update and rebooted")
+    client.invalidate_pages()
+    with operation("wait-for-reboot"):
+        wait_for_reboot(client, uptime_before=uptime_before_update, timeout_sec=reboot_wait_sec, progress=progress)
 
-        try:
-            if client.valid_token() is False:
-                client.login()
-            uptime_after_update = update_time(client)
-            if uptime_after_update < uptime_before_update:
-                break
-            else:
-                print("DEBUG: Have not rebooted after the update, yet!")
-        except (TimeoutError, ConnectionAbortedError) as _err:
-            pass
-        except Exception as err:
-            print(f"DEBUG: HTTP Request failed - err: {err}")
-
-    resp_new_version = client.get("/iss/specific/firmware.html")
-    bs_new_version = BeautifulSoup(resp_new_version.text, 'html.parser')
-    new_version_str = bs_new_version.find('span', attrs={"class": "firm-data"}).next_element
-    return {"status_code": 1, "status_code": "Updated firmware", "update_time_sec": time() - update_time_start,
-            "old_version_str": version_str, "old_version_int": version_int,
-            "new_version_str": new_version_str, "new_version_int": _version2int(new_version_str)}
+    new_version_str = get_firmware_version(client)
+    return FirmwareUpdateResult(updated=True, old_version=version_str, new_version=new_version_str,
+                                duration_sec=time() - update_time_start)
@@ -0,0 +1,153 @@
+import argparse
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from contextvars import copy_context
+from copy import copy
+from time import time
+from typing import Any, Awaitable, Callable, ContextManager, Iterator, List, NamedTuple, Optional, TextIO
+
+from .async_client import AsyncClient
+from .client import Client
+from .inventory import Host
+from .misc import thread_local_stdout
+from .output import emit, record_host
+from .trace import operation
+
+
+class HostResult(NamedTuple):
+    host: Host
+    exit_code: int
+    duration_sec: float
+    error: Optional[str]
+
+
+class _PrefixedWriter:
+    # Prefixes every complete line with the host it belongs to, the lock is shared by all the
+    # hosts writing to the same target, so lines from different switches never interleave
+    def __init__(self, target: TextIO, lock: threading.Lock, prefix: str):
+        self._target = target
+        self._lock = lock
+        self._prefix = prefix
+        self._buffer = ""
+
+    def write(self, text: str) -> int:
+        *lines, self._buffer = (self._buffer + text).split("\n")
+        if lines:
+            with self._lock:
+                self._target.write("".join(f"{self._prefix}{line}\n" for line in lines))
+        return text.__len__()
+
+    def finish(self):
+        if self._buffer:
+            self.write("\n")
+
+    def flush(self):
+        self._target.flush()
+
+
+def _exit_code(err: SystemExit) -> int:
+    if err.code is None:
+        return 0
+    if isinstance(err.code, int):
+        return err.code
+    print(err.code)
+    return 1
+
+
+@contextmanager
+def new_session(args: argparse.Namespace, host: Host) -> Iterator[Client]:
+    client = Client.from_args(args, host=host.host, port=host.port)
+    client.login(password=args.password)
+    yield client
+
+
+def run_on_host(args: argparse.Namespace, host: Host,
+                session: Callable[[argparse.Namespace, Host], ContextManager[Client]] = new_session) -> HostResult:
+    time_start = time()
+
+    host_args = copy(args)
+    host_args.host = host.host
+    host_args.port = host.port
+
+    error = None
+    try:
+        with operation(args.command), record_host(f"{host}"), session(args, host) as client:
+            args.func(client, host_args)
+        exit_code = 0
+    except SystemExit as err:
+        exit_code = _exit_code(err)
+    except Exception as err:
+        exit_code = 1
+        error = f"{err}"
+
+    return HostResult(host=host, exit_code=exit_code, duration_sec=time() - time_start, error=error)
+
+
+def run_fleet(args: argparse.Namespace, hosts: List[Host], max_workers: int = 8,
+              session: Callable[[argparse.Namespace, Host], ContextManager[Client]] = new_session) -> int:
+    stdout = thread_local_stdout()
+    target = stdout.current() or stdout.stream
+    lock = threading.Lock()
+
+    def run(host: Host) -> HostResult:
+        writer = _PrefixedWriter(target, lock, prefix=f"[{host}] ")
+        with stdout.redirect(writer):
+            try:
+                return run_on_host(args, host, session=session)
+            finally:
+                writer.finish()
+
+    results: List[HostResult] = []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, hosts.__len__()))) as executor:
+        # The threads start with the context of the command, e.g. the writer of its records in the daemon
+        futures = [executor.submit(copy_context().run, run, host) for host in hosts]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            emit("host_result", host=f"{result.host}", exit_code=result.exit_code,
+                 duration_sec=round(result.duration_sec, 3), error=result.error)
+
+            with lock:
+                if result.exit_code == 0:
+                    print(f"[{result.host}] OK ({result.duration_sec:.1f}s)")
+                elif result.error:
+                    print(f"[{result.host}] FAILED ({result.duration_sec:.1f}s) - {result.error}")
+                else:
+                    print(f"[{result.host}] FAILED ({result.duration_sec:.1f}s) - exit code: {result.exit_code}")
+
+    failed = [result for result in results if result.exit_code != 0]
+    print(f"{results.__len__() - failed.__len__()}/{results.__len__()} switches succeeded")
+    emit("fleet_result", succeeded=results.__len__() - failed.__len__(), failed=failed.__len__())
+    return 1 if failed else 0
+
+
+async def run_on_host_async(args: argparse.Namespace, host: Host,
+                            func: Callable[[AsyncClient], Awaitable[Any]]) -> HostResult:
+    time_start = time()
+
+    error = None
+    try:
+        async with AsyncClient.from_args(args, host=host.host, port=host.port) as client:
+            await client.login(password=args.password)
+            await func(client)
+        exit_code = 0
+    except Exception as err:
+        exit_code = 1
+        error = f"{err}"
+
+    return HostResult(host=host, exit_code=exit_code, duration_sec=time() - time_start, error=error)
+
+
+async def run_fleet_async(args: argparse.Namespace, hosts: List[Host], func: Callable[[AsyncClient], Awaitable[Any]],
+                          max_switches: int = 256) -> List[HostResult]:
+    # All the switches are driven from the current event loop, `max_switches` bounds how many of them
+    # are worked on at the same time and `--pool-size` how many requests each of them gets at once
+    semaphore = asyncio.Semaphore(max(1, max_switches))
+
+    async def run(host: Host) -> HostResult:
+        async with semaphore:
+            return await run_on_host_async(args, host, func=func)
+
+    return list(await asyncio.gather(*[run(host) for host in hosts]))
@@ -0,0 +1,156 @@
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from time import monotonic
+from typing import TYPE_CHECKING, AsyncIterator, Dict, Iterator, Optional, Tuple
+from weakref import WeakKeyDictionary
+
+if TYPE_CHECKING:
+    import asyncio
+
+
+class _AIMDLimit:
+    # The number of requests a switch gets at the same time. It grows by one for every `limit` requests
+    # answered in time while the limit was used up, and is halved when a request fails or takes much longer
+    # than the fastest answer for its page, at most once for the requests which were in flight together
+    def __init__(self, max_limit: int, min_limit: int = 1, tolerance: float = 1.5, min_delay_sec: float = 0.02):
+        self.max_limit = max(min_limit, max_limit)
+        self.min_limit = min_limit
+        self.tolerance = tolerance
+        self.min_delay_sec = min_delay_sec
+        # Half of the max to start with, a burst of requests to a switch which is busy already is not refused
+        self.limit = float(max(min_limit, (self.max_limit + 1) // 2))
+        self.in_flight = 0
+        self.base_latency_sec: Dict[str, float] = {}
+        self._decreased_at = 0.0
+
+    def has_room(self) -> bool:
+        return self.in_flight < int(self.limit)
+
+    def _congested(self, path: str, latency_sec: float) -> bool:
+        # The fastest answer is the switch without load. It drifts up slowly, so one lucky answer is forgotten
+        base_sec = min(latency_sec, self.base_latency_sec.get(path, latency_sec) * 1.01)
+        self.base_latency_sec[path] = base_sec
+        return latency_sec > max(base_sec * self.tolerance, base_sec + self.min_delay_sec)
+
+    def acquire(self) -> bool:
+        # Tells if the request used up the limit, only then an answer in time shows there is room for more
+        self.in_flight += 1
+        return self.in_flight >= int(self.limit)
+
+    def sample(self, path: str, started_at: float, latency_sec: Optional[float], failed: bool, saturated: bool):
+        # `latency_sec` is None for the requests whose duration says nothing about the load, e.g. uploads
+        self.in_flight -= 1
+        if failed or (latency_sec is not None and self._congested(path, latency_sec)):
+            if started_at > self._decreased_at:
+                self.limit = max(float(self.min_limit), self.limit / 2)
+                self._decreased_at = monotonic()
+        elif latency_sec is not None and saturated:
+            self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+
+
+class _Slot:
+    def __init__(self, path: str, measured: bool):
+        self.path = path
+        self.measured = measured
+        self.started_at = 0.0
+        self.saturated = False
+        self.failed = False
+
+
+class Governor:
+    # Bounds the requests in flight to one switch for all the clients (threads, batch lines, the
+    # exporter, the daemon sessions...) of this process. The requests over the limit wait for their turn
+    def __init__(self, max_limit: int):
+        self._limit = _AIMDLimit(max_limit=max_limit)
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit.limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._limit.in_flight
+
+    @contextmanager
+    def slot(self, path: str, measured: bool = True) -> Iterator[_Slot]:
+        slot = _Slot(path, measured)
+        with self._condition:
+            self._condition.wait_for(self._limit.has_room)
+            slot.saturated = self._limit.acquire()
+            slot.started_at = monotonic()
+        try:
+            yield slot
+        except Exception:
+            slot.failed = True
+            raise
+        finally:
+            latency_sec = monotonic() - slot.started_at if slot.measured else None
+            with self._condition:
+                self._limit.sample(path, started_at=slot.started_at, latency_sec=latency_sec, failed=slot.failed,
+                                   saturated=slot.saturated)
+                self._condition.notify_all()
+
+
+_governors: Dict[Tuple[str, int], Governor] = {}
+_governors_lock = threading.Lock()
+
+
+def governor_for(host: str, port: int, max_limit: int) -> Governor:
+    # The first client of a switch sets the max limit, the clients after it share its governor
+    with _governors_lock:
+        if (host, port) not in _governors:
+            _governors[(host, port)] = Governor(max_limit=max_limit)
+        return _governors[(host, port)]
+
+
+class AsyncGovernor:
+    # The same limit for the requests of an `AsyncClient`, waiting on the event loop instead of a thread
+    def __init__(self, max_limit: int):
+        self._limit = _AIMDLimit(max_limit=max_limit)
+        self._condition: Optional["asyncio.Condition"] = None
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit.limit)
+
+    @asynccontextmanager
+    async def slot(self, path: str, measured: bool = True) -> AsyncIterator[_Slot]:
+        # Created on first use, so the condition belongs to the loop which runs the requests. asyncio is
+        # imported here, the clients of the sub-commands import this module as well
+        if self._condition is None:
+            import asyncio
+            self._condition = asyncio.Condition()
+
+        slot = _Slot(path, measured)
+        async with self._condition:
+            await self._condition.wait_for(self._limit.has_room)
+            slot.saturated = self._limit.acquire()
+            slot.started_at = monotonic()
+        try:
+            yield slot
+        except Exception:
+            slot.failed = True
+            raise
+        finally:
+            latency_sec = monotonic() - slot.started_at if slot.measured else None
+            async with self._condition:
+                self._limit.sample(path, started_at=slot.started_at, latency_sec=latency_sec, failed=slot.failed,
+                                   saturated=slot.saturated)
+                self._condition.notify_all()
+
+
+_async_governors: "WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple[str, int], AsyncGovernor]]" = \
+    WeakKeyDictionary()
+
+
+def async_governor_for(host: str, port: int, max_limit: int) -> AsyncGovernor:
+    # `governor_for` for the clients of the running event loop, e.g. the copies of a fleet run. An
+    # AsyncGovernor waits on one loop, the clients of another loop (in another thread) share another one
+    import asyncio
+    loop = asyncio.get_running_loop()
+    with _governors_lock:
+        governors = _async_governors.setdefault(loop, {})
+        if (host, port) not in governors:
+            governors[(host, port)] = AsyncGovernor(max_limit=max_limit)
+        return governors[(host, port)]
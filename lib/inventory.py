@@ -0,0 +1,42 @@
+from pathlib import Path
+from typing import List, NamedTuple
+
+
+class Host(NamedTuple):
+    host: str
+    port: int
+
+    def __str__(self):
+        if self.port == 80:
+            return self.host
+        return f"[{self.host}]:{self.port}" if ":" in self.host else f"{self.host}:{self.port}"
+
+
+def parse_host(value: str, default_port: int = 80) -> Host:
+    value = value.strip()
+    # An IPv6 address only takes a port in the `[<ADDR>]:<PORT>` form, `fe80::1` is a bare address
+    if value.startswith("["):
+        addr, sep, port = value[1:].partition("]")
+        if not sep or (port and not (port.startswith(":") and port[1:].isdigit())):
+            raise Exception(f"`{value}` is not a valid switch address, expected [<ADDR>] or [<ADDR>]:<PORT>")
+        return Host(host=addr, port=int(port[1:]) if port else default_port)
+    if value.count(":") > 1:
+        return Host(host=value, port=default_port)
+
+    host, sep, port = value.rpartition(":")
+    if sep and host and port.isdigit():
+        return Host(host=host, port=int(port))
+    return Host(host=value, port=default_port)
+
+
+def load_inventory(path: str, default_port: int = 80) -> List[Host]:
+    hosts = []
+    for line in Path(path).read_text().splitlines():
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        hosts.append(parse_host(line, default_port=default_port))
+
+    if not hosts:
+        raise Exception(f"The inventory `{path}` does not contain any switches")
+    return hosts
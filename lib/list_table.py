@@ -0,0 +1,51 @@
+from html.parser import HTMLParser
+from typing import Dict, List, Optional, Set
+
+
+class _ListTableParser(HTMLParser):
+    # Collects the text of the `<span class="...">` fields of every `<li>` in the list table with the
+    # given id, which is how the status pages list the ports, in one pass without a document tree
+    def __init__(self, table_id: str, fields: Set[str]):
+        super(_ListTableParser, self).__init__()
+        self.items: List[Dict[str, str]] = []
+        self._table_id = table_id
+        self._fields = fields
+        self._in_table = False
+        self._table_depth = 0
+        self._capture: Optional[str] = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = {key: value or "" for key, value in attrs}
+        if tag == "ul" and attrs.get("id") == self._table_id:
+            self._in_table = True
+            self._table_depth = 0
+        elif self._in_table:
+            if tag == "ul":
+                self._table_depth += 1
+            elif tag == "li":
+                self.items.append({})
+            elif tag == "span" and self.items:
+                fields = self._fields.intersection(attrs.get("class", "").split())
+                self._capture = fields.pop() if fields else None
+
+    def handle_endtag(self, tag):
+        if tag == "span":
+            self._capture = None
+        elif tag == "ul" and self._in_table:
+            if self._table_depth == 0:
+                self._in_table = False
+            else:
+                self._table_depth -= 1
+
+    def handle_data(self, data):
+        if self._capture is not None:
+            self.items[-1][self._capture] = self.items[-1].get(self._capture, "") + data
+
+
+def _parse_list_table(html: str, table_id: str, fields: Set[str]) -> List[Dict[str, str]]:
+    parser = _ListTableParser(table_id, fields)
+    parser.feed(html)
+    parser.close()
+    if not parser.items:
+        raise Exception(f"The table `{table_id}` was not found on the page")
+    return [{key: value.strip() for key, value in item.items()} for item in parser.items]
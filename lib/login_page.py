@@ -0,0 +1,73 @@
+from html.parser import HTMLParser
+from typing import TYPE_CHECKING, Optional
+
+from .trace import traced_parser
+
+if TYPE_CHECKING:
+    import requests
+
+
+class _LoginPageParser(HTMLParser):
+    # The login only needs a few attributes from the login page and the redirect page, so the
+    # tokens are scanned directly, instead of importing bs4 and building a document tree
+    def __init__(self):
+        super(_LoginPageParser, self).__init__()
+        self.rand: Optional[str] = None
+        self.body_onload: Optional[str] = None
+        self.gambit: Optional[str] = None
+        self.error_msg = ""
+        self._in_error_msg = False
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "input" and attrs.get("id") == "rand" and self.rand is None:
+            self.rand = attrs.get("value") or ""
+        elif tag == "input" and attrs.get("name") == "Gambit" and self.gambit is None:
+            self.gambit = attrs.get("value") or ""
+        elif tag == "body" and self.body_onload is None:
+            self.body_onload = attrs.get("onload")
+        elif tag == "span" and attrs.get("id") == "loginPageErrorMsg":
+            self._in_error_msg = True
+
+    def handle_endtag(self, tag):
+        if tag == "span":
+            self._in_error_msg = False
+
+    def handle_data(self, data):
+        if self._in_error_msg:
+            self.error_msg += data
+
+
+@traced_parser
+def _parse_login_page(html: str) -> _LoginPageParser:
+    parser = _LoginPageParser()
+    parser.feed(html)
+    parser.close()
+    return parser
+
+
+def _is_login_page(resp: "requests.Response") -> bool:
+    text = resp.text
+    if 'id="rand"' in text or "LoginPassword" in text:
+        return True
+
+    # A short page, which only redirects the browser to the login page
+    return text.__len__() < 250 and "location" in text.lower()
+
+
+def _merge(password: str, random_number: str):
+    arr1 = list(password)
+    arr2 = list(random_number)
+    result = ""
+    index1 = 0
+    index2 = 0
+    while index1 < arr1.__len__() or index2 < arr2.__len__():
+        if index1 < arr1.__len__():
+            result += arr1[index1]
+            index1 += 1
+
+        if index2 < arr2.__len__():
+            result += arr2[index2]
+            index2 += 1
+
+    return result
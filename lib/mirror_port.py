@@ -1,18 +1,36 @@
 import argparse
-from typing import List
+from html.parser import HTMLParser
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional
 
 from .client import Client
-from .misc import convert_list_of_ports_to_str
+from .misc import convert_list_of_ports_to_str, switch_port_iter
+from .output import emit
+from .steps import Request, Steps, drive, drive_async
+from .trace import traced_parser
+
+if TYPE_CHECKING:
+    from .async_client import AsyncClient
+
+MIRROR_PORT_PATH = "/iss/specific/port_monitorconfig.html"
+
+
+class MirrorSession(NamedTuple):
+    enabled: bool
+    src_ports: List[int]
+    dest_port: Optional[int]
 
 
 def sub_cmd_mirror_port(client: Client, _args: argparse.Namespace):
     if _args.mirror_port_disable is True:
         mirror_port_disable(client=client)
+        emit("mirror", enabled=False, src_ports=[], dest_port=None)
         print("Disabled port mirroring")
         exit(0)
 
     elif _args.mirror_port_src_ports and _args.mirror_port_dest_port:
         mirror_port(client=client, src_ports=_args.mirror_port_src_ports, dest_port=_args.mirror_port_dest_port)
+        emit("mirror", enabled=True, src_ports=sorted(_args.mirror_port_src_ports),
+             dest_port=_args.mirror_port_dest_port)
         print("Mirrored the port(s) `{}` to the port `{}`".format(
             sorted(_args.mirror_port_src_ports), _args.mirror_port_dest_port,
         ))
@@ -22,24 +40,88 @@ def sub_cmd_mirror_port(client: Client, _args: argparse.Namespace):
         print("Error: There have to be provided at least one source and destination port")
         exit(1)
 
-def mirror_port_disable(client):
-    resp = client.post("/iss/specific/port_monitorconfig.html", data={
+
+def _mirror_port_disable_data() -> Dict[str, str]:
+    return {
         "SessionMode": "1",
         "SourcePort": "",
         "DestPort": "-1",
-    })
+    }
+
+
+def _check_mirror_port_disable(resp):
     if resp.text != "SUCCESS":
         raise Exception(f"Failed to disable port mirroring - html_text: {resp.text}")
 
-def mirror_port(client: Client, src_ports: List[int], dest_port: int):
+def _mirror_port_disable_steps() -> Steps[None]:
+    resp = yield Request("POST", MIRROR_PORT_PATH, {"data": _mirror_port_disable_data()})
+    _check_mirror_port_disable(resp)
+
+def mirror_port_disable(client):
+    drive(client, _mirror_port_disable_steps())
+
+async def mirror_port_disable_async(client: "AsyncClient"):
+    await drive_async(client, _mirror_port_disable_steps())
+
+
+def _mirror_port_data(src_ports: List[int], dest_port: int) -> Dict[str, str]:
     if dest_port in src_ports:
         raise Exception(f"Port `{dest_port}` can't be the destination port and the source port(s) at the same time")
 
-    src_ports_str = convert_list_of_ports_to_str(src_ports)
-    resp = client.post("/iss/specific/port_monitorconfig.html", data={
+    return {
         "SessionMode": "0",
-        "SourcePort": src_ports_str,
+        "SourcePort": convert_list_of_ports_to_str(src_ports),
         "DestPort": f"{dest_port}",
-    })
+    }
+
+
+def _check_mirror_port(resp, src_ports: List[int], dest_port: int):
     if resp.text != "SUCCESS":
         raise Exception(f"Failed to mirror port(s) `{src_ports}` to the port `{dest_port}` - html_text: {resp.text}")
+
+def _mirror_port_steps(src_ports: List[int], dest_port: int) -> Steps[None]:
+    resp = yield Request("POST", MIRROR_PORT_PATH, {"data": _mirror_port_data(src_ports, dest_port)})
+    _check_mirror_port(resp, src_ports, dest_port)
+
+def mirror_port(client: Client, src_ports: List[int], dest_port: int):
+    drive(client, _mirror_port_steps(src_ports, dest_port))
+
+async def mirror_port_async(client: "AsyncClient", src_ports: List[int], dest_port: int):
+    await drive_async(client, _mirror_port_steps(src_ports, dest_port))
+
+
+class _HiddenInputParser(HTMLParser):
+    # Collects the values of the hidden inputs by their id, the mirror page keeps its state in them
+    def __init__(self):
+        super(_HiddenInputParser, self).__init__(convert_charrefs=True)
+        self.values: Dict[str, str] = {}
+
+    def handle_starttag(self, tag, attrs):
+        if tag != "input":
+            return
+        attrs = dict(attrs)
+        if attrs.get("type") == "hidden" and attrs.get("id"):
+            self.values[attrs["id"]] = attrs.get("value") or ""
+
+
+@traced_parser
+def parse_mirror_page(html: str) -> MirrorSession:
+    parser = _HiddenInputParser()
+    parser.feed(html)
+    parser.close()
+
+    if not {"sessionMode", "sourcePort", "destPort"} <= parser.values.keys():
+        raise Exception("The mirror config is missing on the page")
+    if parser.values["sessionMode"] != "0":
+        return MirrorSession(enabled=False, src_ports=[], dest_port=None)
+
+    src_ports = parser.values["sourcePort"]
+    return MirrorSession(
+        enabled=True,
+        src_ports=[port_no for port_no in switch_port_iter() if src_ports[port_no - 1:port_no] == "1"],
+        dest_port=int(parser.values["destPort"]),
+    )
+
+
+def get_mirror_session(client: Client) -> MirrorSession:
+    return client.get_page(MIRROR_PORT_PATH, parse_mirror_page)
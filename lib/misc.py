@@ -1,9 +1,15 @@
-from typing import List
+import fcntl
+import sys
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Generic, List, Optional, TextIO, TypeVar
 
-import requests
+if TYPE_CHECKING:
+    import requests
 
 
-def bad_request(resp: requests.Response, msg: str = None, err = None):
+def bad_request(resp: "requests.Response", msg: str = None, err = None):
     if msg is None:
         msg = "Bad Request"
     if err:
@@ -22,3 +28,88 @@ def convert_list_of_ports_to_str(ports: List[int], include_port_16: bool = True)
         for port in list(switch_port_iter(include_port_16=include_port_16))
     ])
     return ports_str
+
+
+@contextmanager
+def file_lock(path: Path):
+    # flock() locks belong to the open file, so it serializes both threads and processes
+    path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    with open(path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@asynccontextmanager
+async def async_file_lock(path: Path, poll_sec: float = 0.01) -> AsyncIterator[None]:
+    # `file_lock` for the event loop. flock() is tried without blocking and again after a short sleep, so a
+    # task cancelled while it waits never gets the lock (a blocking flock() in a worker thread would take
+    # it after the task is gone and keep it). asyncio is imported here, the sub-commands import this module
+    import asyncio
+    path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    with open(path, "a") as lock_file:
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                await asyncio.sleep(poll_sec)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+T = TypeVar("T")
+
+
+class Once(Generic[T]):
+    # A value made by the first thread which asks for it, the other threads wait for it and get the same value
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._made = False
+        self._value: Optional[T] = None
+
+    def get(self, make: Callable[[], T]) -> T:
+        with self._lock:
+            if not self._made:
+                self._value = make()
+                self._made = True
+            return self._value
+
+
+class ThreadLocalStdout:
+    # Lets each thread send what the sub-commands print to its own target (e.g. a buffer or a
+    # writer prefixing the lines with the host), while the other threads keep writing to stdout
+    def __init__(self, stream: TextIO):
+        self.stream = stream
+        self._local = threading.local()
+
+    def current(self) -> Optional[TextIO]:
+        return getattr(self._local, "target", None)
+
+    @contextmanager
+    def redirect(self, target: Optional[TextIO]):
+        previous_target = self.current()
+        self._local.target = target
+        try:
+            yield target
+        finally:
+            self._local.target = previous_target
+
+    def write(self, text: str) -> int:
+        return (self.current() or self.stream).write(text)
+
+    def flush(self):
+        (self.current() or self.stream).flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def thread_local_stdout() -> ThreadLocalStdout:
+    if not isinstance(sys.stdout, ThreadLocalStdout):
+        sys.stdout = ThreadLocalStdout(sys.stdout)
+    return sys.stdout
@@ -0,0 +1,91 @@
+import atexit
+import json
+import sys
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import time
+from typing import Any, Dict, Iterator, List, Optional, TextIO
+
+OUTPUT_FORMATS = ["text", "json", "ndjson"]
+
+# The switch the current code works on, every record emitted under it carries it as `host`
+_host: ContextVar[Optional[str]] = ContextVar("output_host", default=None)
+# The writer of the command the current code runs for, the daemon runs many commands at the same time
+_writer_override: ContextVar[Optional["RecordWriter"]] = ContextVar("output_writer", default=None)
+
+
+class RecordWriter:
+    # `ndjson` writes every record as one line as soon as it is emitted, so whoever reads the output
+    # sees a switch when it is done and not when the whole fleet is. `json` writes one array at the end
+    def __init__(self, output: TextIO, output_format: str):
+        self._output = output
+        self._format = output_format
+        self._lock = threading.Lock()
+        self._records: List[Dict[str, Any]] = []
+
+    def write(self, record: Dict[str, Any]):
+        if self._format == "ndjson":
+            line = json.dumps(record, default=str)
+            with self._lock:
+                self._output.write(line + "\n")
+                self._output.flush()
+        else:
+            with self._lock:
+                self._records.append(record)
+
+    def close(self):
+        if self._format == "json":
+            with self._lock:
+                self._output.write(json.dumps(self._records, default=str, indent=2) + "\n")
+                self._records = []
+        self._output.flush()
+
+
+_writer: Optional[RecordWriter] = None
+
+
+def _current_writer() -> Optional[RecordWriter]:
+    return _writer_override.get() or _writer
+
+
+def start_output(output_format: str) -> Optional[RecordWriter]:
+    # The records take over stdout, what the commands print for people goes to stderr from now on
+    global _writer
+    if output_format == "text":
+        return None
+
+    writer = _writer = RecordWriter(sys.stdout, output_format)
+    sys.stdout = sys.stderr
+    atexit.register(writer.close)
+    return writer
+
+
+def machine_output() -> bool:
+    return _current_writer() is not None
+
+
+@contextmanager
+def record_writer(writer: Optional[RecordWriter]) -> Iterator[Optional[RecordWriter]]:
+    token = _writer_override.set(writer)
+    try:
+        yield writer
+    finally:
+        _writer_override.reset(token)
+
+
+@contextmanager
+def record_host(host: str) -> Iterator[None]:
+    token = _host.set(host)
+    try:
+        yield
+    finally:
+        _host.reset(token)
+
+
+def emit(record_type: str, **fields: Any):
+    # Nothing is built for the text output, so the commands can emit their records unconditionally
+    writer = _current_writer()
+    if writer is None:
+        return
+    writer.write({"type": record_type, "ts": round(time(), 3), "host": _host.get(), **fields})
@@ -1,23 +1,74 @@
 import argparse
-from typing import List
+from typing import TYPE_CHECKING, Dict, List, NamedTuple
 
 from .client import Client
+from .list_table import _parse_list_table
 from .misc import convert_list_of_ports_to_str
+from .output import emit
+from .steps import Request, Steps, drive, drive_async
+from .trace import traced_parser
+
+if TYPE_CHECKING:
+    from .async_client import AsyncClient
+
+POE_PORT_CONF_PATH = "/iss/specific/poePortConf.html"
+
+
+class PoEPortConfig(NamedTuple):
+    port_no: int
+    enabled: bool
+    priority: str
+    power_limit_w: float
 
 
 def sub_cmd_poe(client: Client, _args: argparse.Namespace):
     if _args.power_cycle_ports:
         power_cycle_ports(client=client, ports=_args.power_cycle_ports)
+        emit("poe_power_cycle", ports=sorted(_args.power_cycle_ports))
         print("Power cycled the ports: ", _args.power_cycle_ports)
         exit(0)
 
 
-def power_cycle_ports(client: Client, ports: List[int]):
-    poe_port = convert_list_of_ports_to_str(ports, include_port_16=False)
-
-    resp = client.post("/iss/specific/poePortConf.html", data={
+def _power_cycle_data(ports: List[int]) -> Dict[str, str]:
+    return {
         "TYPE": "resetPoe",
-        "PoePort": poe_port,
-    })
+        "PoePort": convert_list_of_ports_to_str(ports, include_port_16=False),
+    }
+
+
+def _check_power_cycle(resp, ports: List[int]):
     if resp.text != "SUCCESS":
         raise Exception(f"Failed to power cycle ports: {ports} - html_text: {resp.text}")
+
+
+def _power_cycle_steps(ports: List[int]) -> Steps[None]:
+    resp = yield Request("POST", POE_PORT_CONF_PATH, {"data": _power_cycle_data(ports)})
+    _check_power_cycle(resp, ports)
+
+
+def power_cycle_ports(client: Client, ports: List[int]):
+    drive(client, _power_cycle_steps(ports))
+
+
+async def power_cycle_ports_async(client: "AsyncClient", ports: List[int]):
+    await drive_async(client, _power_cycle_steps(ports))
+
+
+# The layout of the table is the one of the emulator, it is not verified against a real firmware yet.
+# A snapshot leaves out the PoE config (null) when the page cannot be read
+@traced_parser
+def parse_poe_config_page(html: str) -> Dict[int, PoEPortConfig]:
+    result = {}
+    for item in _parse_list_table(html, "poePortConfTbl", {"port-count", "poe-admin", "poe-priority", "poe-power-limit"}):
+        port_no = int(item["port-count"])
+        result[port_no] = PoEPortConfig(
+            port_no=port_no,
+            enabled=item.get("poe-admin", "").lower() == "enable",
+            priority=item.get("poe-priority", "").lower(),
+            power_limit_w=float(item.get("poe-power-limit") or 0),
+        )
+    return result
+
+
+def get_poe_config(client: Client) -> Dict[int, PoEPortConfig]:
+    return client.get_page(POE_PORT_CONF_PATH, parse_poe_config_page)
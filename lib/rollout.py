@@ -0,0 +1,151 @@
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from datetime import timedelta
+from pathlib import Path
+from time import time
+from typing import List, NamedTuple, Optional
+
+from .client import Client
+from .firmware import (
+    FIRMWARE_CACHE_DIR,
+    FirmwareRelease,
+    _print_reboot_progress,
+    _version2int,
+    fetch_firmware,
+    get_firmware_version,
+    get_release,
+    update,
+    update_time,
+)
+from .fleet import _PrefixedWriter
+from .inventory import Host
+from .misc import thread_local_stdout
+from .output import emit, record_host
+
+
+class UpgradeResult(NamedTuple):
+    host: Host
+    upgraded: bool
+    uptime_before: Optional[timedelta]
+    duration_sec: float
+    error: Optional[str]
+
+
+def sub_cmd_rollout(args: argparse.Namespace) -> int:
+    if not args.hosts:
+        print("Error: At least one switch have to be provided with --host or --inventory")
+        return 1
+    if args.password is None:
+        print("Error: The password for the switches have to be provided with --password")
+        return 1
+
+    # The firmware is looked up and downloaded once, every switch gets the same image from the cache
+    release = get_release(
+        firmware_cache_dir=Path(args.firmware_cache_dir) if args.firmware_cache_dir else FIRMWARE_CACHE_DIR,
+        firmware_dir=Path(args.firmware_dir) if args.firmware_dir else None,
+        metadata_ttl_sec=args.firmware_metadata_ttl,
+    )
+    firmware_path = fetch_firmware(
+        release, cache_dir=Path(args.firmware_cache_dir) if args.firmware_cache_dir else FIRMWARE_CACHE_DIR,
+    )
+    release = FirmwareRelease(version=release.version, url=release.url, path=firmware_path)
+
+    return rollout(args, hosts=args.hosts, release=release, wave_size=args.rollout_wave_size,
+                   reboot_wait_sec=args.rollout_reboot_wait)
+
+
+def rollout(args: argparse.Namespace, hosts: List[Host], release: FirmwareRelease, wave_size: int = 1,
+            reboot_wait_sec: int = 600) -> int:
+    # The switches are upgraded in waves of `wave_size`, and a wave is only started when every switch
+    # in the previous wave is back with the new firmware, so a bad image never takes down more than one wave
+    wave_size = max(1, wave_size)
+    waves = [hosts[index:index + wave_size] for index in range(0, hosts.__len__(), wave_size)]
+    time_start = time()
+    print(f"Rolling out the firmware {release.version} to {hosts.__len__()} switches "
+          f"in {waves.__len__()} waves of up to {wave_size}")
+
+    for wave_no, wave in enumerate(waves, start=1):
+        print(f"Wave {wave_no}/{waves.__len__()}: {', '.join(f'{host}' for host in wave)}")
+        results = _run_wave(args, wave, release=release, reboot_wait_sec=reboot_wait_sec)
+
+        failed = 0
+        for result in results:
+            error = result.error or _check_health(args, result, release=release)
+            emit("upgrade", host=f"{result.host}", wave=wave_no, upgraded=result.upgraded,
+                 version=release.version, duration_sec=round(result.duration_sec, 3), error=error)
+            if error is None:
+                status = "upgraded" if result.upgraded else "already up to date"
+                print(f"[{result.host}] OK ({result.duration_sec:.1f}s) - {status}")
+            else:
+                failed += 1
+                print(f"[{result.host}] FAILED ({result.duration_sec:.1f}s) - {error}")
+
+        if failed:
+            skipped = sum(wave.__len__() for wave in waves[wave_no:])
+            print(f"Stopped the rollout after wave {wave_no}, {failed} switches failed "
+                  f"and {skipped} switches were not touched")
+            return 1
+
+    print(f"Rolled out the firmware {release.version} to {hosts.__len__()} switches "
+          f"in {time() - time_start:.0f}s")
+    return 0
+
+
+def _run_wave(args: argparse.Namespace, wave: List[Host], release: FirmwareRelease,
+              reboot_wait_sec: int) -> List[UpgradeResult]:
+    stdout = thread_local_stdout()
+    target = stdout.current() or stdout.stream
+    lock = threading.Lock()
+
+    def run(host: Host) -> UpgradeResult:
+        writer = _PrefixedWriter(target, lock, prefix=f"[{host}] ")
+        with stdout.redirect(writer):
+            try:
+                with record_host(f"{host}"):
+                    return _upgrade_host(args, host, release=release, reboot_wait_sec=reboot_wait_sec)
+            finally:
+                writer.finish()
+
+    with ThreadPoolExecutor(max_workers=wave.__len__()) as executor:
+        futures = [executor.submit(copy_context().run, run, host) for host in wave]
+        return [future.result() for future in futures]
+
+
+def _upgrade_host(args: argparse.Namespace, host: Host, release: FirmwareRelease,
+                  reboot_wait_sec: int) -> UpgradeResult:
+    time_start = time()
+    try:
+        client = Client.from_args(args, host=host.host, port=host.port)
+        client.login(password=args.password)
+
+        if not _version2int(get_firmware_version(client)) < _version2int(release.version):
+            return UpgradeResult(host=host, upgraded=False, uptime_before=None,
+                                 duration_sec=time() - time_start, error=None)
+
+        uptime_before = update_time(client)
+        update(client, reboot_wait_sec=reboot_wait_sec, release=release, progress=_print_reboot_progress)
+        return UpgradeResult(host=host, upgraded=True, uptime_before=uptime_before,
+                             duration_sec=time() - time_start, error=None)
+    except Exception as err:
+        return UpgradeResult(host=host, upgraded=False, uptime_before=None,
+                             duration_sec=time() - time_start, error=f"{err}")
+
+
+def _check_health(args: argparse.Namespace, result: UpgradeResult, release: FirmwareRelease) -> Optional[str]:
+    # Checked with a new login, so the switch has to accept the password after the reboot as well. A stored
+    # token is not reused, it would pass the check without the switch being asked for a login at all
+    try:
+        client = Client.from_args(args, host=result.host.host, port=result.host.port)
+        client.login(password=args.password, fresh=True)
+
+        version = get_firmware_version(client)
+        if _version2int(version) < _version2int(release.version):
+            return f"The switch reports the firmware {version} instead of {release.version}"
+
+        if result.upgraded and update_time(client) >= result.uptime_before:
+            return "The uptime of the switch did not drop, so it has not rebooted with the new firmware"
+    except Exception as err:
+        return f"The health check failed - err: {err}"
+    return None
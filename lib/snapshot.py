@@ -0,0 +1,211 @@
+import argparse
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .client import Client
+from .firmware import get_firmware_version
+from .inventory import Host
+from .misc import switch_port_iter
+from .mirror_port import get_mirror_session
+from .output import emit, machine_output
+from .poe import get_poe_config
+from .vlan.diff import diff_pvids, diff_vlans
+from .vlan.fingerprint import page_fingerprint
+from .vlan.helper_functions import _get_vlan_page
+from .vlan.structs import TYPE_VLANS, MapPort2UntaggedVLAN, ModeVLAN, ObjVLAN, PageVLAN, VLANTable, port_bit
+
+# Bumped when the layout of the document changes, so an old snapshot is never misread
+SNAPSHOT_VERSION = 1
+
+_OPTIONAL_PAGES = {"mirror", "poe"}
+
+
+def take_snapshot(client: Client) -> Dict[str, Any]:
+    # The pages do not depend on each other, so they are fetched at the same time over the
+    # connections of the one logged in session
+    fetchers = {
+        "firmware": get_firmware_version,
+        "vlan": _get_vlan_page,
+        "mirror": get_mirror_session,
+        "poe": get_poe_config,
+    }
+    with ThreadPoolExecutor(max_workers=fetchers.__len__()) as executor:
+        futures = {name: executor.submit(copy_context().run, fetcher, client) for name, fetcher in fetchers.items()}
+        pages, errors = {}, {}
+        for name, future in futures.items():
+            try:
+                pages[name] = future.result()
+            except Exception as err:
+                # The layouts of the mirror and PoE pages are not verified against the pages of a real
+                # firmware yet, so a page which cannot be read leaves out its part (null) and not the snapshot
+                if name not in _OPTIONAL_PAGES:
+                    raise
+                # The first line of the error, a bad request carries the whole page. It is kept in the
+                # snapshot as well, a null part is not mistaken for a switch without that config
+                errors[name] = f"{err}".splitlines()[0]
+                print(f"Warning: [{Host(host=client.host, port=client.port)}] The {name} config is left out "
+                      f"of the snapshot - {errors[name]}", file=sys.stderr)
+                pages[name] = None
+
+    page_vlan, mirror, poe = pages["vlan"], pages["mirror"], pages["poe"]
+    return {
+        "version": SNAPSHOT_VERSION,
+        "host": f"{Host(host=client.host, port=client.port)}",
+        "taken_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "firmware": pages["firmware"],
+        "vlan": _vlan_section(page_vlan),
+        "mirror": None if mirror is None else {"enabled": mirror.enabled, "src_ports": mirror.src_ports,
+                                               "dest_port": mirror.dest_port},
+        "poe": None if poe is None else {
+            f"{port_no}": {"enabled": port.enabled, "priority": port.priority, "power_limit_w": port.power_limit_w}
+            for port_no, port in sorted(poe.items())
+        },
+        "errors": errors,
+    }
+
+
+def _vlan_section(page_vlan: PageVLAN) -> Dict[str, Any]:
+    return {
+        "mode": page_vlan.mode.value,
+        # The members of a VLAN are kept like the switch sends them, one digit (AccessVLAN) per port
+        "vlans": {f"{vlan_id}": {"name": vlan.name, "members": vlan.ports_access_to_str()}
+                  for vlan_id, vlan in sorted(page_vlan.vlans.items())},
+        "pvids": [page_vlan.port2vlan[port_no].select_vlan_id if port_no in page_vlan.port2vlan else None
+                  for port_no in switch_port_iter()],
+        "fingerprint": page_fingerprint(page_vlan),
+    }
+
+
+def dump_snapshot(snapshot: Dict[str, Any]) -> str:
+    return json.dumps(snapshot, sort_keys=True, separators=(",", ":"))
+
+
+def load_snapshot(path: str) -> Dict[str, Any]:
+    snapshot = json.loads(Path(path).read_text())
+    version = snapshot.get("version") if isinstance(snapshot, dict) else None
+    if not isinstance(version, int):
+        raise Exception(f"`{path}` is not a snapshot of a switch")
+    if version > SNAPSHOT_VERSION:
+        raise Exception(f"The snapshot `{path}` has the version {version}, "
+                        f"but only up to the version {SNAPSHOT_VERSION} is supported")
+    return snapshot
+
+
+def _snapshot_vlans(vlan: Dict[str, Any]) -> TYPE_VLANS:
+    return {int(vlan_id): ObjVLAN.from_members(name=entry["name"], members=entry["members"])
+            for vlan_id, entry in vlan["vlans"].items()}
+
+
+def snapshot_vlan_page(snapshot: Dict[str, Any]) -> PageVLAN:
+    # The VLAN page of the switch when the snapshot was taken. Only the PVIDs are kept, the VLANs a port
+    # can select as its PVID are the ones it is a member of
+    vlan = snapshot["vlan"]
+    vlans = _snapshot_vlans(vlan)
+    table = VLANTable(vlans)
+
+    port2vlan = {}
+    for port_no, pvid in enumerate(vlan["pvids"], start=1):
+        if pvid is None:
+            raise Exception(f"The snapshot of `{snapshot['host']}` has no PVID for the port {port_no}")
+        bit = port_bit(port_no)
+        port2vlan[port_no] = MapPort2UntaggedVLAN(
+            select_vlan_id=pvid,
+            vlan_ids=[vlan_id for vlan_id in table if (table.tagged[vlan_id] | table.untagged[vlan_id]) & bit],
+        )
+    return PageVLAN(mode=ModeVLAN(vlan["mode"]), vlans=vlans, port2vlan=port2vlan)
+
+
+def diff_snapshots(old: Dict[str, Any], new: Dict[str, Any]) -> List[str]:
+    changes = []
+    if old["firmware"] != new["firmware"]:
+        changes.append(f"~ firmware: {old['firmware']} -> {new['firmware']}")
+
+    old_vlan, new_vlan = old["vlan"], new["vlan"]
+    if old_vlan["mode"] != new_vlan["mode"]:
+        changes.append(f"~ VLAN mode: {ModeVLAN(old_vlan['mode']).name} -> {ModeVLAN(new_vlan['mode']).name}")
+
+    changes += diff_vlans(_snapshot_vlans(old_vlan), _snapshot_vlans(new_vlan))
+    changes += diff_pvids(dict(enumerate(old_vlan["pvids"], start=1)), dict(enumerate(new_vlan["pvids"], start=1)))
+
+    if old["mirror"] != new["mirror"]:
+        changes.append(f"~ mirror: {_mirror_str(old['mirror'])} -> {_mirror_str(new['mirror'])}")
+
+    old_poe, new_poe = old["poe"], new["poe"]
+    if old_poe is None or new_poe is None:
+        if old_poe != new_poe:
+            changes.append(f"~ PoE config: {'not read' if old_poe is None else 'read'} -> "
+                           f"{'not read' if new_poe is None else 'read'}")
+        return changes
+    for port_no in sorted(old_poe.keys() | new_poe.keys(), key=int):
+        old_port, new_port = old_poe.get(port_no, {}), new_poe.get(port_no, {})
+        for key in sorted(old_port.keys() | new_port.keys()):
+            if old_port.get(key) != new_port.get(key):
+                changes.append(f"~ PoE port {port_no} {key}: {old_port.get(key)} -> {new_port.get(key)}")
+    return changes
+
+
+def _mirror_str(mirror: Optional[Dict[str, Any]]) -> str:
+    if mirror is None:
+        return "not read"
+    if not mirror["enabled"]:
+        return "disabled"
+    return f"{mirror['src_ports']} to {mirror['dest_port']}"
+
+
+def snapshot_path(output_dir: str, host: str, port: int) -> Path:
+    name = host if port == 80 else f"{host}_{port}"
+    return Path(output_dir) / f"{name}.json"
+
+
+def write_snapshot(path: Path, snapshot: Dict[str, Any]):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(dump_snapshot(snapshot) + "\n")
+
+
+def record_vlan_snapshot(client: Client, output_dir: str) -> Path:
+    # Called after the VLANs were changed through this tool, so `drift` only reports the changes made in
+    # another way. Only the VLAN part of the snapshot is replaced, the rest stays as it was checked last.
+    # The VLAN page is the one the switch answered the last change with, so it costs no request
+    path = snapshot_path(output_dir, host=client.host, port=client.port)
+    if path.exists():
+        snapshot = load_snapshot(f"{path}")
+        snapshot["vlan"] = _vlan_section(_get_vlan_page(client))
+    else:
+        snapshot = take_snapshot(client)
+    write_snapshot(path, snapshot)
+    return path
+
+
+def sub_cmd_snapshot(client: Client, args: argparse.Namespace):
+    document = take_snapshot(client)
+    snapshot = dump_snapshot(document)
+    if args.snapshot_output_dir is None:
+        # The record carries the document, it is not printed a second time for people
+        emit("snapshot", path=None, snapshot=document)
+        if not machine_output():
+            print(snapshot)
+        return
+
+    path = snapshot_path(args.snapshot_output_dir, host=client.host, port=client.port)
+    write_snapshot(path, document)
+    emit("snapshot", path=f"{path}", snapshot=document)
+    print(f"Saved the snapshot to `{path}`")
+
+
+def sub_cmd_diff(args: argparse.Namespace) -> int:
+    old, new = load_snapshot(args.diff_old), load_snapshot(args.diff_new)
+    changes = diff_snapshots(old, new)
+    emit("snapshot_diff", host=new["host"], old=args.diff_old, new=args.diff_new, changes=changes)
+    for change in changes:
+        print(change)
+    if not changes:
+        print(f"No differences between `{args.diff_old}` ({old['host']}, {old['taken_at']}) "
+              f"and `{args.diff_new}` ({new['host']}, {new['taken_at']})")
+
+    # Like diff(1), the exit code tells if there are any differences
+    return 1 if changes else 0
@@ -0,0 +1,65 @@
+from typing import TYPE_CHECKING, Any, Callable, Dict, Generator, NamedTuple, Optional, TypeVar, Union
+
+if TYPE_CHECKING:
+    from .async_client import AsyncClient
+    from .client import Client
+
+T = TypeVar("T")
+
+
+class Request(NamedTuple):
+    method: str
+    path: str
+    # None rather than a shared `{}` default, the clients are handed their own dict for every request
+    kwargs: Optional[Dict[str, Any]] = None
+
+
+class GetPage(NamedTuple):
+    # A page parsed once per session, from the page cache of the client when it is there
+    path: str
+    parser: Callable[[str], Any]
+
+
+# An operation on the switch written once for both clients. It yields the requests it needs and gets the
+# answers sent back, what it returns is the result of the operation. `drive` runs it with a `Client` and
+# `drive_async` with an `AsyncClient`, so the sync and the async API cannot drift apart
+Steps = Generator[Union[Request, GetPage], Any, T]
+
+
+def _run_step(client: "Client", step: Union[Request, GetPage]) -> Any:
+    if isinstance(step, GetPage):
+        return client.get_page(step.path, step.parser)
+    return client.request(step.method, step.path, **(step.kwargs or {}))
+
+
+async def _run_step_async(client: "AsyncClient", step: Union[Request, GetPage]) -> Any:
+    if isinstance(step, GetPage):
+        return await client.get_page(step.path, step.parser)
+    return await client.request(step.method, step.path, **(step.kwargs or {}))
+
+
+def drive(client: "Client", steps: Steps[T]) -> T:
+    # A failed request is thrown into the steps, so their `with` blocks (e.g. the trace operation) are left
+    answer, error = None, None
+    while True:
+        try:
+            step = steps.send(answer) if error is None else steps.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            answer, error = _run_step(client, step), None
+        except Exception as err:
+            answer, error = None, err
+
+
+async def drive_async(client: "AsyncClient", steps: Steps[T]) -> T:
+    answer, error = None, None
+    while True:
+        try:
+            step = steps.send(answer) if error is None else steps.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            answer, error = await _run_step_async(client, step), None
+        except Exception as err:
+            answer, error = None, err
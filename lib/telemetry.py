@@ -0,0 +1,69 @@
+from typing import Dict, NamedTuple
+
+from .client import Client
+from .list_table import _parse_list_table
+from .misc import bad_request
+from .trace import traced_parser
+
+# The status pages and the layout of their tables are the ones of the emulator, they are not verified
+# against a real firmware yet. The exporter leaves out the metrics of a page it cannot read and reports
+# `gs316ep_page_error 1` for them
+POE_STATUS_PATH = "/iss/specific/poePortStatus.html"
+PORT_STATUS_PATH = "/iss/specific/portStatus.html"
+
+
+class PoEPortStatus(NamedTuple):
+    port_no: int
+    delivering: bool
+    power_w: float
+    poe_class: str
+
+
+class PortStatus(NamedTuple):
+    port_no: int
+    link_up: bool
+    speed_mbps: int
+
+
+@traced_parser
+def parse_poe_status_page(html: str) -> Dict[int, PoEPortStatus]:
+    result = {}
+    for item in _parse_list_table(html, "poePortStatusTbl", {"port-count", "poe-status", "poe-power", "poe-class"}):
+        port_no = int(item["port-count"])
+        result[port_no] = PoEPortStatus(
+            port_no=port_no,
+            delivering=item.get("poe-status", "").lower() == "delivering power",
+            power_w=float(item.get("poe-power") or 0),
+            poe_class=item.get("poe-class", ""),
+        )
+    return result
+
+
+@traced_parser
+def parse_port_status_page(html: str) -> Dict[int, PortStatus]:
+    result = {}
+    for item in _parse_list_table(html, "portStatusTbl", {"port-count", "port-link", "port-speed"}):
+        port_no = int(item["port-count"])
+        speed = item.get("port-speed", "").upper().rstrip("M")
+        result[port_no] = PortStatus(
+            port_no=port_no,
+            link_up=item.get("port-link", "").lower() == "up",
+            speed_mbps=int(speed) if speed.isdigit() else 0,
+        )
+    return result
+
+
+def get_poe_status(client: Client) -> Dict[int, PoEPortStatus]:
+    resp = client.get(POE_STATUS_PATH)
+    try:
+        return parse_poe_status_page(resp.text)
+    except Exception as err:
+        bad_request(resp, err=err)
+
+
+def get_port_status(client: Client) -> Dict[int, PortStatus]:
+    resp = client.get(PORT_STATUS_PATH)
+    try:
+        return parse_port_status_page(resp.text)
+    except Exception as err:
+        bad_request(resp, err=err)
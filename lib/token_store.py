@@ -0,0 +1,48 @@
+from contextlib import contextmanager
+from pathlib import Path
+from time import time
+from typing import Optional
+
+from .misc import async_file_lock, file_lock
+
+TOKEN_DIR = Path("/tmp/.netgear-gs316ep_token")
+TOKEN_MAX_AGE_SEC = 15 * 60
+
+
+class TokenStore:
+    # The token is shared by every process managing the same switch. Logging in is done while
+    # holding the lock, so parallel processes reuse the new token instead of logging in again
+    # and invalidating each other's session
+    def __init__(self, host: str, port: int = 80, max_age_sec: int = TOKEN_MAX_AGE_SEC):
+        self._dir = TOKEN_DIR / (host if port == 80 else f"{host}:{port}")
+        self._token_path = self._dir / "token"
+        self.max_age_sec = max_age_sec
+
+    @property
+    def path(self) -> Path:
+        return self._token_path
+
+    @contextmanager
+    def lock(self):
+        with file_lock(self._dir / "lock"):
+            yield
+
+    def lock_async(self):
+        return async_file_lock(self._dir / "lock")
+
+    def load(self) -> Optional[str]:
+        try:
+            if int(self._token_path.stat().st_mtime) <= time() - self.max_age_sec:
+                return None
+            return self._token_path.read_text() or None
+        except FileNotFoundError:
+            return None
+
+    def save(self, token: str):
+        self._dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+        tmp_path = self._dir / "token.tmp"
+        tmp_path.write_text(token)
+        tmp_path.replace(self._token_path)
+
+    def clear(self):
+        self._token_path.unlink(missing_ok=True)
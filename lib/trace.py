@@ -0,0 +1,129 @@
+import atexit
+import json
+import sys
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from time import perf_counter, time
+from typing import Any, Callable, Dict, Iterator, Optional, TextIO, Tuple, TypeVar
+
+T = TypeVar("T")
+
+# The operations the current code runs in, e.g. ("vlan", "set-pvid"). A context variable follows
+# both the threads of the fleet and the tasks of the async client
+_operations: ContextVar[Tuple[str, ...]] = ContextVar("operations", default=())
+
+
+class _EndpointStats:
+    def __init__(self):
+        self.count = 0
+        self.total_sec = 0.0
+        self.bytes = 0
+
+
+class Tracer:
+    # Writes every span as one JSON line and keeps the totals for the summary at the end of the run
+    def __init__(self, output: TextIO):
+        self._output = output
+        self._lock = threading.Lock()
+        self._time_start = perf_counter()
+        self.requests: Dict[str, _EndpointStats] = {}
+        self.parsers: Dict[str, _EndpointStats] = {}
+
+    def span(self, kind: str, latency_sec: float, **fields: Any):
+        record = {"ts": round(time(), 6), "kind": kind, "operation": "/".join(_operations.get()),
+                  **fields, "latency_ms": round(latency_sec * 1000, 3)}
+        line = json.dumps(record)
+
+        if kind == "request":
+            key, totals = f"{fields['method']} {fields['path']}", self.requests
+        else:
+            key, totals = fields["parser"], self.parsers
+
+        with self._lock:
+            stats = totals.setdefault(key, _EndpointStats())
+            stats.count += 1
+            stats.total_sec += latency_sec
+            stats.bytes += fields.get("bytes") or 0
+            self._output.write(line + "\n")
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "kind": "summary",
+                "wall_time_ms": round((perf_counter() - self._time_start) * 1000, 3),
+                "requests": sum(stats.count for stats in self.requests.values()),
+                "endpoints": {key: {"count": stats.count, "total_ms": round(stats.total_sec * 1000, 3),
+                                    "bytes": stats.bytes}
+                              for key, stats in sorted(self.requests.items())},
+                "parsers": {key: {"count": stats.count, "total_ms": round(stats.total_sec * 1000, 3)}
+                            for key, stats in sorted(self.parsers.items())},
+            }
+
+    def print_summary(self, output: TextIO = None):
+        summary = self.summary()
+        output = output or sys.stderr
+        output.write(f"\n{'Endpoint':<48} | {'Count':>5} | {'Total':>10} | {'Bytes':>9}\n")
+        for key, stats in summary["endpoints"].items():
+            output.write(f"{key:<48} | {stats['count']:>5} | {stats['total_ms']:>7.1f} ms | {stats['bytes']:>9}\n")
+        for key, stats in summary["parsers"].items():
+            output.write(f"{'parse ' + key:<48} | {stats['count']:>5} | {stats['total_ms']:>7.1f} ms |\n")
+        output.write(f"{summary['requests']} requests in {summary['wall_time_ms'] / 1000:.2f}s\n")
+
+    def close(self):
+        summary = self.summary()
+        with self._lock:
+            self._output.write(json.dumps(summary) + "\n")
+            self._output.flush()
+
+
+_tracer: Optional[Tracer] = None
+
+
+def get_tracer() -> Optional[Tracer]:
+    return _tracer
+
+
+def start_tracing(path: str) -> Tracer:
+    # `-` writes the spans to stderr, so they do not mix with the output of the command on stdout
+    global _tracer
+    output = sys.stderr if path == "-" else open(path, "a", buffering=1)
+    tracer = _tracer = Tracer(output)
+
+    def finish():
+        tracer.close()
+        tracer.print_summary()
+
+    atexit.register(finish)
+    return tracer
+
+
+@contextmanager
+def operation(name: str) -> Iterator[None]:
+    token = _operations.set(_operations.get() + (name,))
+    try:
+        yield
+    finally:
+        _operations.reset(token)
+
+
+def trace_request(method: str, path: str, host: str, status: Optional[int], size: Optional[int],
+                  latency_sec: float):
+    if _tracer is not None:
+        _tracer.span("request", latency_sec, method=method, path=path, host=host, status=status, bytes=size)
+
+
+def traced_parser(func: Callable[..., T]) -> Callable[..., T]:
+    # The first argument of the parsers is the HTML they parse
+    @wraps(func)
+    def wrapper(html, *args, **kwargs):
+        if _tracer is None:
+            return func(html, *args, **kwargs)
+
+        time_start = perf_counter()
+        try:
+            return func(html, *args, **kwargs)
+        finally:
+            _tracer.span("parse", perf_counter() - time_start, parser=func.__name__, bytes=html.__len__())
+    return wrapper
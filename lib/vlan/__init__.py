@@ -1,5 +1,20 @@
-from .set_mode import set_vlan_mode
-from .set_vlans import set_vlans
 from .structs import ModeVLAN
 from .structs import AccessVLAN
-from .cmds import sub_cmd_vlan
+
+_LAZY_ATTRIBUTES = {
+    "set_vlan_mode": ".set_mode",
+    "set_vlan_mode_async": ".set_mode",
+    "set_vlans": ".set_vlans",
+    "set_vlans_async": ".set_vlans",
+    "sub_cmd_vlan": ".cmds",
+}
+
+
+def __getattr__(name: str):
+    # The structs are light, the rest pulls in the client (requests) and is imported on first use
+    if name in _LAZY_ATTRIBUTES:
+        from importlib import import_module
+        # Importing the `set_vlans` module binds the module to the name, so the function is bound after it
+        value = globals()[name] = getattr(import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,85 @@
+import argparse
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+from .helper_functions import _parse_vlan_arguments, _validate_vlans
+from .plan import OperationVLAN, plan_vlans
+from .structs import TYPE_VLANS, ModeVLAN
+from ..output import emit
+from ..snapshot import load_snapshot, snapshot_path, snapshot_vlan_page
+
+# The VLAN page is read once to plan, and every operation is one POST which the switch answers with the
+# VLAN page the next operation builds on. The login is not counted, it is one GET checking the token of the
+# token store, or 2 requests when there is none
+_PLAN_REQUESTS = 1
+
+
+class CheckResult(NamedTuple):
+    path: Path
+    host: Optional[str]
+    operations: List[OperationVLAN]
+    requests: int
+    error: Optional[str]
+
+
+def predicted_requests(operations: List[OperationVLAN]) -> int:
+    return _PLAN_REQUESTS + operations.__len__()
+
+
+def check_snapshot(path: Path, vlans: TYPE_VLANS) -> CheckResult:
+    # Plans the VLANs like `set_vlans` does against the switch, but from the VLAN page in its snapshot
+    try:
+        snapshot = load_snapshot(f"{path}")
+        page = snapshot_vlan_page(snapshot)
+        if page.mode == ModeVLAN.advanced_802_1q_vlan:
+            current_vlans, current_port2vlan_mapping = page.vlans, page.port2vlan
+        else:
+            current_vlans, current_port2vlan_mapping = {}, {}
+        operations, _ = plan_vlans(current_mode=page.mode, current_vlans=current_vlans,
+                                   current_port2vlan_mapping=current_port2vlan_mapping, new_vlans=vlans)
+    except Exception as err:
+        return CheckResult(path=path, host=None, operations=[], requests=0, error=f"{err}")
+    return CheckResult(path=path, host=snapshot["host"], operations=operations,
+                       requests=predicted_requests(operations), error=None)
+
+
+def sub_cmd_vlan_check(args: argparse.Namespace) -> int:
+    # The config is validated once, it is the same for every switch
+    try:
+        vlans = _validate_vlans(_parse_vlan_arguments(args.vlan_set))
+    except Exception as err:
+        emit("vlan_check", path=None, operations=[], requests=0, error=f"{err}")
+        print(f"Error: The VLAN config is not valid - {err}")
+        return 1
+
+    if args.hosts:
+        paths = [snapshot_path(args.vlan_check, host=host.host, port=host.port) for host in args.hosts]
+    else:
+        paths = sorted(Path(args.vlan_check).glob("*.json"))
+    if not paths:
+        print(f"Error: There are no snapshots in `{args.vlan_check}`")
+        return 1
+
+    changed = failed = 0
+    for path in paths:
+        result = check_snapshot(path, vlans)
+        emit("vlan_check", host=result.host, path=f"{path}",
+             operations=[f"{operation}" for operation in result.operations],
+             requests=result.requests, error=result.error)
+
+        if result.error is not None:
+            failed += 1
+            print(f"[{path}] FAILED - {result.error}")
+            continue
+        if not result.operations:
+            print(f"[{result.host}] OK - up to date, {result.requests} requests")
+            continue
+
+        changed += 1
+        print(f"[{result.host}] OK - {result.operations.__len__()} operations, {result.requests} requests")
+        for operation in result.operations:
+            print(f"[{result.host}] {operation}")
+
+    print(f"Checked {paths.__len__()} switches: {changed} would change, "
+          f"{paths.__len__() - changed - failed} are up to date, {failed} failed")
+    return 1 if failed else 0
@@ -1,29 +1,54 @@
 import argparse
 
-from .get_vlans import get_vlan_info, get_vlan_command
+from .get_vlans import get_vlan_info, get_vlan_command, get_vlans
 from .helper_functions import _parse_vlan_arguments
 from ..client import Client
-from .structs import ModeVLAN
-from .set_vlans import set_vlans
-from .set_mode import set_vlan_mode
+from ..output import emit
+from .structs import ModeVLAN, vlans_record
+from .plan import format_plan
+from .set_vlans import set_vlans, plan_set_vlans
+from .set_mode import get_vlan_mode, set_vlan_mode
+
+
+def _record_baseline(client: Client, args: argparse.Namespace):
+    # The snapshot module is only imported when a change is recorded
+    if args.vlan_record is None:
+        return
+    from ..snapshot import record_vlan_snapshot
+    path = record_vlan_snapshot(client, args.vlan_record)
+    emit("vlan_baseline", path=f"{path}")
+    print(f"Recorded the VLAN config as the baseline in `{path}`")
 
 
 def sub_cmd_vlan(client: Client, args: argparse.Namespace):
     if args.vlan_mode:
-        set_vlan_mode(client, ModeVLAN(args.mode))
+        result = set_vlan_mode(client, ModeVLAN[args.vlan_mode])
+        emit("vlan_mode", **result.to_record())
+        print(result)
+        _record_baseline(client, args)
         exit(0)
 
     if args.vlan_set:
         vlans = _parse_vlan_arguments(args.vlan_set)
+        if args.vlan_plan:
+            operations, _, _ = plan_set_vlans(client=client, vlans=vlans)
+            emit("vlan_plan", operations=[f"{operation}" for operation in operations])
+            print(format_plan(operations))
+            exit(0)
+
         result = set_vlans(client=client, vlans=vlans)
+        emit("vlan_set", **result.to_record())
         print(result)
+        _record_baseline(client, args)
         exit(0)
 
     if args.vlan_get == "info":
         result = get_vlan_info(client)
-        print(result)
-        exit(0)
     elif args.vlan_get == "command":
         result = get_vlan_command(client)
-        print(result)
-        exit(0)
+    else:
+        return
+    # The page was parsed for the text already, the record is built from the cached page
+    emit("vlans", mode=get_vlan_mode(client).value, vlans=vlans_record(get_vlans(client)))
+    print(result)
+    exit(0)
@@ -0,0 +1,39 @@
+from typing import Dict, List, Optional
+
+from .structs import TYPE_VLANS, AccessVLAN, ObjVLAN, ports_of_mask
+
+
+def _access(vlan_obj: ObjVLAN, port_no: int) -> AccessVLAN:
+    return vlan_obj.ports_access.get(port_no, AccessVLAN.excluded)
+
+
+def diff_vlans(old_vlans: TYPE_VLANS, new_vlans: TYPE_VLANS) -> List[str]:
+    changes = []
+    for vlan_id in sorted(old_vlans.keys() | new_vlans.keys()):
+        old_vlan, new_vlan = old_vlans.get(vlan_id), new_vlans.get(vlan_id)
+        if new_vlan is None:
+            changes.append(f"- VLAN {vlan_id} ({old_vlan.name})")
+            continue
+        if old_vlan is None:
+            ports = ", ".join(f"{port_no}:{access.name}" for port_no, access in new_vlan.ports_access.items())
+            changes.append(f"+ VLAN {vlan_id} ({new_vlan.name}) ports: {ports or '-'}")
+            continue
+        if old_vlan == new_vlan:
+            continue
+
+        if old_vlan.name != new_vlan.name:
+            changes.append(f"~ VLAN {vlan_id} name: {old_vlan.name} -> {new_vlan.name}")
+        # The ports whose access changed are the bits which differ in either mask
+        changed_ports = (old_vlan.tagged ^ new_vlan.tagged) | (old_vlan.untagged ^ new_vlan.untagged)
+        for port_no in ports_of_mask(changed_ports):
+            changes.append(f"~ VLAN {vlan_id} port {port_no}: {_access(old_vlan, port_no).name} "
+                           f"-> {_access(new_vlan, port_no).name}")
+    return changes
+
+
+def diff_pvids(old_pvids: Dict[int, Optional[int]], new_pvids: Dict[int, Optional[int]]) -> List[str]:
+    return [
+        f"~ port {port_no} PVID: {old_pvids.get(port_no)} -> {new_pvids.get(port_no)}"
+        for port_no in sorted(old_pvids.keys() | new_pvids.keys())
+        if old_pvids.get(port_no) != new_pvids.get(port_no)
+    ]
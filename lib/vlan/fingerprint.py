@@ -0,0 +1,60 @@
+import json
+import re
+from hashlib import sha256
+from html import unescape
+from typing import Dict, Optional
+
+from .structs import TYPE_VLANS, ModeVLAN, ObjVLAN, PageVLAN, masks_from_members
+from ..misc import switch_port_iter
+
+
+def vlan_fingerprint(mode: ModeVLAN, vlans: TYPE_VLANS, pvids: Dict[int, Optional[int]]) -> str:
+    return _fingerprint(mode.value, vlans, pvids)
+
+
+def _fingerprint(mode: str, vlans: TYPE_VLANS, pvids: Dict[int, Optional[int]]) -> str:
+    # The same VLAN config always has the same fingerprint, whichever order the switch lists the VLANs in
+    state = [
+        mode,
+        [[vlan_id, vlan_obj.name, vlan_obj.tagged, vlan_obj.untagged] for vlan_id, vlan_obj in sorted(vlans.items())],
+        [pvids.get(port_no) for port_no in switch_port_iter()],
+    ]
+    return sha256(json.dumps(state, separators=(",", ":")).encode()).hexdigest()
+
+
+def page_pvids(page: PageVLAN) -> Dict[int, Optional[int]]:
+    return {port_no: mapping.select_vlan_id for port_no, mapping in page.port2vlan.items()}
+
+
+def page_fingerprint(page: PageVLAN) -> str:
+    return vlan_fingerprint(page.mode, page.vlans, page_pvids(page))
+
+
+_MODE_RE = re.compile(r'vlanmode="([^"]*)"')
+_VLAN_RE = re.compile(r'list-vid="4"[^>]*>([^<]*)<.*?list-vnm="4"[^>]*>([^<]*)<.*?list-vhidmem="4"[^>]*value="([^"]*)"',
+                      re.DOTALL)
+_PVID_LIST_RE = re.compile(r'pvid-table-vlan-list[^>]*>([^<]*)<')
+
+
+def html_fingerprint(html: str) -> Optional[str]:
+    # The fingerprint of vlan.html from the few fields of the VLAN config, found with regular expressions
+    # instead of parsing the page. It is only used to confirm that a page has an expected fingerprint:
+    # a field which is not found or read differently gives another fingerprint, and the page is then
+    # parsed in full (`parse_vlan_page`) to tell what changed. None when the page has no VLAN mode
+    mode = _MODE_RE.search(html)
+    if mode is None:
+        return None
+
+    try:
+        vlans = {}
+        for vlan_id, name, members in _VLAN_RE.findall(html):
+            tagged, untagged = masks_from_members(members)
+            vlans[int(vlan_id)] = ObjVLAN(name=unescape(name), tagged=tagged, untagged=untagged)
+
+        pvids = {}
+        for port_no, vlan_ids in enumerate(_PVID_LIST_RE.findall(html), start=1):
+            pvids[port_no] = next((int(vlan_id.strip()[:-1]) for vlan_id in vlan_ids.split(",")
+                                   if vlan_id.strip().endswith("*")), None)
+    except Exception:
+        return None
+    return _fingerprint(unescape(mode.group(1)), vlans, pvids)
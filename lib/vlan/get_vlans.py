@@ -1,54 +1,47 @@
-from .helper_functions import _get_vlans_from_html_code
-from .structs import TYPE_VLANS, AccessVLAN
+from typing import TYPE_CHECKING
+
+from .helper_functions import _copy_vlans, _get_vlan_page, _vlan_page_steps
+from .structs import TYPE_VLANS, VLANTable
 from ..client import Client
+from ..misc import switch_port_iter
+from ..steps import drive_async
+
+if TYPE_CHECKING:
+    from ..async_client import AsyncClient
 
 
 def get_vlans(client: Client) -> TYPE_VLANS:
-    resp = client.get("/iss/specific/vlan.html")
-    vlans = _get_vlans_from_html_code(resp.text)
-    return vlans
+    return _copy_vlans(_get_vlan_page(client).vlans)
 
 
-def get_vlan_info(client: Client) -> str:
-    ports = get_vlans(client)
+async def get_vlans_async(client: "AsyncClient") -> TYPE_VLANS:
+    return _copy_vlans((await drive_async(client, _vlan_page_steps())).vlans)
 
-    table = {}
-    for vlan_id, vlan_obj in ports.items():
-        for port_no, access in vlan_obj.ports_access.items():
-            table.setdefault(port_no, {AccessVLAN.untagged: 1, AccessVLAN.tagged: []})
 
-            if access == AccessVLAN.untagged:
-                table[port_no][AccessVLAN.untagged] = vlan_id
-            elif access == AccessVLAN.tagged:
-                table[port_no][AccessVLAN.tagged].append(f"{vlan_id:>4}")
+def get_vlan_info(client: Client) -> str:
+    table = VLANTable(get_vlans(client))
 
     result = "Port No | VLAN Untagged | VLAN Tagged\n"
     result += "--------|---------------|-------------\n"
-    for port_no in sorted(table.keys()):
-        _vlans = table[port_no]
-
+    for port_no in switch_port_iter():
+        untagged_vlan_id = table.untagged_vlan(port_no)
         result += "{port:>7} | {untagged:>13} | {tagged}\n".format(
             port=port_no,
-            untagged=_vlans[AccessVLAN.untagged],
-            tagged=" ".join(_vlans[AccessVLAN.tagged]),
+            untagged=1 if untagged_vlan_id is None else untagged_vlan_id,
+            tagged=" ".join(f"{vlan_id:>4}" for vlan_id in table.tagged_vlans(port_no)),
         )
 
     return result
 
 
 def get_vlan_command(client: Client) -> str:
-    resp = client.get("/iss/specific/vlan.html")
-    vlans = _get_vlans_from_html_code(resp.text)
+    vlans = get_vlans(client)
 
     result = "--set "
     for vlan_id in sorted(vlans.keys()):
         _vlan_obj = vlans[vlan_id]
 
-        tmp_result = []
-        for port_no, access in _vlan_obj.ports_access.items():
-            if access == AccessVLAN.excluded:
-                continue
-            tmp_result.append(f"{port_no}:{access.name}")
+        tmp_result = [f"{port_no}:{access.name}" for port_no, access in _vlan_obj.ports_access.items()]
 
         result += f"{vlan_id}:{_vlan_obj.name}@" + ",".join(tmp_result) + " "
 
@@ -1,10 +1,16 @@
-from typing import Dict, List
+from typing import TYPE_CHECKING, Dict, List, Union
 
+import requests
 from bs4 import BeautifulSoup, Tag
 
-from .structs import TYPE_VLANS, AccessVLAN, ObjVLAN, MapPort2UntaggedVLAN
+from .page_parser import parse_vlan_page
+from .structs import TYPE_VLANS, AccessVLAN, ObjVLAN, MapPort2UntaggedVLAN, PageVLAN, port_bit, ports_of_mask
 from ..client import Client
 from ..misc import bad_request
+from ..steps import GetPage, Request, Steps, drive
+
+if TYPE_CHECKING:
+    from ..async_client import AsyncClient, AsyncResponse
 
 
 def _parse_vlan_arguments(args_set: List[str]) -> TYPE_VLANS:
@@ -56,6 +62,36 @@ def _parse_vlan_arguments(args_set: List[str]) -> TYPE_VLANS:
     return vlans
 
 
+VLAN_PAGE_PATH = "/iss/specific/vlan.html"
+
+
+def _get_vlan_page(client: Client) -> PageVLAN:
+    return client.get_page(VLAN_PAGE_PATH, parse_vlan_page)
+
+
+def _vlan_page_steps() -> Steps[PageVLAN]:
+    return (yield GetPage(VLAN_PAGE_PATH, parse_vlan_page))
+
+
+def _cache_vlan_page(client: Union[Client, "AsyncClient"], resp: Union[requests.Response, "AsyncResponse"]) -> PageVLAN:
+    try:
+        page = parse_vlan_page(resp.text)
+    except Exception as err:
+        bad_request(resp, err=err)
+    client.cache_page(VLAN_PAGE_PATH, page)
+    return page
+
+
+def _copy_vlans(vlans: TYPE_VLANS) -> TYPE_VLANS:
+    # The VLAN objects cannot be changed, so only the dictionary is copied
+    return dict(vlans)
+
+
+def _copy_port_2_vlan_mapping(port2vlan: Dict[int, MapPort2UntaggedVLAN]) -> Dict[int, MapPort2UntaggedVLAN]:
+    # The mapping of the cached page is shared by the session, the VLAN IDs of a port are a list
+    return {port_no: mapping._replace(vlan_ids=list(mapping.vlan_ids)) for port_no, mapping in port2vlan.items()}
+
+
 def _get_port_2_vlan_mapping_from_html_code(html: str):
     bs = BeautifulSoup(html, 'html.parser')
     vlan_table_elem: Tag = bs.find('ul', id="pvidList")
@@ -87,27 +123,100 @@ def _get_port_2_vlan_mapping_from_html_code(html: str):
     return map_port2vlan
 
 
-def _get_port_2_vlan_mapping(client: Client):
-    resp = client.get("/iss/specific/vlan.html")
-    vlans = _get_port_2_vlan_mapping_from_html_code(resp.text)
-    return vlans
+def _get_port_2_vlan_mapping(client: Client) -> Dict[int, MapPort2UntaggedVLAN]:
+    return _copy_port_2_vlan_mapping(_get_vlan_page(client).port2vlan)
 
 
-def _set_untagged_vlan_2_port(client: Client, port_no: int, vlan_id: int):
-    resp = client.post("/iss/specific/vlan.html", data={
+def _set_pvid_data(port_no: int, vlan_id: int) -> Dict[str, Union[str, int]]:
+    return {
         "page": "adv8021QPage",
         "ACTION": "setPvid",
         "PORT": port_no,
         "PVID": vlan_id,
-    })
-    result = _get_port_2_vlan_mapping_from_html_code(resp.text)
+    }
+
+
+def _check_set_pvid(client: Union[Client, "AsyncClient"], resp, port_no: int, vlan_id: int):
+    result = _cache_vlan_page(client, resp).port2vlan
     if result[port_no].select_vlan_id != vlan_id:
         bad_request(resp)
 
 
+def _set_untagged_vlan_2_port_steps(client: Union[Client, "AsyncClient"], port_no: int, vlan_id: int) -> Steps[None]:
+    resp = yield Request("POST", VLAN_PAGE_PATH, {"data": _set_pvid_data(port_no=port_no, vlan_id=vlan_id)})
+    _check_set_pvid(client, resp, port_no=port_no, vlan_id=vlan_id)
+
+
+def _set_untagged_vlan_2_port(client: Client, port_no: int, vlan_id: int):
+    drive(client, _set_untagged_vlan_2_port_steps(client, port_no=port_no, vlan_id=vlan_id))
+
+
+def _validate_ports_access(id_: int, name: str, ports_access: dict) -> ObjVLAN:
+    if type(ports_access) != dict:
+        raise Exception(f"The attribute `ports_access` of the VLAN object have to be a dictionary, "
+                        f"but the one with VLAN ID `{id_}` has the type `{type(name)}`")
+
+    tagged = untagged = 0
+    for port_no, access in ports_access.items():
+        if type(port_no) != int:
+            raise Exception(
+                f"The port numbers, which are provided as the key in the dictionary "
+                f"for the attribute `ports_access` of the VLAN object, have to be an integer. "
+                f"However, that is not the case for the VLAN ID `{id_}`."
+            )
+
+        if not 1 <= port_no <= 16:
+            raise Exception(
+                f"The port numbers, which are provided as the key in the dictionary "
+                f"for the attribute `ports_access` of the VLAN object, "
+                f"have to be an number which between 1-16, not `{port_no}`. "
+                f"However, that is not the case for the VLAN ID `{id_}`."
+            )
+
+        if type(access) == AccessVLAN:
+            new_access = access
+
+        elif type(access) == int:
+            if 1 <= access <= 3:
+                new_access = AccessVLAN(access)
+            else:
+                raise Exception(
+                    f"The port_access type, which are provided as the value in the dictionary "
+                    f"for the attribute `ports_access` of the VLAN object, "
+                    f"have to be an number which between 1-3, not `{port_no}`. "
+                    f"Note: `1 = tagged`, `2 = untagged` and `3 = excluded`. "
+                    f"However, that is not the case for port `{port_no}` for the VLAN ID `{id_}`."
+                )
+        elif type(access) == str:
+            if access in {"tagged", "untagged", "excluded"}:
+                new_access = AccessVLAN[access]
+            else:
+                raise Exception(
+                    f"The port_access type, which are provided as the value in the dictionary "
+                    f"for the attribute `ports_access` of the VLAN object, "
+                    f"have to be an of the following `tagged`, `untagged` or `excluded`. "
+                    f"However, that is not the case for port `{port_no}` for the VLAN ID `{id_}`."
+                )
+        else:
+            raise Exception(
+                f'The port_access type, which are provided as the value in the dictionary '
+                f'for the attribute `ports_access` of the VLAN object, '
+                f'can one of 3 types `{AccessVLAN.__class__.name}`, `integer` or `str`, not `{type(access)}`. '
+                f'Note: `1 = "tagged"`, `2 = "untagged"` and `3 = "excluded"`. '
+                f'However, that is not the case for port `{port_no}` for the VLAN ID `{id_}`.'
+            )
+
+        if new_access == AccessVLAN.tagged:
+            tagged |= port_bit(port_no)
+        elif new_access == AccessVLAN.untagged:
+            untagged |= port_bit(port_no)
+
+    return ObjVLAN(name=name, tagged=tagged, untagged=untagged)
+
+
 def _validate_vlans(vlans: TYPE_VLANS) -> TYPE_VLANS:
     vlan_names = {}
-    untagged_ports = {}
+    untagged_ports = 0
     new_vlans = {}
 
     for id_, obj in vlans.items():
@@ -124,6 +233,9 @@ def _validate_vlans(vlans: TYPE_VLANS) -> TYPE_VLANS:
             else:
                 name = obj.get("name")
                 ports_access = obj.get("ports_access")
+        elif isinstance(obj, ObjVLAN):
+            name = obj.name
+            ports_access = None
         else:
             name = obj.name
             ports_access = obj.ports_access
@@ -143,73 +255,25 @@ def _validate_vlans(vlans: TYPE_VLANS) -> TYPE_VLANS:
         else:
             vlan_names[name] = id_
 
-        if type(ports_access) != dict:
-            raise Exception(f"The attribute `ports_access` of the VLAN object have to be a dictionary, "
-                            f"but the one with VLAN ID `{id_}` has the type `{type(name)}`")
-
-        new_ports_access = {}
-        for port_no, access in ports_access.items():
-            if type(port_no) != int:
-                raise Exception(
-                    f"The port numbers, which are provided as the key in the dictionary "
-                    f"for the attribute `ports_access` of the VLAN object, have to be an integer. "
-                    f"However, that is not the case for the VLAN ID `{id_}`."
-                )
-
-            if not 1 <= port_no <= 16:
-                raise Exception(
-                    f"The port numbers, which are provided as the key in the dictionary "
-                    f"for the attribute `ports_access` of the VLAN object, "
-                    f"have to be an number which between 1-16, not `{port_no}`. "
-                    f"However, that is not the case for the VLAN ID `{id_}`."
-                )
-
-            if type(access) == AccessVLAN:
-                new_access = access
-
-            elif type(access) == int:
-                if 1 <= access <= 3:
-                    new_access = AccessVLAN(access)
-                else:
-                    raise Exception(
-                        f"The port_access type, which are provided as the value in the dictionary "
-                        f"for the attribute `ports_access` of the VLAN object, "
-                        f"have to be an number which between 1-3, not `{port_no}`. "
-                        f"Note: `1 = tagged`, `2 = untagged` and `3 = excluded`. "
-                        f"However, that is not the case for port `{port_no}` for the VLAN ID `{id_}`."
-                    )
-            elif type(access) == str:
-                if access in {"tagged", "untagged", "excluded"}:
-                    new_access = AccessVLAN[access]
-                else:
-                    raise Exception(
-                        f"The port_access type, which are provided as the value in the dictionary "
-                        f"for the attribute `ports_access` of the VLAN object, "
-                        f"have to be an of the following `tagged`, `untagged` or `excluded`. "
-                        f"However, that is not the case for port `{port_no}` for the VLAN ID `{id_}`."
-                    )
-            else:
-                raise Exception(
-                    f'The port_access type, which are provided as the value in the dictionary '
-                    f'for the attribute `ports_access` of the VLAN object, '
-                    f'can one of 3 types `{AccessVLAN.__class__.name}`, `integer` or `str`, not `{type(access)}`. '
-                    f'Note: `1 = "tagged"`, `2 = "untagged"` and `3 = "excluded"`. '
-                    f'However, that is not the case for port `{port_no}` for the VLAN ID `{id_}`.'
-                )
-
-            if new_access == AccessVLAN.untagged:
-                if port_no in untagged_ports.keys():
-                    raise Exception(
-                        f"There cannot be 2 VLANs which are untagged on the same port! "
-                        f"The VLAN ID `{id_}` is untagged on the same port (`{port_no}`) "
-                        f"as the VLAN ID `{untagged_ports[port_no]}`."
-                    )
-                else:
-                    untagged_ports[port_no] = id_
-
-            new_ports_access[port_no] = new_access
-
-        new_vlans[id_] = ObjVLAN(name=name, ports_access=new_ports_access)
+        if ports_access is None:
+            # The masks of an ObjVLAN are checked when it is created (see `ObjVLAN.__new__`)
+            new_vlan = ObjVLAN(name=name, tagged=obj.tagged, untagged=obj.untagged)
+        else:
+            new_vlan = _validate_ports_access(id_, name=name, ports_access=ports_access)
+
+        # A port untagged in two VLANs shows up as a bit set in both untagged masks
+        conflicts = new_vlan.untagged & untagged_ports
+        if conflicts:
+            port_no = ports_of_mask(conflicts)[0]
+            other_id = next(vlan_id for vlan_id, vlan_obj in new_vlans.items() if vlan_obj.untagged & port_bit(port_no))
+            raise Exception(
+                f"There cannot be 2 VLANs which are untagged on the same port! "
+                f"The VLAN ID `{id_}` is untagged on the same port (`{port_no}`) "
+                f"as the VLAN ID `{other_id}`."
+            )
+        untagged_ports |= new_vlan.untagged
+
+        new_vlans[id_] = new_vlan
 
     return new_vlans
 
@@ -231,9 +295,7 @@ def _get_vlans_from_html_code(html: str):
         vlan_name = elem.find('span', attrs={"list-vnm": 4}).get_text()
 
         vlan_ports_str = elem.find('input', attrs={"list-vhidmem": 4}).get("value")
-        vlan_ports = {index+1: AccessVLAN(int(status))
-                     for index, status in enumerate(list(vlan_ports_str))}
 
-        vlans[vlan_id_int] = ObjVLAN(name=vlan_name, ports_access=vlan_ports)
+        vlans[vlan_id_int] = ObjVLAN.from_members(name=vlan_name, members=vlan_ports_str)
 
     return vlans
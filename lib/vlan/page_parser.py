@@ -0,0 +1,121 @@
+from html.parser import HTMLParser
+from typing import Dict, List, Optional, Tuple
+
+from .structs import MapPort2UntaggedVLAN, ModeVLAN, ObjVLAN, PageVLAN, TYPE_VLANS
+from ..trace import traced_parser
+
+_VOID_ELEMENTS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+
+class _VLANPageParser(HTMLParser):
+    # Reads the VLAN mode, the VLAN table (`AQVTbl`) and the PVID list (`pvidList`) from vlan.html
+    # in one pass over the tokens, without building a document tree
+    def __init__(self):
+        super(_VLANPageParser, self).__init__()
+        self.mode: Optional[str] = None
+        self.vlans: TYPE_VLANS = {}
+        self.port2vlan: Dict[int, MapPort2UntaggedVLAN] = {}
+
+        self._stack: List[Tuple[str, Dict[str, str]]] = []
+        self._section: Optional[str] = None
+        self._section_depth = 0
+        self._item: Dict[str, str] = {}
+        self._capture: Optional[str] = None
+        self._capture_text = ""
+
+    def handle_starttag(self, tag, attrs):
+        attrs = {key: value or "" for key, value in attrs}
+        classes = attrs.get("class", "").split()
+
+        if tag == "span" and "status-text" in classes and self.mode is None and self._stack:
+            self.mode = self._stack[-1][1].get("vlanmode")
+
+        if tag == "ul" and attrs.get("id") in {"AQVTbl", "pvidList"}:
+            self._section = attrs["id"]
+            self._section_depth = self._stack.__len__()
+
+        elif self._section == "AQVTbl":
+            if tag == "li":
+                self._flush_item()
+            elif tag == "span" and attrs.get("list-vid") == "4":
+                self._start_capture("vlan_id")
+            elif tag == "span" and attrs.get("list-vnm") == "4":
+                self._start_capture("name")
+            elif tag == "input" and attrs.get("list-vhidmem") == "4":
+                self._item["members"] = attrs.get("value", "")
+
+        elif self._section == "pvidList":
+            if tag == "li":
+                self._flush_item()
+            elif tag == "span" and "port-count" in classes:
+                self._start_capture("port_no")
+            elif tag == "span" and "pvid-table-vlan-list" in classes:
+                self._start_capture("vlan_ids")
+
+        if tag not in _VOID_ELEMENTS:
+            self._stack.append((tag, attrs))
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in _VOID_ELEMENTS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag == "span" and self._capture is not None:
+            self._item[self._capture] = self._capture_text
+            self._capture = None
+
+        # Unclosed elements (which browsers tolerate) are closed together with their parent
+        for index in range(self._stack.__len__() - 1, -1, -1):
+            if self._stack[index][0] == tag:
+                del self._stack[index:]
+                break
+
+        if self._section is not None:
+            if tag == "li":
+                self._flush_item()
+            if self._stack.__len__() <= self._section_depth:
+                self._flush_item()
+                self._section = None
+
+    def handle_data(self, data):
+        if self._capture is not None:
+            self._capture_text += data
+
+    def _start_capture(self, key: str):
+        self._capture = key
+        self._capture_text = ""
+
+    def _flush_item(self):
+        item, self._item = self._item, {}
+        if not item:
+            return
+
+        if self._section == "AQVTbl":
+            self.vlans[int(item["vlan_id"])] = ObjVLAN.from_members(name=item["name"], members=item["members"])
+
+        elif self._section == "pvidList":
+            select_vlan_id = None
+            vlan_ids = []
+            for vlan_id_str in item["vlan_ids"].split(","):
+                vlan_id_str = vlan_id_str.strip()
+                if vlan_id_str.endswith("*"):
+                    select_vlan_id = int(vlan_id_str[:-1])
+                    vlan_ids.append(select_vlan_id)
+                else:
+                    vlan_ids.append(int(vlan_id_str))
+
+            self.port2vlan[int(item["port_no"])] = MapPort2UntaggedVLAN(select_vlan_id=select_vlan_id,
+                                                                          vlan_ids=vlan_ids)
+
+
+@traced_parser
+def parse_vlan_page(html: str) -> PageVLAN:
+    parser = _VLANPageParser()
+    parser.feed(html)
+    parser.close()
+
+    if parser.mode is None:
+        raise Exception("The VLAN mode was not found on the page")
+
+    return PageVLAN(mode=ModeVLAN(parser.mode), vlans=parser.vlans, port2vlan=parser.port2vlan)
@@ -0,0 +1,125 @@
+from enum import Enum
+from typing import Dict, List, NamedTuple, Tuple
+
+from .structs import ALL_PORTS_MASK, TYPE_VLANS, MapPort2UntaggedVLAN, ModeVLAN, ObjVLAN, VLANTable, port_bit
+from ..misc import switch_port_iter
+
+
+class ActionVLAN(str, Enum):
+    set_mode = "set-mode"
+    add_vlan = "add-vlan"
+    edit_vlan = "edit-vlan"
+    set_pvid = "set-pvid"
+    remove_vlan = "remove-vlan"
+
+
+class OperationVLAN(NamedTuple):
+    action: ActionVLAN
+    vlan_id: int = None
+    vlan_obj: ObjVLAN = None
+    port_no: int = None
+    mode: ModeVLAN = None
+
+    def __str__(self):
+        if self.action == ActionVLAN.set_mode:
+            return f"~ set the VLAN mode to `{self.mode.value}`"
+        if self.action == ActionVLAN.add_vlan:
+            return f"+ add VLAN {self.vlan_id} `{self.vlan_obj.name}` {self.vlan_obj.ports_access_to_str()}"
+        if self.action == ActionVLAN.edit_vlan:
+            return f"~ edit VLAN {self.vlan_id} `{self.vlan_obj.name}` {self.vlan_obj.ports_access_to_str()}"
+        if self.action == ActionVLAN.set_pvid:
+            return f"~ set the PVID of port {self.port_no} to VLAN {self.vlan_id}"
+        return f"- remove VLAN {self.vlan_id}"
+
+
+def _default_vlans() -> Tuple[TYPE_VLANS, Dict[int, MapPort2UntaggedVLAN]]:
+    vlans = {1: ObjVLAN(name="Default", untagged=ALL_PORTS_MASK)}
+    port2vlan = {port_no: MapPort2UntaggedVLAN(select_vlan_id=1, vlan_ids=[1]) for port_no in switch_port_iter()}
+    return vlans, port2vlan
+
+
+def _desired_state(new_vlans: TYPE_VLANS) -> Tuple[TYPE_VLANS, Dict[int, int]]:
+    new_vlans = dict(new_vlans)
+
+    # Every port which is not untagged in any of the given VLANs falls back to be untagged in VLAN 1
+    new_port2vlan_mapping = {port_no: 1 for port_no in switch_port_iter()}
+    new_port2vlan_mapping.update(VLANTable(new_vlans).untagged_ports())
+
+    default_vlan = new_vlans.get(1, ObjVLAN(name="Default"))
+    fallback_ports = sum(port_bit(port_no) for port_no, vlan_id in new_port2vlan_mapping.items() if vlan_id == 1)
+    new_vlans[1] = default_vlan._replace(tagged=default_vlan.tagged & ~fallback_ports,
+                                         untagged=default_vlan.untagged | fallback_ports)
+
+    return new_vlans, new_port2vlan_mapping
+
+
+def _vlan_differs(current_vlan_obj: ObjVLAN, new_vlan_obj: ObjVLAN) -> bool:
+    return current_vlan_obj != new_vlan_obj
+
+
+def _staged_vlan(vlan_id: int, current_vlan_obj: ObjVLAN, new_vlan_obj: ObjVLAN,
+                 current_port2vlan_mapping: Dict[int, MapPort2UntaggedVLAN]) -> ObjVLAN:
+    # The switch refuses to remove a port from the VLAN which is its PVID, so those ports keep their
+    # current access until their PVID has been moved, every other port gets its new access right away
+    pinned_ports = sum(port_bit(port_no) for port_no in switch_port_iter()
+                       if current_port2vlan_mapping[port_no].select_vlan_id == vlan_id)
+    pinned_ports &= ~(new_vlan_obj.tagged | new_vlan_obj.untagged)
+    return ObjVLAN(name=new_vlan_obj.name,
+                   tagged=new_vlan_obj.tagged | (current_vlan_obj.tagged & pinned_ports),
+                   untagged=new_vlan_obj.untagged | (pinned_ports & ~current_vlan_obj.tagged))
+
+
+def plan_vlans(current_mode: ModeVLAN, current_vlans: TYPE_VLANS,
+               current_port2vlan_mapping: Dict[int, MapPort2UntaggedVLAN],
+               new_vlans: TYPE_VLANS) -> Tuple[List[OperationVLAN], TYPE_VLANS]:
+    # The operations are ordered so the switch never has a reason to refuse one of them:
+    #   1. add the new VLANs and let the existing VLANs take the ports which get them as PVID
+    #   2. move the PVIDs, every port is a member of its new PVID VLAN at this point
+    #   3. edit the VLANs to their final membership, no port has one of the removed memberships as PVID
+    #   4. remove the VLANs which are no longer wanted, no port has them as PVID either
+    operations = []
+    if current_mode != ModeVLAN.advanced_802_1q_vlan:
+        # Changing the mode resets the VLANs on the switch to the defaults
+        operations.append(OperationVLAN(action=ActionVLAN.set_mode, mode=ModeVLAN.advanced_802_1q_vlan))
+        current_vlans, current_port2vlan_mapping = _default_vlans()
+
+    new_vlans, new_port2vlan_mapping = _desired_state(new_vlans)
+    staged_vlans = dict(current_vlans)
+
+    for vlan_id in sorted(set(new_vlans.keys()) - set(current_vlans.keys())):
+        operations.append(OperationVLAN(action=ActionVLAN.add_vlan, vlan_id=vlan_id, vlan_obj=new_vlans[vlan_id]))
+        staged_vlans[vlan_id] = new_vlans[vlan_id]
+
+    moved_ports = [port_no for port_no in switch_port_iter()
+                   if current_port2vlan_mapping[port_no].select_vlan_id != new_port2vlan_mapping[port_no]]
+
+    # The port has to be a member of the VLAN before it can be set as its PVID
+    joined_vlans = {new_port2vlan_mapping[port_no] for port_no in moved_ports
+                    if new_port2vlan_mapping[port_no] in current_vlans and
+                    new_port2vlan_mapping[port_no] not in current_port2vlan_mapping[port_no].vlan_ids}
+    for vlan_id in sorted(joined_vlans):
+        staged_vlans[vlan_id] = _staged_vlan(vlan_id=vlan_id, current_vlan_obj=current_vlans[vlan_id],
+                                             new_vlan_obj=new_vlans[vlan_id],
+                                             current_port2vlan_mapping=current_port2vlan_mapping)
+        operations.append(OperationVLAN(action=ActionVLAN.edit_vlan, vlan_id=vlan_id,
+                                        vlan_obj=staged_vlans[vlan_id]))
+
+    for port_no in moved_ports:
+        operations.append(OperationVLAN(action=ActionVLAN.set_pvid, vlan_id=new_port2vlan_mapping[port_no],
+                                        port_no=port_no))
+
+    for vlan_id in sorted(set(new_vlans.keys()) & set(current_vlans.keys())):
+        if _vlan_differs(staged_vlans[vlan_id], new_vlans[vlan_id]):
+            operations.append(OperationVLAN(action=ActionVLAN.edit_vlan, vlan_id=vlan_id,
+                                            vlan_obj=new_vlans[vlan_id]))
+
+    for vlan_id in sorted(set(current_vlans.keys()) - set(new_vlans.keys())):
+        operations.append(OperationVLAN(action=ActionVLAN.remove_vlan, vlan_id=vlan_id))
+
+    return operations, new_vlans
+
+
+def format_plan(operations: List[OperationVLAN]) -> str:
+    if not operations:
+        return "No changes, the VLANs on the switch are already up to date"
+    return "\n".join(f"{operation}" for operation in operations)
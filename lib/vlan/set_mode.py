@@ -1,50 +1,67 @@
 import pprint
-from bs4 import BeautifulSoup
+from typing import TYPE_CHECKING, Any, Dict, NamedTuple
 
+from .helper_functions import VLAN_PAGE_PATH, _cache_vlan_page, _get_vlan_page, _vlan_page_steps
 from .structs import ModeVLAN
 from ..client import Client
 from ..misc import bad_request
+from ..steps import Request, Steps, drive, drive_async
 
+if TYPE_CHECKING:
+    from ..async_client import AsyncClient
 
-def get_vlan_mode(client: Client) -> ModeVLAN:
-    resp = client.get("/iss/specific/vlan.html")
-
-    bs = BeautifulSoup(resp.text, 'html.parser')
-    current_vlan_mode = bs.find("span", attrs={"class": "status-text"}).parent.get("vlanmode")
-    if current_vlan_mode is None:
-        bad_request(resp)
 
-    return ModeVLAN(current_vlan_mode)
+def get_vlan_mode(client: Client) -> ModeVLAN:
+    return _get_vlan_page(client).mode
 
 
-def set_vlan_mode(client: Client, mode: ModeVLAN | str):
+def _check_vlan_mode(mode: ModeVLAN | str) -> ModeVLAN:
     if type(mode) == str:
         mode = ModeVLAN(mode)
 
     if mode in [ModeVLAN.basic_port_based_vlan, ModeVLAN.advanced_port_based_vlan, ModeVLAN.basic_802_1q_vlan]:
         raise TypeError(f'The VLAN Mode is not supported - mode: {mode}')
+    return mode
 
-    current_vlan_mode = get_vlan_mode(client)
 
-    if current_vlan_mode == mode:
-        return {
-            "status_code": 0, "status": f"The mode is already: {mode.value}",
-            "old_mode": current_vlan_mode, "new_mode": mode,
+class SetVLANModeResult(NamedTuple):
+    old_mode: ModeVLAN
+    new_mode: ModeVLAN
+
+    @property
+    def changed(self) -> bool:
+        return self.old_mode != self.new_mode
+
+    def to_record(self) -> Dict[str, Any]:
+        return {"changed": self.changed, "old_mode": self.old_mode.value, "new_mode": self.new_mode.value}
+
+    def __str__(self):
+        result = {
+            "status_code": 1 if self.changed else 0,
+            "status": f"Changed the mode to: {self.new_mode.value}" if self.changed
+            else f"The mode is already: {self.new_mode.value}",
+            "old_mode": self.old_mode, "new_mode": self.new_mode,
         }
+        return pprint.pformat(result, indent=4)
+
 
-    resp = client.post("/iss/specific/vlan.html", data={"page": "", "VLAN_MOD_SET": mode.value})
-    bs = BeautifulSoup(resp.text, 'html.parser')
-    try:
-        new_vlan_mode_str = bs.find("span", attrs={"class": "status-text"}).parent.get("vlanmode")
-    except Exception as err:
-        bad_request(resp, err=err)
+def _set_vlan_mode_steps(client: "Client | AsyncClient", mode: ModeVLAN | str) -> Steps[SetVLANModeResult]:
+    mode = _check_vlan_mode(mode)
+    current_vlan_mode = (yield from _vlan_page_steps()).mode
+
+    if current_vlan_mode == mode:
+        return SetVLANModeResult(old_mode=mode, new_mode=mode)
 
-    new_vlan_mode = ModeVLAN(new_vlan_mode_str)
+    resp = yield Request("POST", VLAN_PAGE_PATH, {"data": {"page": "", "VLAN_MOD_SET": mode.value}})
+    new_vlan_mode = _cache_vlan_page(client, resp).mode
     if new_vlan_mode != mode:
         bad_request(resp)
+    return SetVLANModeResult(old_mode=current_vlan_mode, new_mode=new_vlan_mode)
+
+
+def set_vlan_mode(client: Client, mode: ModeVLAN | str) -> SetVLANModeResult:
+    return drive(client, _set_vlan_mode_steps(client, mode))
+
 
-    result = {
-        "status_code": 0, "status": f"The mode is already: {mode.value}",
-        "old_mode": current_vlan_mode, "new_mode": new_vlan_mode,
-    }
-    return pprint.pformat(result, indent=4)
+async def set_vlan_mode_async(client: "AsyncClient", mode: ModeVLAN | str) -> SetVLANModeResult:
+    return await drive_async(client, _set_vlan_mode_steps(client, mode))
@@ -1,147 +1,168 @@
 import pprint
 import re
+from typing import TYPE_CHECKING, Any, Dict, List, NamedTuple, Tuple, Union
 
-from .get_vlans import get_vlans
 from .helper_functions import (
-    _get_vlans_from_html_code,
+    VLAN_PAGE_PATH,
+    _cache_vlan_page,
+    _copy_port_2_vlan_mapping,
+    _copy_vlans,
     _validate_vlans,
-    _get_port_2_vlan_mapping,
-    _get_port_2_vlan_mapping_from_html_code,
-    _set_untagged_vlan_2_port,
+    _set_untagged_vlan_2_port_steps,
+    _vlan_page_steps,
 )
-from .set_mode import set_vlan_mode
-from .structs import TYPE_VLANS, ModeVLAN, AccessVLAN, ObjVLAN
+from .plan import ActionVLAN, OperationVLAN, plan_vlans
+from .set_mode import _set_vlan_mode_steps
+from .structs import TYPE_VLANS, ModeVLAN, AccessVLAN, ObjVLAN, vlans_record
 from ..client import Client
-from ..misc import switch_port_iter, bad_request
+from ..misc import bad_request
+from ..steps import Request, Steps, drive, drive_async
+from ..trace import operation as trace_operation
 
+if TYPE_CHECKING:
+    from ..async_client import AsyncClient
 
-def error_handler_cannot_remove_port(client: Client, html_text: str) -> bool:
-    check_text = re.search(
+
+def _add_vlan_data(vlan_id: int, vlan_obj: ObjVLAN) -> Dict[str, Union[str, int]]:
+    return {
+        "page": "adv8021QPage",
+        "ACTION": "add",
+        "VLAN_ID": vlan_id,
+        "VLAN_NAME": vlan_obj.name,
+        "hiddenMem": vlan_obj.ports_access_to_str(),
+        "voiceVLANID": 0,
+        "autoCameraVLANID": 0,
+        "autoWifiVLANID": 0,
+        "fsVoiceVlanCos": 6,
+        "fsAutoCameraVlanCos": 6,
+        "fsAutoWifiVlanCos": 6
+    }
+
+
+def _check_add_vlan(client: Union[Client, "AsyncClient"], resp, vlan_id: int, vlan_obj: ObjVLAN) -> str:
+    # The plan moves the PVIDs before a membership is removed, so this is a bug in the plan and not retried
+    cannot_remove_port = re.search(
         r"Cannot remove port [@]?(?P<PORT>[0-9]+)[@]? from this VLAN. Change its PVID first",
-        html_text,
+        resp.text,
         re.IGNORECASE
     )
-    if check_text is None:
-        return False
-
-    vlan_id = 1
-
-    port_no = int(check_text.groupdict().get("PORT"))
-    vlans = get_vlans(client)
-
-    vlan_obj = vlans[vlan_id]
-    vlan_obj.ports_access[port_no] = AccessVLAN.untagged
-
-    _add_vlan(client=client, vlan_id=vlan_id, vlan_obj=vlan_obj)
-    _set_untagged_vlan_2_port(client=client, port_no=port_no, vlan_id=vlan_id)
-
-    return True
-
-
-def _add_vlan(client: Client, vlan_id: int, vlan_obj: ObjVLAN) -> str:
-    while True:
-        resp = client.post("/iss/specific/vlan.html", data={
-            "page": "adv8021QPage",
-            "ACTION": "add",
-            "VLAN_ID": vlan_id,
-            "VLAN_NAME": vlan_obj.name,
-            "hiddenMem": vlan_obj.ports_access_to_str(),
-            "voiceVLANID": 0,
-            "autoCameraVLANID": 0,
-            "autoWifiVLANID": 0,
-            "fsVoiceVlanCos": 6,
-            "fsAutoCameraVlanCos": 6,
-            "fsAutoWifiVlanCos": 6
-        })
-        html_text = resp.text
-
-        if error_handler_cannot_remove_port(client=client, html_text=html_text) is False:
-            break
-
-    vlans = _get_vlans_from_html_code(html_text)
-    if not (vlan_id in vlans and
-            vlans[vlan_id].name == vlan_obj.name and
-            vlans[vlan_id].ports_access_to_str() == vlan_obj.ports_access_to_str()):
+    if cannot_remove_port is not None:
+        bad_request(resp, msg=f"Bad Request ({cannot_remove_port.group(0)})")
+
+    vlans = _cache_vlan_page(client, resp).vlans
+    if vlans.get(vlan_id) != vlan_obj:
         bad_request(resp)
 
     return resp.text
 
 
-def set_vlans(client: Client, vlans = TYPE_VLANS):
-    result = set_vlan_mode(client=client, mode=ModeVLAN.advanced_802_1q_vlan)
-    status_code = 0
+def _add_vlan_steps(client: Union[Client, "AsyncClient"], vlan_id: int, vlan_obj: ObjVLAN) -> Steps[str]:
+    resp = yield Request("POST", VLAN_PAGE_PATH, {"data": _add_vlan_data(vlan_id=vlan_id, vlan_obj=vlan_obj)})
+    return _check_add_vlan(client, resp, vlan_id=vlan_id, vlan_obj=vlan_obj)
+
 
+def _plan_set_vlans_steps(vlans: TYPE_VLANS) -> Steps[Tuple[List[OperationVLAN], TYPE_VLANS, TYPE_VLANS]]:
     new_vlans = _validate_vlans(vlans)
-    current_vlans = get_vlans(client)
-
-    new_port2vlan_mapping = {port_no: 1 for port_no in switch_port_iter()}
-    new_vlan2port_mapping = {1: list(switch_port_iter())}
-    for vlan_id, vlan_obj in new_vlans.items():
-        for port_no, port_access in vlan_obj.ports_access.items():
-            if port_access == AccessVLAN.untagged:
-                new_port2vlan_mapping[port_no] = vlan_id
-                new_vlan2port_mapping.setdefault(vlan_id, [])
-                new_vlan2port_mapping[vlan_id].append(port_no)
-                new_vlan2port_mapping[1].remove(port_no)
-
-    new_vlans.setdefault(1, ObjVLAN(name="Default", ports_access={}))
-    for port_no, vlan_id in new_port2vlan_mapping.items():
-        if vlan_id == 1:
-            new_vlans[1].ports_access[port_no] = AccessVLAN.untagged
-
-    add_vlans = set(new_vlans.keys()) - set(current_vlans.keys())
-    if add_vlans:
-        for vlan_id in add_vlans:
-            _add_vlan(client, vlan_id, new_vlans[vlan_id])
-            status_code = 1
-
-    edit_vlans = sorted(set(new_vlans.keys()) & set(current_vlans.keys()))
-    if edit_vlans:
-        current_port2vlan_mapping = _get_port_2_vlan_mapping(client)
-
-        for port_no in switch_port_iter():
-            curr_port2vlan = current_port2vlan_mapping[port_no]
-            new_port2vlan_id = new_port2vlan_mapping[port_no]
-            if curr_port2vlan.select_vlan_id != new_port2vlan_id:
-                if new_port2vlan_id not in curr_port2vlan.vlan_ids:
-                    tmp_vlan_obj = ObjVLAN(name=new_vlans[new_port2vlan_id].name,
-                                           ports_access=new_vlans[new_port2vlan_id].ports_access.copy())
-                    for _port_no in new_vlan2port_mapping[new_port2vlan_id]:
-                        tmp_vlan_obj.ports_access[_port_no] = AccessVLAN.untagged
-
-                    html = _add_vlan(client=client, vlan_id=new_port2vlan_id, vlan_obj=tmp_vlan_obj)
-                    current_port2vlan_mapping = _get_port_2_vlan_mapping_from_html_code(html)
-
-                _set_untagged_vlan_2_port(client=client, port_no=port_no, vlan_id=new_port2vlan_id)
-                status_code = 1
-
-        for vlan_id in edit_vlans:
-            status_code = 1
-            _add_vlan(client, vlan_id, new_vlans[vlan_id])
-
-    remove_vlans = set(current_vlans.keys()) - set(new_vlans.keys())
-    if remove_vlans:
-        for vlan_id in remove_vlans:
-            remove_vlan(client=client, vlan_id=vlan_id)
-            status_code = 1
-
-    result["status_code"] = status_code
-    result["status"] = "Updated VLANs on the switch"
-    result["old_vlans"] = {vlan_id: vlan_obj.filter_out_access_states({AccessVLAN.excluded}) for vlan_id, vlan_obj in current_vlans.items()}
-    result["new_vlans"] = {vlan_id: vlan_obj.filter_out_access_states({AccessVLAN.excluded}) for vlan_id, vlan_obj in new_vlans.items()}
-    return pprint.pformat(result, indent=4)
+    with trace_operation("plan"):
+        page = yield from _vlan_page_steps()
+        current_mode = page.mode
 
+        if current_mode == ModeVLAN.advanced_802_1q_vlan:
+            current_vlans = _copy_vlans(page.vlans)
+            current_port2vlan_mapping = _copy_port_2_vlan_mapping(page.port2vlan)
+        else:
+            current_vlans, current_port2vlan_mapping = {}, {}
 
-def remove_vlan(client: Client, vlan_id):
-    resp = client.post("/iss/specific/vlan.html", data={
-        "page": "adv8021QPage",
-        "ACTION": "delete",
-        "VLAN_ID": vlan_id,
-    })
+    operations, new_vlans = plan_vlans(current_mode=current_mode, current_vlans=current_vlans,
+                                       current_port2vlan_mapping=current_port2vlan_mapping, new_vlans=new_vlans)
+    return operations, current_vlans, new_vlans
+
+
+def plan_set_vlans(client: Client, vlans: TYPE_VLANS) -> Tuple[List[OperationVLAN], TYPE_VLANS, TYPE_VLANS]:
+    return drive(client, _plan_set_vlans_steps(vlans))
+
+
+def _operation_steps(client: Union[Client, "AsyncClient"], operation: OperationVLAN) -> Steps[None]:
+    with trace_operation(operation.action.value):
+        if operation.action == ActionVLAN.set_mode:
+            yield from _set_vlan_mode_steps(client, mode=operation.mode)
+        elif operation.action in {ActionVLAN.add_vlan, ActionVLAN.edit_vlan}:
+            yield from _add_vlan_steps(client, vlan_id=operation.vlan_id, vlan_obj=operation.vlan_obj)
+        elif operation.action == ActionVLAN.set_pvid:
+            yield from _set_untagged_vlan_2_port_steps(client, port_no=operation.port_no, vlan_id=operation.vlan_id)
+        elif operation.action == ActionVLAN.remove_vlan:
+            yield from _remove_vlan_steps(client, vlan_id=operation.vlan_id)
+
+
+class SetVLANsResult(NamedTuple):
+    operations: List[OperationVLAN]
+    old_vlans: TYPE_VLANS
+    new_vlans: TYPE_VLANS
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.operations)
+
+    def to_record(self) -> Dict[str, Any]:
+        return {
+            "changed": self.changed,
+            "operations": [f"{operation}" for operation in self.operations],
+            "old_vlans": vlans_record(self.old_vlans),
+            "new_vlans": vlans_record(self.new_vlans),
+        }
+
+    def __str__(self):
+        result = {
+            "status_code": 1 if self.changed else 0,
+            "status": "Updated VLANs on the switch" if self.changed else "The VLANs on the switch are already up to date",
+            "operations": [f"{operation}" for operation in self.operations],
+        }
+        result["old_vlans"] = {vlan_id: vlan_obj.filter_out_access_states({AccessVLAN.excluded}) for vlan_id, vlan_obj in self.old_vlans.items()}
+        result["new_vlans"] = {vlan_id: vlan_obj.filter_out_access_states({AccessVLAN.excluded}) for vlan_id, vlan_obj in self.new_vlans.items()}
+        return pprint.pformat(result, indent=4)
 
+
+def _set_vlans_steps(client: Union[Client, "AsyncClient"], vlans: TYPE_VLANS) -> Steps[SetVLANsResult]:
+    # The operations depend on each other, so they are sent one after the other. With the async client
+    # the concurrency comes from driving many switches from the same event loop
+    operations, current_vlans, new_vlans = yield from _plan_set_vlans_steps(vlans)
+
+    # The VLANs on the switch are reset when the mode changes, so plan again from the new state
+    if operations and operations[0].action == ActionVLAN.set_mode:
+        yield from _operation_steps(client, operation=operations[0])
+        operations, current_vlans, new_vlans = yield from _plan_set_vlans_steps(vlans)
+
+    for operation in operations:
+        yield from _operation_steps(client, operation=operation)
+
+    return SetVLANsResult(operations=operations, old_vlans=current_vlans, new_vlans=new_vlans)
+
+
+def set_vlans(client: Client, vlans = TYPE_VLANS) -> SetVLANsResult:
+    return drive(client, _set_vlans_steps(client, vlans))
+
+
+async def set_vlans_async(client: "AsyncClient", vlans: TYPE_VLANS) -> SetVLANsResult:
+    return await drive_async(client, _set_vlans_steps(client, vlans))
+
+
+def _check_remove_vlan(client: Union[Client, "AsyncClient"], resp, vlan_id: int):
     if "You can not remove this VLAN" in resp.text:
         bad_request(resp, msg=f"Bad Request ({resp.text})")
 
-    result = _get_vlans_from_html_code(resp.text)
+    result = _cache_vlan_page(client, resp).vlans
     if result.get(vlan_id):
         bad_request(resp)
+
+
+def _remove_vlan_steps(client: Union[Client, "AsyncClient"], vlan_id: int) -> Steps[None]:
+    resp = yield Request("POST", VLAN_PAGE_PATH, {"data": {
+        "page": "adv8021QPage",
+        "ACTION": "delete",
+        "VLAN_ID": vlan_id,
+    }})
+    _check_remove_vlan(client, resp, vlan_id=vlan_id)
+
+
+def remove_vlan(client: Client, vlan_id):
+    drive(client, _remove_vlan_steps(client, vlan_id=vlan_id))
@@ -1,8 +1,15 @@
+from array import array
 from enum import Enum
-from typing import Dict, NamedTuple, List, Set
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Any, Dict, Iterator, Mapping, NamedTuple, List, Optional, Set, Tuple
 
 from ..misc import switch_port_iter
 
+PORT_COUNT = 16
+ALL_PORTS_MASK = (1 << PORT_COUNT) - 1
+MAX_VLAN_ID = 4095
+
 
 class ModeVLAN(str, Enum):
     no_vlans = 'noVlan'
@@ -21,23 +28,106 @@ class AccessVLAN(int, Enum):
         return f"{self.name}"
 
 
-class ObjVLAN(NamedTuple):
+# A set of ports is a mask with the bit `port_no - 1` set for every port in it
+def port_bit(port_no: int) -> int:
+    return 1 << (port_no - 1)
+
+
+def ports_of_mask(mask: int) -> List[int]:
+    return [port_no for port_no in switch_port_iter() if mask >> (port_no - 1) & 1]
+
+
+# `hiddenMem` has one digit (AccessVLAN) per port starting with port 1, reversed it reads like a mask
+_TAGGED_DIGITS = str.maketrans("123", "100")
+_UNTAGGED_DIGITS = str.maketrans("123", "010")
+
+
+def masks_from_members(members: str) -> Tuple[int, int]:
+    members = members[::-1]
+    return int(members.translate(_TAGGED_DIGITS) or "0", 2), int(members.translate(_UNTAGGED_DIGITS) or "0", 2)
+
+
+@lru_cache(maxsize=4096)
+def members_from_masks(tagged: int, untagged: int) -> str:
+    return "".join(
+        "1" if tagged >> index & 1 else "2" if untagged >> index & 1 else "3"
+        for index in range(PORT_COUNT)
+    )
+
+
+def _masks_from_ports_access(ports_access: Dict[int, AccessVLAN]) -> Tuple[int, int]:
+    tagged = untagged = 0
+    for port_no, access in ports_access.items():
+        if type(port_no) != int or not 1 <= port_no <= PORT_COUNT:
+            raise Exception(f"The port numbers of a VLAN have to be between 1-{PORT_COUNT}, not `{port_no}`")
+
+        if type(access) == str and access in AccessVLAN.__members__:
+            access = AccessVLAN[access]
+        if access == AccessVLAN.tagged:
+            tagged |= port_bit(port_no)
+        elif access == AccessVLAN.untagged:
+            untagged |= port_bit(port_no)
+        elif access != AccessVLAN.excluded:
+            raise Exception(f"The access of port `{port_no}` has to be tagged(1), untagged(2) or excluded(3), "
+                            f"not `{access}`")
+    return tagged, untagged
+
+
+class _MasksVLAN(NamedTuple):
     name: str
-    ports_access: Dict[int, AccessVLAN]
+    tagged: int
+    untagged: int
+
+
+class ObjVLAN(_MasksVLAN):
+    # The membership is kept as a tagged and an untagged port mask, `ports_access` and the `hiddenMem`
+    # string of the switch are views built from them. A port which is in neither mask is excluded
+    __slots__ = ()
+
+    def __new__(cls, name: str, ports_access: Dict[int, AccessVLAN] = None, tagged: int = 0, untagged: int = 0):
+        if ports_access is not None:
+            tagged, untagged = _masks_from_ports_access(ports_access)
+        else:
+            # The masks given directly are checked, a port is either tagged or untagged and only the
+            # ports of the switch have a bit
+            if (tagged | untagged) & ~ALL_PORTS_MASK:
+                raise Exception(f"The VLAN `{name}` has members which are not ports of the switch, "
+                                f"tagged: {tagged:#x}, untagged: {untagged:#x}")
+            if tagged & untagged:
+                raise Exception(f"The VLAN `{name}` has the ports {ports_of_mask(tagged & untagged)} "
+                                f"tagged and untagged at the same time")
+        return super(ObjVLAN, cls).__new__(cls, name, tagged, untagged)
+
+    def __getnewargs__(self):
+        # copy, deepcopy and pickle call `__new__` with these, the masks are not the second argument
+        return self.name, None, self.tagged, self.untagged
+
+    @classmethod
+    def from_members(cls, name: str, members: str) -> "ObjVLAN":
+        tagged, untagged = masks_from_members(members)
+        return cls(name=name, tagged=tagged, untagged=untagged)
+
+    @property
+    def ports_access(self) -> Mapping[int, AccessVLAN]:
+        # A read-only view, a write to it could not change the masks of the (immutable) VLAN and would be lost.
+        # A changed VLAN is built with `ObjVLAN(name=..., ports_access={...})`
+        return MappingProxyType({
+            port_no: AccessVLAN.tagged if self.tagged >> (port_no - 1) & 1 else AccessVLAN.untagged
+            for port_no in ports_of_mask(self.tagged | self.untagged)
+        })
 
     def ports_access_to_str(self):
-        return ''.join([
-            self.ports_access.get(index, AccessVLAN.excluded).value.__str__()
-            for index in switch_port_iter()
-        ])
+        return members_from_masks(self.tagged, self.untagged)
 
     def filter_out_access_states(self, access_states: Set[AccessVLAN]) -> "ObjVLAN":
-        result = {
-            port_no: access
-            for port_no, access in self.ports_access.items()
-            if access not in access_states
-        }
-        return ObjVLAN(name=self.name, ports_access=result)
+        return ObjVLAN(
+            name=self.name,
+            tagged=0 if AccessVLAN.tagged in access_states else self.tagged,
+            untagged=0 if AccessVLAN.untagged in access_states else self.untagged,
+        )
+
+    def __repr__(self):
+        return f"ObjVLAN(name={self.name!r}, ports_access={dict(self.ports_access)!r})"
 
 class MapPort2UntaggedVLAN(NamedTuple):
     select_vlan_id: int
@@ -45,3 +135,62 @@ class MapPort2UntaggedVLAN(NamedTuple):
 
 
 TYPE_VLANS = Dict[int, ObjVLAN]
+
+
+def vlans_record(vlans: TYPE_VLANS) -> Dict[int, Dict[str, Any]]:
+    # The VLANs as plain data for the JSON output, the members are listed by their access
+    return {
+        vlan_id: {"name": vlan_obj.name, "tagged": ports_of_mask(vlan_obj.tagged),
+                  "untagged": ports_of_mask(vlan_obj.untagged)}
+        for vlan_id, vlan_obj in sorted(vlans.items())
+    }
+
+
+class VLANTable:
+    # The port masks of all the VLANs in two arrays indexed by the VLAN ID, so the questions about
+    # the ports (which VLAN is untagged on it, which VLANs are tagged on it) are bit tests on integers
+    def __init__(self, vlans: TYPE_VLANS = None):
+        self.tagged = array("H", bytes(2 * (MAX_VLAN_ID + 1)))
+        self.untagged = array("H", bytes(2 * (MAX_VLAN_ID + 1)))
+        self.names: Dict[int, str] = {}
+        for vlan_id, vlan_obj in (vlans or {}).items():
+            self[vlan_id] = vlan_obj
+
+    def __setitem__(self, vlan_id: int, vlan_obj: ObjVLAN):
+        self.tagged[vlan_id] = vlan_obj.tagged
+        self.untagged[vlan_id] = vlan_obj.untagged
+        self.names[vlan_id] = vlan_obj.name
+
+    def __getitem__(self, vlan_id: int) -> ObjVLAN:
+        return ObjVLAN(name=self.names[vlan_id], tagged=self.tagged[vlan_id], untagged=self.untagged[vlan_id])
+
+    def __contains__(self, vlan_id: int) -> bool:
+        return vlan_id in self.names
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(sorted(self.names))
+
+    def __len__(self) -> int:
+        return self.names.__len__()
+
+    def untagged_vlan(self, port_no: int) -> Optional[int]:
+        bit = port_bit(port_no)
+        return next((vlan_id for vlan_id in self if self.untagged[vlan_id] & bit), None)
+
+    def tagged_vlans(self, port_no: int) -> List[int]:
+        bit = port_bit(port_no)
+        return [vlan_id for vlan_id in self if self.tagged[vlan_id] & bit]
+
+    def untagged_ports(self) -> Dict[int, int]:
+        # Port to the VLAN which is untagged on it, for the ports which are untagged in a VLAN
+        result = {}
+        for vlan_id in self:
+            for port_no in ports_of_mask(self.untagged[vlan_id]):
+                result.setdefault(port_no, vlan_id)
+        return result
+
+
+class PageVLAN(NamedTuple):
+    mode: ModeVLAN
+    vlans: TYPE_VLANS
+    port2vlan: Dict[int, MapPort2UntaggedVLAN]
@@ -0,0 +1,118 @@
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from datetime import datetime
+from time import monotonic, sleep
+from typing import List, Optional
+
+from .diff import diff_pvids, diff_vlans
+from .fingerprint import page_pvids
+from .helper_functions import VLAN_PAGE_PATH
+from .page_parser import parse_vlan_page
+from .structs import PageVLAN
+from ..client import Client
+from ..inventory import Host
+from ..misc import bad_request
+from ..output import emit
+
+
+class VLANWatcher:
+    # Keeps the last vlan.html of one switch. A page with the same bytes as the last one is not parsed
+    # again, and a changed page only reports the VLANs and PVIDs which differ from the last one
+    def __init__(self, client: Client):
+        self.client = client
+        self.content: Optional[bytes] = None
+        self.page: Optional[PageVLAN] = None
+
+    def poll(self) -> List[str]:
+        resp = self.client.get(VLAN_PAGE_PATH)
+        if resp.content == self.content:
+            return []
+
+        try:
+            page = parse_vlan_page(resp.text)
+        except Exception as err:
+            bad_request(resp, err=err)
+        self.client.cache_page(VLAN_PAGE_PATH, page)
+
+        previous_page, self.content, self.page = self.page, resp.content, page
+        if previous_page is None:
+            return [f"watching {page.vlans.__len__()} VLANs in the mode `{page.mode.value}`"]
+
+        changes = []
+        if previous_page.mode != page.mode:
+            changes.append(f"~ VLAN mode: {previous_page.mode.name} -> {page.mode.name}")
+        changes += diff_vlans(previous_page.vlans, page.vlans)
+        changes += diff_pvids(page_pvids(previous_page), page_pvids(page))
+        return changes
+
+
+class _WatchedSwitch:
+    def __init__(self, host: Host):
+        self.host = host
+        self.watcher: Optional[VLANWatcher] = None
+        self.error: Optional[str] = None
+
+
+def watch_vlans(args: argparse.Namespace, hosts: List[Host], interval_sec: float, max_workers: int = 8,
+                rounds: int = None):
+    # Every switch keeps its session for the whole watch, and all of them are polled in rounds by
+    # one pool of threads, so a site of switches costs one GET per switch and interval
+    switches = [_WatchedSwitch(host) for host in hosts]
+    lock = threading.Lock()
+    prefix_host = hosts.__len__() > 1
+
+    def report(switch: _WatchedSwitch, lines: List[str], error: str = None):
+        emit("vlan_watch", host=f"{switch.host}", changes=[] if error else lines, error=error)
+        timestamp = datetime.now().strftime("%H:%M:%S")
+        prefix = f"[{switch.host}] " if prefix_host else ""
+        with lock:
+            for line in lines:
+                print(f"{prefix}{timestamp} {line}", flush=True)
+
+    def poll(switch: _WatchedSwitch):
+        try:
+            if switch.watcher is None:
+                client = Client.from_args(args, host=switch.host.host, port=switch.host.port)
+                client.login(password=args.password)
+                switch.watcher = VLANWatcher(client)
+            changes = switch.watcher.poll()
+        except Exception as err:
+            # An error is reported when it starts and not on every round it goes on for
+            if switch.error is None:
+                report(switch, [f"! {err}"], error=f"{err}")
+            switch.error = f"{err}"
+            return
+
+        if switch.error is not None:
+            switch.error = None
+            changes.insert(0, "the switch answers again")
+        if changes:
+            report(switch, changes)
+
+    round_no = 0
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, hosts.__len__()))) as executor:
+        while rounds is None or round_no < rounds:
+            round_start = monotonic()
+            futures = [executor.submit(copy_context().run, poll, switch) for switch in switches]
+            for future in futures:
+                future.result()
+            round_no += 1
+            if rounds is None or round_no < rounds:
+                sleep(max(0.0, interval_sec - (monotonic() - round_start)))
+
+
+def sub_cmd_vlan_watch(args: argparse.Namespace) -> int:
+    if not args.hosts:
+        print("Error: At least one switch have to be provided with --host or --inventory")
+        return 1
+    if args.password is None:
+        print("Error: The password for the switches have to be provided with --password")
+        return 1
+
+    try:
+        watch_vlans(args, hosts=args.hosts, interval_sec=args.vlan_watch, max_workers=args.workers)
+    except KeyboardInterrupt:
+        pass
+    return 0
@@ -1,15 +1,48 @@
 import argparse
+import sys
 
-from lib import get_args, Client
+from lib import get_args
+
+
+def _start_output(args: argparse.Namespace):
+    if args.output != "text":
+        from lib.output import start_output
+        start_output(args.output)
 
 
 def main():
     args = get_args()
 
-    client = Client(host=args.host, port=args.port, proxy_url=args.proxy_url)
-    client.login(password=args.password)
+    if args.trace:
+        from lib.trace import start_tracing
+        start_tracing(args.trace)
+
+    if args.run is not None:
+        from lib.trace import operation
+        _start_output(args)
+        with operation(args.command):
+            exit(args.run(args))
+
+    # The client and the sub-command modules are imported only on the path which needs them
+    if args.daemon_url:
+        # The daemon writes the records of the command, they are passed through as they are
+        from lib.daemon_client import forward_to_daemon
+        exit(forward_to_daemon(args.daemon_url, sys.argv[1:], password=args.password,
+                                secret_file=args.daemon_secret_file))
+
+    _start_output(args)
+    if args.hosts.__len__() > 1:
+        from lib.fleet import run_fleet
+        exit(run_fleet(args, hosts=args.hosts, max_workers=args.workers))
+
+    from lib.client import Client
+    from lib.output import record_host
+    from lib.trace import operation
+    with operation(args.command), record_host(f"{args.hosts[0]}"):
+        client = Client.from_args(args)
+        client.login(password=args.password)
 
-    args.func(client, args)
+        args.func(client, args)
     exit(0)
 
     # result = update(client)
@@ -0,0 +1,62 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from lib.arguments import get_args
+from lib.batch import load_script, parse_script
+from lib.daemon import DaemonServer
+
+GLOBAL_ARGV = ["--host", "127.0.0.1:1", "--password", "password"]
+
+
+class TestParseScript(unittest.TestCase):
+    def setUp(self):
+        self.args = get_args([*GLOBAL_ARGV, "batch", "script.txt"])
+
+    def test_lines(self):
+        lines = parse_script(self.args, "# power cycle the cameras\n\npoe --reset 1 2\nmirror-port --disable  # done\n")
+        self.assertEqual([(line.line_no, line.error) for line in lines], [(3, None), (4, None)])
+        self.assertEqual(lines[0].args.command, "poe")
+        self.assertEqual(lines[0].args.host, "127.0.0.1")
+        self.assertEqual(lines[1].text, "mirror-port --disable  # done")
+
+    def test_errors_are_kept_per_line(self):
+        # (line, part of the error), a bad line does not stop the other lines from being parsed
+        cases = [
+            ("poe --reset 1 'unclosed", "quotation"),
+            ("poe --reset port", "invalid int value"),
+            ("reboot", "invalid choice"),
+            ("--host 10.0.0.1 poe --reset 1", "global arguments cannot be changed"),
+            ("batch other.txt", "cannot be run in a batch"),
+            ("drift /tmp/baselines", "cannot be run in a batch"),
+        ]
+        lines = parse_script(self.args, "\n".join(line for line, _ in cases) + "\nmirror-port --disable\n")
+        for (text, error), line in zip(cases, lines):
+            with self.subTest(text):
+                self.assertIsNone(line.args)
+                self.assertIn(error, line.error)
+        self.assertIsNone(lines[-1].error)
+
+    def test_script_is_read_once_per_command(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / "script.txt"
+            path.write_text("poe --reset 1\n")
+            first = load_script(self.args, f"{path}")
+            path.write_text("poe --reset 2\n")
+            self.assertIs(load_script(self.args, f"{path}"), first)
+            # The next command reads it again
+            next_args = get_args([*GLOBAL_ARGV, "batch", f"{path}"])
+            self.assertEqual(load_script(next_args, f"{path}")[0].text, "poe --reset 2")
+
+
+class TestDaemonBatch(unittest.TestCase):
+    def test_batch_from_stdin_is_rejected(self):
+        server = DaemonServer(get_args(["daemon"]), host="127.0.0.1", port=0)
+        self.addCleanup(server.server_close)
+        result = server.run_command(["--host", "127.0.0.1:1", "batch", "-"], password="password")
+        self.assertEqual(result["exit_code"], 1)
+        self.assertIn("`batch -` cannot be run by the daemon", result["output"])
+
+
+if __name__ == "__main__":
+    unittest.main()
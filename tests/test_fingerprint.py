@@ -0,0 +1,61 @@
+import unittest
+from unittest import mock
+
+from lib import drift
+from lib.emulator import EmulatedSwitch, _vlan_page
+from lib.snapshot import _vlan_section
+from lib.vlan.fingerprint import html_fingerprint, page_fingerprint
+from lib.vlan.page_parser import parse_vlan_page
+
+
+def _switch(vlans=None, pvids=None, vlan_mode: str = "adv8021Q") -> EmulatedSwitch:
+    switch = EmulatedSwitch()
+    switch.vlans.update(vlans or {})
+    switch.pvids.update(pvids or {})
+    switch.vlan_mode = vlan_mode
+    return switch
+
+
+DEFAULT = _switch()
+ZONED = _switch(vlans={1: ["Default", "3322222222222221"], 10: ["cams & <doors>", "2233333333333331"]},
+                pvids={1: 10, 2: 10})
+BASIC = _switch(vlan_mode="bsc8021Q")
+
+
+def _baseline(switch: EmulatedSwitch):
+    return {"host": "switch", "vlan": _vlan_section(parse_vlan_page(_vlan_page(switch)))}
+
+
+class TestHTMLFingerprint(unittest.TestCase):
+    def test_same_as_parsed_page(self):
+        for name, switch in [("default", DEFAULT), ("zoned", ZONED), ("basic mode", BASIC)]:
+            with self.subTest(name):
+                html = _vlan_page(switch)
+                self.assertEqual(html_fingerprint(html), page_fingerprint(parse_vlan_page(html)))
+
+    def test_not_a_vlan_page(self):
+        self.assertIsNone(html_fingerprint("<html><body>Login</body></html>"))
+
+
+class TestCheckDrift(unittest.TestCase):
+    def _check(self, switch: EmulatedSwitch, baseline_switch: EmulatedSwitch):
+        client = mock.Mock()
+        client.get.return_value = mock.Mock(status_code=200, text=_vlan_page(switch))
+        with mock.patch.object(drift, "parse_vlan_page", wraps=parse_vlan_page) as parser:
+            result = drift.check_drift(client, _baseline(baseline_switch))
+        return result, parser.call_count
+
+    def test_unchanged_switch_is_not_parsed(self):
+        result, parsed = self._check(ZONED, baseline_switch=ZONED)
+        self.assertFalse(result.drifted)
+        self.assertEqual(parsed, 0)
+
+    def test_changed_switch_is_parsed_and_diffed(self):
+        result, parsed = self._check(ZONED, baseline_switch=DEFAULT)
+        self.assertTrue(result.drifted)
+        self.assertEqual(parsed, 1)
+        self.assertIn("~ port 1 PVID: 1 -> 10", result.changes)
+
+
+if __name__ == "__main__":
+    unittest.main()
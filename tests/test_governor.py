@@ -0,0 +1,94 @@
+import threading
+import unittest
+from time import monotonic, sleep
+
+from lib.governor import Governor, _AIMDLimit
+
+PATH = "/iss/specific/vlan.html"
+
+
+def _answer(limit: _AIMDLimit, latency_sec: float = 0.01, failed: bool = False):
+    saturated = limit.acquire()
+    limit.sample(PATH, started_at=monotonic(), latency_sec=latency_sec, failed=failed, saturated=saturated)
+
+
+class TestAIMDLimit(unittest.TestCase):
+    def test_starts_at_half_of_the_max(self):
+        self.assertEqual(_AIMDLimit(max_limit=8).limit, 4)
+        self.assertEqual(_AIMDLimit(max_limit=1).limit, 1)
+
+    def test_increases_by_one_per_limit_answers(self):
+        limit = _AIMDLimit(max_limit=8)
+        limit.in_flight = 3
+        for _ in range(4):
+            _answer(limit)
+        self.assertAlmostEqual(limit.limit, 5, delta=0.1)
+
+    def test_does_not_increase_below_the_limit(self):
+        limit = _AIMDLimit(max_limit=8)
+        for _ in range(10):
+            _answer(limit)
+        self.assertEqual(limit.limit, 4)
+
+    def test_halves_on_failure(self):
+        limit = _AIMDLimit(max_limit=8)
+        _answer(limit, failed=True)
+        self.assertEqual(limit.limit, 2)
+
+    def test_halves_on_slow_answer(self):
+        limit = _AIMDLimit(max_limit=8)
+        _answer(limit, latency_sec=0.01)
+        _answer(limit, latency_sec=0.5)
+        self.assertEqual(limit.limit, 2)
+
+    def test_halves_once_for_the_requests_in_flight_together(self):
+        limit = _AIMDLimit(max_limit=8)
+        started_at = monotonic()
+        for _ in range(3):
+            limit.acquire()
+        for _ in range(3):
+            limit.sample(PATH, started_at=started_at, latency_sec=None, failed=True, saturated=False)
+        self.assertEqual(limit.limit, 2)
+
+    def test_floor_and_ceiling(self):
+        limit = _AIMDLimit(max_limit=4)
+        for _ in range(10):
+            _answer(limit, failed=True)
+            sleep(0.001)
+        self.assertEqual(limit.limit, 1)
+
+        limit.limit = 4.0
+        limit.in_flight = 3
+        for _ in range(20):
+            _answer(limit)
+        self.assertEqual(limit.limit, 4)
+
+
+class TestGovernor(unittest.TestCase):
+    def test_bounds_the_requests_in_flight(self):
+        governor = Governor(max_limit=4)
+        lock = threading.Lock()
+        in_flight = [0, 0]
+
+        def request():
+            with governor.slot(PATH, measured=False):
+                with lock:
+                    in_flight[0] += 1
+                    in_flight[1] = max(in_flight)
+                sleep(0.01)
+                with lock:
+                    in_flight[0] -= 1
+
+        threads = [threading.Thread(target=request) for _ in range(12)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # The answers are not measured, so the limit stays at its start (half of the max)
+        self.assertEqual(governor.limit, 2)
+        self.assertLessEqual(in_flight[1], 2)
+        self.assertEqual(governor.in_flight, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
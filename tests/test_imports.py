@@ -0,0 +1,45 @@
+import subprocess
+import sys
+import unittest
+from pathlib import Path
+from typing import List
+
+from lib.emulator import start_emulator
+
+ROOT = Path(__file__).resolve().parent.parent
+
+COMMANDS = ["update", "rollout", "vlan", "poe", "mirror-port", "snapshot", "diff", "drift", "batch", "daemon",
+            "exporter"]
+# The modules a short command must not import, they belong to the other commands
+HEAVY_MODULES = {"asyncio", "bs4", "concurrent.futures", "lib.async_client", "lib.firmware", "lib.vlan.cmds",
+                 "lib.daemon"}
+
+
+def _imported_modules(argv: List[str]) -> List[str]:
+    # `-X importtime` lists the modules imported with an import statement. The sub-command module itself is
+    # imported with import_module (see `_lazy_command`) and is not listed, but everything it imports is
+    proc = subprocess.run([sys.executable, "-X", "importtime", "main.py", *argv], cwd=ROOT,
+                          capture_output=True, text=True)
+    return [line.split("|")[-1].strip() for line in proc.stderr.splitlines() if line.startswith("import time:")]
+
+
+class TestImportBudget(unittest.TestCase):
+    def test_help_imports_no_command(self):
+        for command in COMMANDS:
+            with self.subTest(command):
+                self.assertEqual(sorted(HEAVY_MODULES.intersection(_imported_modules([command, "--help"]))), [])
+
+    def test_short_commands(self):
+        server = start_emulator(password="password")
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        host = ["--host", f"{server.host}:{server.port}", "--password", "password"]
+        for argv in [["poe", "--reset", "1"], ["mirror-port", "--disable"]]:
+            with self.subTest(argv[0]):
+                modules = _imported_modules([*host, *argv])
+                self.assertIn("lib.client", modules)
+                self.assertEqual(sorted(HEAVY_MODULES.intersection(modules)), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+
+from lib.inventory import Host, parse_host
+
+# value, the host and port it is parsed to
+PARSE_HOST_CASES = [
+    ("192.168.0.239", Host(host="192.168.0.239", port=80)),
+    ("192.168.0.239:8080", Host(host="192.168.0.239", port=8080)),
+    ("switch.lan", Host(host="switch.lan", port=80)),
+    ("switch.lan:8080", Host(host="switch.lan", port=8080)),
+    (" switch.lan ", Host(host="switch.lan", port=80)),
+    ("fe80::1", Host(host="fe80::1", port=80)),
+    ("2001:db8::8080", Host(host="2001:db8::8080", port=80)),
+    ("[fe80::1]", Host(host="fe80::1", port=80)),
+    ("[fe80::1]:8080", Host(host="fe80::1", port=8080)),
+    ("[2001:db8::1]:80", Host(host="2001:db8::1", port=80)),
+]
+
+
+class TestParseHost(unittest.TestCase):
+    def test_parse_host(self):
+        for value, expected in PARSE_HOST_CASES:
+            with self.subTest(value):
+                self.assertEqual(parse_host(value), expected)
+
+    def test_default_port(self):
+        self.assertEqual(parse_host("[fe80::1]", default_port=8080), Host(host="fe80::1", port=8080))
+        self.assertEqual(parse_host("switch.lan", default_port=8080), Host(host="switch.lan", port=8080))
+
+    def test_malformed_brackets(self):
+        for value in ["[fe80::1", "[fe80::1]8080", "[fe80::1]:", "[fe80::1]:port"]:
+            with self.subTest(value):
+                with self.assertRaises(Exception):
+                    parse_host(value)
+
+    def test_str_round_trip(self):
+        for value, expected in PARSE_HOST_CASES:
+            with self.subTest(value):
+                self.assertEqual(parse_host(f"{expected}"), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+from pathlib import Path
+
+from lib.vlan.helper_functions import _get_port_2_vlan_mapping_from_html_code, _get_vlans_from_html_code
+from lib.vlan.page_parser import parse_vlan_page
+from lib.vlan.structs import AccessVLAN, ModeVLAN
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+
+
+class TestParseVLANPage(unittest.TestCase):
+    def setUp(self):
+        self.html = (FIXTURES / "vlan.html").read_text()
+
+    def test_same_as_bs4_functions(self):
+        page = parse_vlan_page(self.html)
+        self.assertEqual(page.vlans, _get_vlans_from_html_code(self.html))
+        self.assertEqual(page.port2vlan, _get_port_2_vlan_mapping_from_html_code(self.html))
+
+    def test_page(self):
+        page = parse_vlan_page(self.html)
+        self.assertEqual(page.mode, ModeVLAN.advanced_802_1q_vlan)
+        self.assertEqual(sorted(page.vlans), [1, 10, 20, 4093])
+        self.assertEqual(page.vlans[10].name, "cams & <doors>")
+        self.assertEqual(dict(page.vlans[10].ports_access),
+                         {1: AccessVLAN.untagged, 2: AccessVLAN.untagged, 16: AccessVLAN.tagged})
+        self.assertEqual(page.port2vlan[16].select_vlan_id, 4093)
+        self.assertEqual(page.port2vlan[16].vlan_ids, [10, 20, 4093])
+
+    def test_not_a_vlan_page(self):
+        with self.assertRaises(Exception):
+            parse_vlan_page("<html><body><form id=\"loginForm\"></form></body></html>")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+import unittest
+from typing import Dict
+
+from lib.misc import switch_port_iter
+from lib.vlan.plan import ActionVLAN, OperationVLAN, plan_vlans
+from lib.vlan.structs import ALL_PORTS_MASK, TYPE_VLANS, MapPort2UntaggedVLAN, ModeVLAN, ObjVLAN, port_bit
+
+ADVANCED = ModeVLAN.advanced_802_1q_vlan
+
+
+def _mask(*ports: int) -> int:
+    return sum(port_bit(port_no) for port_no in ports)
+
+
+def _vlan(name: str, untagged: int = 0, tagged: int = 0) -> ObjVLAN:
+    return ObjVLAN(name=name, tagged=tagged, untagged=untagged)
+
+
+def _port2vlan(vlans: TYPE_VLANS) -> Dict[int, MapPort2UntaggedVLAN]:
+    # What the switch reports for the VLANs: the PVID is the VLAN which is untagged on the port
+    port2vlan = {}
+    for port_no in switch_port_iter():
+        member_of = [vlan_id for vlan_id, vlan_obj in sorted(vlans.items())
+                     if (vlan_obj.tagged | vlan_obj.untagged) & port_bit(port_no)]
+        pvid = next(vlan_id for vlan_id in member_of if vlans[vlan_id].untagged & port_bit(port_no))
+        port2vlan[port_no] = MapPort2UntaggedVLAN(select_vlan_id=pvid, vlan_ids=member_of)
+    return port2vlan
+
+
+def _edit(vlan_id: int, vlan_obj: ObjVLAN) -> OperationVLAN:
+    return OperationVLAN(action=ActionVLAN.edit_vlan, vlan_id=vlan_id, vlan_obj=vlan_obj)
+
+
+def _set_pvid(port_no: int, vlan_id: int) -> OperationVLAN:
+    return OperationVLAN(action=ActionVLAN.set_pvid, vlan_id=vlan_id, port_no=port_no)
+
+
+# name, current mode, current VLANs, new VLANs, the operations in the order they have to be sent
+PLAN_CASES = [
+    (
+        "unchanged",
+        ADVANCED,
+        {1: _vlan("Default", untagged=ALL_PORTS_MASK & ~_mask(1)), 10: _vlan("ten", untagged=_mask(1))},
+        {10: _vlan("ten", untagged=_mask(1))},
+        [],
+    ),
+    (
+        # The port joins VLAN 10 before its PVID moves there, and only then leaves VLAN 1
+        "move a PVID",
+        ADVANCED,
+        {1: _vlan("Default", untagged=ALL_PORTS_MASK & ~_mask(5)), 10: _vlan("ten", untagged=_mask(5))},
+        {10: _vlan("ten", untagged=_mask(5, 6))},
+        [
+            _edit(10, _vlan("ten", untagged=_mask(5, 6))),
+            _set_pvid(6, 10),
+            _edit(1, _vlan("Default", untagged=ALL_PORTS_MASK & ~_mask(5, 6))),
+        ],
+    ),
+    (
+        # Both VLANs keep the ports which have them as PVID until the PVIDs are swapped
+        "re-zone",
+        ADVANCED,
+        {1: _vlan("Default", untagged=ALL_PORTS_MASK & ~_mask(1, 2, 3, 4)),
+         10: _vlan("ten", untagged=_mask(1, 2)), 20: _vlan("twenty", untagged=_mask(3, 4))},
+        {10: _vlan("ten", untagged=_mask(3, 4)), 20: _vlan("twenty", untagged=_mask(1, 2))},
+        [
+            _edit(10, _vlan("ten", untagged=_mask(1, 2, 3, 4))),
+            _edit(20, _vlan("twenty", untagged=_mask(1, 2, 3, 4))),
+            _set_pvid(1, 20),
+            _set_pvid(2, 20),
+            _set_pvid(3, 10),
+            _set_pvid(4, 10),
+            _edit(10, _vlan("ten", untagged=_mask(3, 4))),
+            _edit(20, _vlan("twenty", untagged=_mask(1, 2))),
+        ],
+    ),
+    (
+        # The ports fall back to VLAN 1 before the VLAN which is their PVID is removed
+        "remove a VLAN which is a PVID",
+        ADVANCED,
+        {1: _vlan("Default", untagged=ALL_PORTS_MASK & ~_mask(1, 2)), 10: _vlan("ten", untagged=_mask(1, 2))},
+        {},
+        [
+            _edit(1, _vlan("Default", untagged=ALL_PORTS_MASK)),
+            _set_pvid(1, 1),
+            _set_pvid(2, 1),
+            OperationVLAN(action=ActionVLAN.remove_vlan, vlan_id=10),
+        ],
+    ),
+    (
+        # Changing the mode resets the switch to the default VLAN, the VLANs it had before do not matter
+        "change the mode",
+        ModeVLAN.basic_port_based_vlan,
+        {1: _vlan("Default", untagged=ALL_PORTS_MASK & ~_mask(7)), 7: _vlan("seven", untagged=_mask(7))},
+        {10: _vlan("ten", untagged=_mask(1), tagged=_mask(2))},
+        [
+            OperationVLAN(action=ActionVLAN.set_mode, mode=ADVANCED),
+            OperationVLAN(action=ActionVLAN.add_vlan, vlan_id=10,
+                          vlan_obj=_vlan("ten", untagged=_mask(1), tagged=_mask(2))),
+            _set_pvid(1, 10),
+            _edit(1, _vlan("Default", untagged=ALL_PORTS_MASK & ~_mask(1))),
+        ],
+    ),
+]
+
+
+class TestPlanVLANs(unittest.TestCase):
+    def test_operations(self):
+        for name, current_mode, current_vlans, new_vlans, expected in PLAN_CASES:
+            with self.subTest(name):
+                operations, _ = plan_vlans(current_mode=current_mode, current_vlans=current_vlans,
+                                           current_port2vlan_mapping=_port2vlan(current_vlans),
+                                           new_vlans=new_vlans)
+                self.assertEqual([f"{operation}" for operation in operations],
+                                 [f"{operation}" for operation in expected])
+                self.assertEqual(operations, expected)
+
+    def test_inputs_are_not_changed(self):
+        for name, current_mode, current_vlans, new_vlans, _ in PLAN_CASES:
+            with self.subTest(name):
+                current_port2vlan_mapping = _port2vlan(current_vlans)
+                current_copy, mapping_copy, new_copy = dict(current_vlans), _port2vlan(current_vlans), dict(new_vlans)
+                plan_vlans(current_mode=current_mode, current_vlans=current_vlans,
+                           current_port2vlan_mapping=current_port2vlan_mapping, new_vlans=new_vlans)
+                self.assertEqual((current_vlans, current_port2vlan_mapping, new_vlans),
+                                 (current_copy, mapping_copy, new_copy))
+
+
+if __name__ == "__main__":
+    unittest.main()
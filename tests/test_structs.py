@@ -0,0 +1,25 @@
+import copy
+import pickle
+import unittest
+
+from lib.vlan.structs import AccessVLAN, ObjVLAN
+
+
+class TestObjVLAN(unittest.TestCase):
+    def test_copy_and_pickle(self):
+        vlan_obj = ObjVLAN(name="ten", ports_access={1: "tagged", 2: "untagged"})
+        for name, copied in [("copy", copy.copy(vlan_obj)), ("deepcopy", copy.deepcopy(vlan_obj)),
+                             ("pickle", pickle.loads(pickle.dumps(vlan_obj)))]:
+            with self.subTest(name):
+                self.assertIs(type(copied), ObjVLAN)
+                self.assertEqual(copied, vlan_obj)
+
+    def test_ports_access_is_read_only(self):
+        vlan_obj = ObjVLAN(name="ten", ports_access={1: "tagged", 2: "untagged"})
+        self.assertEqual(dict(vlan_obj.ports_access), {1: AccessVLAN.tagged, 2: AccessVLAN.untagged})
+        with self.assertRaises(TypeError):
+            vlan_obj.ports_access[3] = AccessVLAN.untagged
+
+
+if __name__ == "__main__":
+    unittest.main()